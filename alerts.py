@@ -1,83 +1,91 @@
-from pymongo import MongoClient
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 from dotenv import load_dotenv
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import time
 
-# Load environment variables
+# Load .env before the modules below read their settings from the environment
 load_dotenv()
 
-# MongoDB connection
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client.library_db
+from mail_queue import SMTPSession, smtp_settings_from_env
+from scheduler import Scheduler, LeaseLost, check_lease
+from stats import rebuild_stats
+from departments import rebuild_departments
+from loan_archive import archive_returned_loans
+from database import db
+from repositories import LoanRepository
+from metrics import Counter, operation_duration, serve as serve_metrics
+
+# MongoDB connection, configured in database.py and shared with the web app
+loan_repository = LoanRepository(db)
 
 # Email configuration
-SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
-SMTP_USERNAME = os.getenv('SMTP_USERNAME')
-SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
+SMTP_SETTINGS = smtp_settings_from_env()
+
+# Number of parallel SMTP connections used to send alerts
+ALERT_WORKERS = int(os.getenv('ALERT_WORKERS', '8'))
+
+# Seconds between overdue checks, plus up to CHECK_JITTER random seconds
+CHECK_INTERVAL = int(os.getenv('OVERDUE_CHECK_INTERVAL', '300'))
+CHECK_JITTER = int(os.getenv('OVERDUE_CHECK_JITTER', '30'))
+
+# Seconds between full recounts of the dashboard statistics and department registry
+STATS_REPAIR_INTERVAL = int(os.getenv('STATS_REPAIR_INTERVAL', '86400'))
+
+# Seconds between moves of old returned loans into loan_history
+LOAN_ARCHIVE_INTERVAL = int(os.getenv('LOAN_ARCHIVE_INTERVAL', '3600'))
+
+# How long to wait before reminding a borrower about the same overdue loan again
+REMINDER_INTERVAL = timedelta(hours=float(os.getenv('OVERDUE_REMINDER_HOURS', '24')))
+
+# Port for the /metrics endpoint of this process; unset to disable it
+METRICS_PORT = os.getenv('ALERTS_METRICS_PORT')
+
+overdue_alerts = Counter('overdue_alert_emails_total', 'Overdue alert emails by result', ('result',))
+overdue_books = Counter('overdue_books_notified_total', 'Overdue loans covered by alert emails')
+
+# Each dispatcher thread keeps its own SMTP connection open for the whole run
+thread_state = threading.local()
+open_sessions = []
+open_sessions_lock = threading.Lock()
+
+def get_smtp_session():
+    """Return this thread's SMTP session, creating it on first use"""
+    session = getattr(thread_state, 'session', None)
+    if session is None:
+        session = SMTPSession(**SMTP_SETTINGS)
+        thread_state.session = session
+        with open_sessions_lock:
+            open_sessions.append(session)
+    return session
+
+def close_smtp_sessions():
+    """Close the SMTP connections opened by the dispatcher threads"""
+    with open_sessions_lock:
+        for session in open_sessions:
+            session.close()
+        open_sessions.clear()
 
 def send_email(subject, body, to_email):
-    """Send email using SMTP"""
+    """Send email over this thread's reusable SMTP session"""
     try:
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_USERNAME
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(body, 'html'))
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
+        get_smtp_session().send(subject, body, to_email)
         return True
     except Exception as e:
         print(f"Error sending email: {str(e)}")
+        get_smtp_session().close()
         return False
 
-def check_overdue_books():
-    """Check for overdue books and send email notifications"""
-    try:
-        # Get current date
-        current_date = datetime.now()
-        
-        # Find all borrowed books that are overdue
-        overdue_books = list(db.borrowed_books.find({
-            'status': 'borrowed',
-            'return_date': {'$lt': current_date}
-        }))
-        
-        # Group overdue books by user
-        user_overdue_books = {}
-        for book in overdue_books:
-            user_id = book['user_id']
-            if user_id not in user_overdue_books:
-                user_overdue_books[user_id] = []
-            user_overdue_books[user_id].append(book)
-        
-        # Send email to each user with their overdue books
-        for user_id, books in user_overdue_books.items():
-            # Get user details
-            user = db.users.find_one({'userId': user_id})
-            if not user or not user.get('email'):
-                continue
-            
-            # Calculate days overdue for each book
-            for book in books:
-                days_overdue = (current_date - book['return_date']).days
-                book['days_overdue'] = days_overdue
-                book['estimated_penalty'] = days_overdue * 5  # Rs. 5 per day penalty
-            
-            # Prepare email content
-            email_subject = "Overdue Books Alert - Library Management System"
-            email_body = f"""
+def overdue_users(current_date):
+    """Users with loans due for a reminder, with their name, email and overdue books"""
+    return loan_repository.due_for_reminder(current_date)
+
+def build_overdue_email(user, current_date):
+    """Prepare the overdue alert email body for one user"""
+    email_body = f"""
             <h2>Overdue Books Alert</h2>
-            <p>Dear {user.get('name', 'User')},</p>
+            <p>Dear {user.get('name') or 'User'},</p>
             <p>This is a reminder that you have the following overdue books:</p>
             <table style="width: 100%; border-collapse: collapse; margin: 20px 0;">
                 <tr style="background-color: #f3f4f6;">
@@ -87,60 +95,130 @@ def check_overdue_books():
                     <th style="padding: 10px; text-align: left; border: 1px solid #e5e7eb;">Estimated Penalty</th>
                 </tr>
             """
-            
-            for book in books:
-                email_body += f"""
+    
+    for book in user['books']:
+        # Calculate days overdue for each book
+        days_overdue = (current_date - book['return_date']).days
+        estimated_penalty = days_overdue * 5  # Rs. 5 per day penalty
+        email_body += f"""
                 <tr>
                     <td style="padding: 10px; border: 1px solid #e5e7eb;">{book['book_title']}</td>
                     <td style="padding: 10px; border: 1px solid #e5e7eb;">{book['return_date'].strftime('%Y-%m-%d')}</td>
-                    <td style="padding: 10px; border: 1px solid #e5e7eb;">{book['days_overdue']} days</td>
-                    <td style="padding: 10px; border: 1px solid #e5e7eb;">Rs. {book['estimated_penalty']}</td>
+                    <td style="padding: 10px; border: 1px solid #e5e7eb;">{days_overdue} days</td>
+                    <td style="padding: 10px; border: 1px solid #e5e7eb;">Rs. {estimated_penalty}</td>
                 </tr>
                 """
-            
-            email_body += """
+    
+    email_body += """
             </table>
             <p><strong>Please return these books as soon as possible to avoid additional penalties.</strong></p>
             <p>If you have already returned the books, please ignore this email.</p>
             <p>Best regards,<br>Library Management System Team</p>
             """
-            
-            # Send email
-            send_email(email_subject, email_body, user['email'])
-            print(f"Sent overdue alert email to {user['email']}")
+    return email_body
+
+def record_reminder(user, current_date):
+    """Push the next reminder for the user's notified loans one interval into the future"""
+    loan_repository.record_reminder([book['loan_id'] for book in user['books']], current_date,
+                                    current_date + REMINDER_INTERVAL)
+
+def send_overdue_alert(user, current_date):
+    """Send one user their overdue alert; returns True if the email was sent"""
+    email_subject = "Overdue Books Alert - Library Management System"
+    if not send_email(email_subject, build_overdue_email(user, current_date), user['email']):
+        # Leave next_reminder_at alone so the next run retries
+        return False
+    record_reminder(user, current_date)
+    return True
+
+def check_overdue_books():
+    """Check for overdue books and send email notifications
+
+    Returns the metrics of the run: users processed, emails sent and failed,
+    overdue books covered, duration and send rate.
+    """
+    metrics = {
+        'users': 0,
+        'emails_sent': 0,
+        'emails_failed': 0,
+        'overdue_books': 0,
+        'duration_seconds': 0.0,
+        'emails_per_second': 0.0
+    }
+    start = time.perf_counter()
+    try:
+        # Get current date
+        current_date = datetime.now()
         
-        return len(overdue_books)
+        # Send alerts in parallel, each worker thread reusing one SMTP connection
+        with ThreadPoolExecutor(max_workers=ALERT_WORKERS, thread_name_prefix='overdue-alert') as executor:
+            futures = []
+            for user in overdue_users(current_date):
+                # Stop queueing alerts if another worker took over the job
+                check_lease()
+                metrics['users'] += 1
+                metrics['overdue_books'] += len(user['books'])
+                futures.append(executor.submit(send_overdue_alert, user, current_date))
+            for future in as_completed(futures):
+                if future.result():
+                    metrics['emails_sent'] += 1
+                else:
+                    metrics['emails_failed'] += 1
     
+    except LeaseLost:
+        raise
     except Exception as e:
         print(f"Error in check_overdue_books: {str(e)}")
-        return 0
+    finally:
+        close_smtp_sessions()
+    
+    metrics['duration_seconds'] = round(time.perf_counter() - start, 3)
+    if metrics['duration_seconds'] > 0:
+        metrics['emails_per_second'] = round(metrics['emails_sent'] / metrics['duration_seconds'], 1)
+    return metrics
+
+def run_overdue_check():
+    """Scheduled job: check for overdue books and report the run's metrics"""
+    # Get current time
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"\n[{current_time}] Checking for overdue books...")
+    
+    # Run the check
+    metrics = check_overdue_books()
+    operation_duration.observe(metrics['duration_seconds'], operation='overdue_check')
+    overdue_alerts.inc(metrics['emails_sent'], result='sent')
+    overdue_alerts.inc(metrics['emails_failed'], result='failed')
+    overdue_books.inc(metrics['overdue_books'])
+    print(f"Found {metrics['overdue_books']} overdue books for {metrics['users']} users")
+    print(f"Sent {metrics['emails_sent']} emails ({metrics['emails_failed']} failed) "
+          f"in {metrics['duration_seconds']}s, {metrics['emails_per_second']} emails/sec")
+
+def run_loan_archive():
+    """Scheduled job: move old returned loans out of borrowed_books"""
+    summary = archive_returned_loans(db)
+    if summary['archived']:
+        print(f"Archived {summary['archived']} returned loans in {summary['duration_seconds']}s")
+
+def create_scheduler():
+    """Scheduler hosting the overdue check and other periodic maintenance jobs"""
+    scheduler = Scheduler(db)
+    scheduler.add_job('overdue_check', run_overdue_check, interval=CHECK_INTERVAL, jitter=CHECK_JITTER)
+    scheduler.add_job('stats_repair', lambda: rebuild_stats(db), interval=STATS_REPAIR_INTERVAL, jitter=60)
+    scheduler.add_job('departments_repair', lambda: rebuild_departments(db), interval=STATS_REPAIR_INTERVAL, jitter=60)
+    scheduler.add_job('loan_archive', run_loan_archive, interval=LOAN_ARCHIVE_INTERVAL, jitter=60)
+    return scheduler
 
 def run_continuous_check():
-    """Run the overdue books check continuously every 5 minutes"""
-    print("Starting continuous overdue books check...")
+    """Run the overdue books check, and any other scheduled jobs, until stopped"""
+    print("Starting scheduled overdue books check...")
     print("Press Ctrl+C to stop the script")
+    if METRICS_PORT:
+        serve_metrics(int(METRICS_PORT))
+        print(f"Serving metrics on port {METRICS_PORT}")
     
-    while True:
-        try:
-            # Get current time
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            print(f"\n[{current_time}] Checking for overdue books...")
-            
-            # Run the check
-            overdue_count = check_overdue_books()
-            print(f"Found {overdue_count} overdue books")
-            
-            # Wait for 5 minutes before next check
-            print("Waiting 5 minutes before next check...")
-            time.sleep(300)  # 300 seconds = 5 minutes
-            
-        except KeyboardInterrupt:
-            print("\nStopping the continuous check...")
-            break
-        except Exception as e:
-            print(f"Error in continuous check: {str(e)}")
-            print("Waiting 5 minutes before retrying...")
-            time.sleep(300)
+    scheduler = create_scheduler()
+    scheduler.run_forever()
+    print("\nStopped the scheduled jobs")
 
 if __name__ == "__main__":
-    run_continuous_check() 
\ No newline at end of file
+    run_continuous_check()
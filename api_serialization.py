@@ -0,0 +1,76 @@
+from flask import Response
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from datetime import datetime
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Fields each API endpoint returns. Projections are built from these lists, so
+# passwords, search tokens and any field added later are never loaded for the API.
+USER_FIELDS = ('userId', 'name', 'email', 'role', 'department', 'active_loans', 'total_penalty', 'created_at')
+BOOK_FIELDS = ('title', 'author', 'isbn', 'department', 'book_count', 'borrowed_count', 'available_copies',
+               'cover_image', 'status', 'created_at')
+
+# Cursors with these options return documents as undecoded BSON bytes
+RAW_BSON = CodecOptions(document_class=RawBSONDocument)
+
+
+def api_projection(fields, requested=None):
+    """Inclusion projection for an endpoint's fields
+
+    requested is a comma separated `fields` parameter; it narrows the
+    projection to the named fields the endpoint returns, and other names are
+    ignored. _id is always included.
+    """
+    names = [name.strip() for name in (requested or '').split(',') if name.strip() in fields]
+    return {name: 1 for name in names or fields}
+
+
+def api_document(document, fields):
+    """A document just written, trimmed to what the endpoint's GET returns: _id and its fields
+
+    Search tokens, the normalized ISBN and any extra fields sent by the client
+    are stored but never echoed.
+    """
+    return {name: document[name] for name in ('_id',) + tuple(fields) if name in document}
+
+
+def json_default(value):
+    """Encoder fallback for BSON types; orjson handles datetimes itself"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+# Shared stdlib encoder for when orjson is not installed
+encoder = json.JSONEncoder(default=json_default, separators=(',', ':'), ensure_ascii=False)
+
+
+def dumps(value):
+    """Encode documents straight from the cursor, ObjectIds and datetimes included, to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default)
+    return encoder.encode(value).encode()
+
+
+def json_response(value, status=200):
+    return Response(dumps(value), status=status, mimetype='application/json')
+
+
+def ndjson_stream(cursor):
+    """Yield one JSON line per document without materializing the cursor"""
+    for document in cursor:
+        yield dumps(document) + b'\n'
+
+
+def bson_stream(cursor):
+    """Yield the stored bytes of each document from a RAW_BSON cursor, without decoding them"""
+    for document in cursor:
+        yield document.raw
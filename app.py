@@ -1,19 +1,34 @@
-from flask import Flask, request, render_template, jsonify, current_app, redirect, url_for, session
+from flask import Flask, request, render_template, current_app, redirect, url_for, session, Response, stream_with_context
 from flask_cors import CORS
-from pymongo import MongoClient
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 import os
 from dotenv import load_dotenv
+
+# Load .env before the modules below read their settings from the environment
+load_dotenv()
+
 from werkzeug.utils import secure_filename
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from mail_queue import MailQueue, OUTBOX_COLLECTION
+from migrations import migrate, UniqueIndexError
+from catalog_search import search_fields, SEARCH_PER_PAGE
+from catalog_import import import_catalog, detect_format, summary_email, new_book_email
+from user_import import import_users, generate_password, credentials_email
+from images import store_upload, cover_url, normalize_key
+from storage import get_storage, IMMUTABLE_CACHE_CONTROL
+from pagination import parse_limit, DEFAULT_LIMIT
+from api_serialization import api_projection, api_document, json_response, ndjson_stream, bson_stream, USER_FIELDS, BOOK_FIELDS
+from repositories import UserRepository, BookRepository, LoanRepository, availability_update, duplicate_user_error, parse_book_count, \
+    DUPLICATE_ISBN_ERROR, LISTING_SORTS, AVAILABLE_BOOKS_QUERY
+import stats
+import http_cache
+import departments
+import metrics
+import circulation
+from database import db, collection_proxy, close_client
+from circulation import CirculationError
 from datetime import datetime
 from functools import wraps
-import random
-import string
-
-load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')  # Required for session management
@@ -21,26 +36,64 @@ app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')  # Required for
 # Configure CORS to allow all origins
 CORS(app, resources={r"/api/*": {"origins": "*"}})
 
-# MongoDB connection
-client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'))
-db = client.library_db
+# Compress large JSON and HTML responses
+http_cache.init_app(app)
+
+# Route timings and MongoDB command counts, served at /metrics
+metrics.init_app(app)
+
+# MongoDB connection; `db` resolves to a client owned by the current process (see database.py)
+AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'true').lower() == 'true'
+
+# Queries go through the repositories, which own projections, retries and timing
+user_repository = UserRepository(db)
+book_repository = BookRepository(db)
+loan_repository = LoanRepository(db)
 
 # Email configuration
-SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
-SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
-SMTP_USERNAME = os.getenv('SMTP_USERNAME')
-SMTP_PASSWORD = os.getenv('SMTP_PASSWORD')
 ADMIN_EMAIL = os.getenv('ADMIN_EMAIL')
 
+# Outbound email is queued in MongoDB and sent by a background worker
+mail_queue = MailQueue(collection_proxy(OUTBOX_COLLECTION))
+MAIL_WORKER_ENABLED = os.getenv('MAIL_WORKER_ENABLED', 'true').lower() == 'true'
+
 # File upload configuration
 UPLOAD_FOLDER = 'static/uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Borrowed books listing
+BORROWED_BOOKS_PER_PAGE = 50
+# Sorts with a (field, _id) index; see repositories.LISTING_SORTS
+BORROWED_BOOKS_SORT_FIELDS = set(LISTING_SORTS)
+
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Cover images live in static/ by default, or in an S3-compatible bucket (STORAGE_BACKEND=s3)
+storage = get_storage(app.static_folder)
+
+def covers_changed():
+    """Variants were stored in the background; cached pages still link to the original"""
+    http_cache.bump(db, 'books')
+
+@app.template_filter('cover')
+def cover_filter(cover_image, variant=None):
+    """URL of a cover or its resized variant, e.g. book.cover_image|cover('thumb')"""
+    url = cover_url(storage, cover_image, variant)
+    if variant and cover_image and url == storage.url(normalize_key(cover_image)):
+        # The variant is still being generated; do not keep a page pointing at the original
+        http_cache.uncacheable()
+    return url
+
+@app.after_request
+def cache_uploads(response):
+    # Uploaded covers are content-addressed, so a URL always refers to the same bytes
+    if request.path.startswith('/static/uploads/') and response.status_code == 200:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
+
 # Helper function to convert ObjectId to string
 def serialize_id(obj):
     if isinstance(obj, ObjectId):
@@ -51,22 +104,12 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def send_email(subject, body, to_email):
+    """Queue an email for the background mail worker"""
     try:
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_USERNAME
-        msg['To'] = to_email
-        msg['Subject'] = subject
-
-        msg.attach(MIMEText(body, 'html'))
-
-        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT)
-        server.starttls()
-        server.login(SMTP_USERNAME, SMTP_PASSWORD)
-        server.send_message(msg)
-        server.quit()
-        return True
+        with metrics.track('email_enqueue'):
+            return mail_queue.enqueue(subject, body, to_email)
     except Exception as e:
-        print(f"Error sending email: {str(e)}")
+        print(f"Error queueing email: {str(e)}")
         return False
 
 # Login required decorator
@@ -78,6 +121,61 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def book_list_context(query=None, after=None, endpoint='books'):
+    """Fetch one keyset page of books prepared for the book list templates"""
+    books, next_cursor = book_repository.page(query, after)
+    for book in books:
+        book['_id'] = str(book['_id'])
+        # Convert backslashes to forward slashes for cover_image paths
+        if book.get('cover_image'):
+            book['cover_image'] = book['cover_image'].replace('\\', '/')
+    return {'books': books, 'next_cursor': next_cursor, 'list_endpoint': endpoint}
+
+def book_search_context(query, search, page):
+    """Fetch one page of ranked search results prepared for the book list templates"""
+    books, total = book_repository.search(search, query, page)
+    for book in books:
+        book['_id'] = str(book['_id'])
+        if book.get('cover_image'):
+            book['cover_image'] = book['cover_image'].replace('\\', '/')
+    total_pages = max((total + SEARCH_PER_PAGE - 1) // SEARCH_PER_PAGE, 1)
+    return {'books': books, 'page': page, 'total_pages': total_pages}
+
+def lend_books_context(after=None):
+    """Fetch one keyset page of lendable books for the lend books template"""
+    return book_list_context(AVAILABLE_BOOKS_QUERY, after, 'lend_book')
+
+def user_list_context(after=None):
+    """Fetch one keyset page of users (without passwords) for the user list templates"""
+    users, next_cursor = user_repository.page(after=after)
+    for user in users:
+        user['_id'] = str(user['_id'])
+    return {'users': users, 'next_cursor': next_cursor, 'list_endpoint': 'users'}
+
+def paginated_api_response(repository, fields, query=None):
+    """Serve a repository's collection as keyset-paginated JSON, or stream it all as NDJSON or BSON"""
+    # Only the endpoint's own fields are loaded; `fields` can narrow them further
+    projection = api_projection(fields, request.args.get('fields'))
+    
+    # Exports stream every matching document straight from the cursor
+    export_format = request.args.get('format')
+    if export_format == 'ndjson':
+        cursor = repository.export(query, projection)
+        return Response(stream_with_context(ndjson_stream(cursor)), mimetype='application/x-ndjson')
+    if export_format == 'bson':
+        # Documents are passed through as the bytes MongoDB sent, one after another
+        cursor = repository.export(query, projection, raw=True)
+        return Response(stream_with_context(bson_stream(cursor)), mimetype='application/bson')
+    
+    limit = parse_limit(request.args.get('limit'), DEFAULT_LIMIT)
+    documents, next_cursor = repository.page(query, request.args.get('after'), limit, projection)
+    response = json_response(documents)
+    if next_cursor:
+        # The body stays a plain list; the next page is advertised in headers
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{url_for(request.endpoint, **dict(request.args.to_dict(), after=next_cursor))}>; rel="next"'
+    return response
+
 # Login route
 @app.route("/login", methods=['GET', 'POST'])
 def login():
@@ -92,7 +190,7 @@ def login():
             return redirect(url_for('admin_dashboard'))
         
         # Find user in database
-        user = db.users.find_one({'userId': user_id})
+        user = user_repository.find_for_login(user_id)
         
         if user and user.get('password') == password:
             session['user_id'] = user_id
@@ -125,11 +223,12 @@ def public_index():
 def admin_dashboard():
     try:
         # Get counts for dashboard
-        users_count = db.users.count_documents({})
-        books_count = db.books.count_documents({})
+        library_stats = stats.get_stats(db)
+        users_count = library_stats.get('users_total', 0)
+        books_count = library_stats.get('books_total', 0)
         
         # Get recently added books (last 5)
-        recent_books = list(db.books.find().sort('created_at', -1).limit(5))
+        recent_books = book_repository.recent(5)
         for book in recent_books:
             book['_id'] = str(book['_id'])
             if book.get('cover_image'):
@@ -176,23 +275,19 @@ def get_pages():
             "icon": "fas fa-book-medical"
         }
     ]
-    return jsonify(pages)
+    return json_response(pages)
 
 @app.route('/users')
 def users():
     try:
-        # Get all users from the database
-        users = list(db.users.find())
-        
-        # Convert ObjectId to string for each user
-        for user in users:
-            user['_id'] = str(user['_id'])
+        # Get one page of users from the database
+        context = user_list_context(request.args.get('after'))
         
         # Check user role and render appropriate template
         if session.get('role') == 'admin':
-            return render_template('users.html', users=users)
+            return render_template('users.html', **context)
         else:
-            return render_template('staff_users.html', users=users)
+            return render_template('staff_users.html', **context)
             
     except Exception as e:
         print(f"Error in users route: {str(e)}")
@@ -201,11 +296,9 @@ def users():
 @app.route("/api/users")
 def get_users():
     try:
-        users = list(db.users.find())
-        users = [{**user, '_id': serialize_id(user['_id'])} for user in users]
-        return jsonify(users)
+        return paginated_api_response(user_repository, USER_FIELDS)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route("/add_user")
 @login_required
@@ -213,6 +306,7 @@ def add_user():
     return render_template("add_user.html")
 
 @app.route('/books')
+@http_cache.cached(db, 'books', window=storage.url_window)
 def books():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -221,78 +315,57 @@ def books():
         # Get filter parameters
         department = request.args.get('department')
         search = request.args.get('search')
+        page = max(request.args.get('page', 1, type=int), 1)
         
         # Build query
         query = {}
         if department:
             query['department'] = department
-            
-        if search:
-            query['$or'] = [
-                {'title': {'$regex': search, '$options': 'i'}},
-                {'author': {'$regex': search, '$options': 'i'}},
-                {'isbn': {'$regex': search, '$options': 'i'}}
-            ]
-        
-        # Get books from database
-        books = list(db.books.find(query))
         
-        # Convert ObjectId to string for JSON serialization
-        for book in books:
-            book['_id'] = str(book['_id'])
-            # Convert backslashes to forward slashes for cover_image paths
-            if 'cover_image' in book and book['cover_image']:
-                book['cover_image'] = book['cover_image'].replace('\\', '/')
+        # Get books from database; searches are ranked and paged by number,
+        # plain listings are paged by _id
+        if search:
+            context = book_search_context(query, search, page)
+        else:
+            context = book_list_context(query, request.args.get('after'))
         
-        # Get unique departments for filter dropdown
-        departments = sorted(db.books.distinct('department'))
+        # Departments with their title counts for the filter dropdown, kept in memory
+        department_list = departments.get_departments(db)
         
         # Get user role
         user_role = session.get('role')
         
         # Render appropriate template based on user role
-        if user_role == 'admin':
-            return render_template('books.html', books=books, departments=departments)
-        else:
-            return render_template('staff_books.html', books=books, departments=departments)
+        template = 'books.html' if user_role == 'admin' else 'staff_books.html'
+        return render_template(template, departments=department_list, **context)
             
     except Exception as e:
         print(f"Error in books route: {str(e)}")
         return render_template('books.html', books=[], departments=[], error="An error occurred while fetching books.")
 
 @app.route("/api/books")
+@http_cache.cached(db, 'books')
 def get_books():
     try:
-        books = list(db.books.find())
-        books = [{**book, '_id': serialize_id(book['_id'])} for book in books]
-        return jsonify(books)
+        return paginated_api_response(book_repository, BOOK_FIELDS)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
+
+@app.route("/api/books/suggest")
+def api_suggest_books():
+    try:
+        return json_response(book_repository.suggest(request.args.get('q', '')))
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
 
 @app.route("/add_book")
 @login_required
 def add_book():
     return render_template("add_book.html")
 
-def generate_password(length=8):
-    """Generate a random password with letters, numbers, and special characters"""
-    characters = string.ascii_letters + string.digits + string.punctuation
-    return ''.join(random.choice(characters) for _ in range(length))
-
 def send_user_credentials(user_data, password):
     """Send user credentials via email"""
-    subject = "Your Library Management System Account"
-    body = f"""
-    <h2>Welcome to Library Management System</h2>
-    <p>Dear {user_data['name']},</p>
-    <p>Your account has been created successfully. Here are your login credentials:</p>
-    <ul>
-        <li><strong>User ID:</strong> {user_data['userId']}</li>
-        <li><strong>Password:</strong> {password}</li>
-    </ul>
-    <p>Please change your password after your first login for security purposes.</p>
-    <p>Best regards,<br>Library Management System Team</p>
-    """
+    subject, body = credentials_email(user_data, password)
     return send_email(subject, body, user_data['email'])
 
 # User Management Routes
@@ -315,25 +388,21 @@ def create_user():
         for field in required_fields:
             if not user_data[field]:
                 return render_template("add_user.html", error=f"Missing required field: {field}")
+        if user_data['role'] not in stats.ROLES:
+            return render_template("add_user.html", error=f"Unknown role: {user_data['role']}")
             
-        # Check if user with same userId already exists
-        existing_user = db.users.find_one({'userId': user_data['userId']})
-        if existing_user:
-            return render_template("add_user.html", error="User with this ID already exists")
-            
-        # Check if user with same email already exists
-        existing_email = db.users.find_one({'email': user_data['email']})
-        if existing_email:
-            return render_template("add_user.html", error="User with this email already exists")
-            
-        # Insert the user
-        db.users.insert_one(user_data)
+        # Insert the user; unique indexes on userId and email reject duplicates
+        try:
+            user_repository.create(user_data)
+        except DuplicateKeyError as e:
+            return render_template("add_user.html", error=duplicate_user_error(e))
+        stats.user_added(db, user_data['role'])
         
         # Send email with credentials
         if send_user_credentials(user_data, password):
-            return render_template("users.html", users=list(db.users.find()), message="User added successfully! Credentials sent to user's email.")
+            return render_template("users.html", **user_list_context(), message="User added successfully! Credentials will be emailed to the user.")
         else:
-            return render_template("users.html", users=list(db.users.find()), message="User added successfully! But failed to send email credentials.")
+            return render_template("users.html", **user_list_context(), message="User added successfully! But failed to queue the credentials email.")
             
     except Exception as e:
         print(f"Error in create_user: {str(e)}")
@@ -351,24 +420,20 @@ def api_create_user():
         # Validate required fields
         for field in required_fields:
             if not user_data.get(field):
-                return jsonify({"error": f"Missing required field: {field}"}), 400
-            
-        # Check if user with same userId already exists
-        existing_user = db.users.find_one({'userId': user_data['userId']})
-        if existing_user:
-            return jsonify({"error": "User with this ID already exists"}), 400
-            
-        # Check if user with same email already exists
-        existing_email = db.users.find_one({'email': user_data['email']})
-        if existing_email:
-            return jsonify({"error": "User with this email already exists"}), 400
+                return json_response({"error": f"Missing required field: {field}"}, 400)
+        if user_data['role'] not in stats.ROLES:
+            return json_response({"error": f"Unknown role: {user_data['role']}"}, 400)
             
         # Add password to user data
         user_data['password'] = password
         
-        # Insert the user
-        result = db.users.insert_one(user_data)
-        user_data['_id'] = serialize_id(result.inserted_id)
+        # Insert the user; unique indexes on userId and email reject duplicates
+        try:
+            inserted_id = user_repository.create(user_data)
+        except DuplicateKeyError as e:
+            return json_response({"error": duplicate_user_error(e)}, 400)
+        stats.user_added(db, user_data['role'])
+        user_data['_id'] = serialize_id(inserted_id)
         
         # Send email with credentials
         email_sent = send_user_credentials(user_data, password)
@@ -379,32 +444,56 @@ def api_create_user():
             "email_sent": email_sent
         }
         
-        return jsonify(response_data), 201
+        return json_response(response_data, 201)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+@app.route('/users/import', methods=['POST'])
+@login_required
+def import_user_roster():
+    try:
+        roster = request.files.get('file')
+        if not roster or not roster.filename:
+            return render_template("add_user.html", error="No file uploaded")
+        summary = import_users(db, roster.stream, mail_queue)
+        message = (f"Imported roster: {summary['created']} created, {summary['skipped']} skipped, "
+                   f"{summary['failed']} failed. Credentials will be emailed to the new users.")
+        return render_template("users.html", **user_list_context(), message=message)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        print(f"Error in import_user_roster: {str(e)}")
+        return render_template("add_user.html", error=str(e))
+
+@app.route('/api/users/import', methods=['POST'])
+def api_import_users():
+    try:
+        roster = request.files.get('file')
+        if not roster or not roster.filename:
+            return json_response({"error": "No file uploaded"}, 400)
+        return json_response(import_users(db, roster.stream, mail_queue))
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/users/<user_id>', methods=['GET'])
 def get_user(user_id):
     try:
-        user = db.users.find_one({'_id': ObjectId(user_id)})
+        user = user_repository.get(user_id)
         if user:
             user['_id'] = serialize_id(user['_id'])
             return render_template("edit_user.html", user=user)
-        return render_template("users.html", users=list(db.users.find()), error="User not found")
+        return render_template("users.html", **user_list_context(), error="User not found")
     except Exception as e:
         print(f"Error in get_user: {str(e)}")
-        return render_template("users.html", users=list(db.users.find()), error=str(e))
+        return render_template("users.html", **user_list_context(), error=str(e))
 
 @app.route('/api/users/<user_id>', methods=['GET'])
 def api_get_user(user_id):
     try:
-        user = db.users.find_one({'_id': ObjectId(user_id)})
+        user = user_repository.get(user_id, api_projection(USER_FIELDS))
         if user:
-            user['_id'] = serialize_id(user['_id'])
-            return jsonify(user)
-        return jsonify({"error": "User not found"}), 404
+            return json_response(user)
+        return json_response({"error": "User not found"}, 404)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/users/<user_id>/edit', methods=['POST'])
 def update_user(user_id):
@@ -421,6 +510,8 @@ def update_user(user_id):
         for field in required_fields:
             if not user_data[field]:
                 return render_template("edit_user.html", user=user_data, error=f"Missing required field: {field}")
+        if user_data['role'] not in stats.ROLES:
+            return render_template("edit_user.html", user=user_data, error=f"Unknown role: {user_data['role']}")
         
         # Check if new password is provided
         new_password = request.form.get('password')
@@ -441,18 +532,16 @@ def update_user(user_id):
             """
             send_email(email_subject, email_body, user_data['email'])
         
-        # Update the user
-        result = db.users.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': user_data}
-        )
+        # Update the user, keeping the per-role counters in step
+        previous = user_repository.update(user_id, user_data)
         
-        if result.modified_count:
+        if previous:
+            stats.user_role_changed(db, previous.get('role'), user_data['role'])
             return redirect('/users')
-        return render_template("users.html", users=list(db.users.find()), error="User not found")
+        return render_template("users.html", **user_list_context(), error="User not found")
     except Exception as e:
         print(f"Error in update_user: {str(e)}")
-        return render_template("users.html", users=list(db.users.find()), error=str(e))
+        return render_template("users.html", **user_list_context(), error=str(e))
 
 @app.route('/api/users/<user_id>/edit', methods=['PUT'])
 def api_update_user(user_id):
@@ -463,41 +552,43 @@ def api_update_user(user_id):
         # Validate required fields
         for field in required_fields:
             if not user_data.get(field):
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+                return json_response({"error": f"Missing required field: {field}"}, 400)
+        if user_data['role'] not in stats.ROLES:
+            return json_response({"error": f"Unknown role: {user_data['role']}"}, 400)
         
-        # Update the user
-        result = db.users.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': user_data}
-        )
+        # Update the user, keeping the per-role counters in step
+        previous = user_repository.update(user_id, user_data)
         
-        if result.modified_count:
+        if previous:
+            stats.user_role_changed(db, previous.get('role'), user_data['role'])
             user_data['_id'] = user_id
-            return jsonify({"message": "User updated successfully", "user": user_data})
-        return jsonify({"error": "User not found"}), 404
+            return json_response({"message": "User updated successfully", "user": user_data})
+        return json_response({"error": "User not found"}, 404)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/users/<user_id>/delete', methods=['POST'])
 def delete_user(user_id):
     try:
-        result = db.users.delete_one({'_id': ObjectId(user_id)})
-        if result.deleted_count:
-            return render_template("users.html", users=list(db.users.find()), message="User deleted successfully!")
-        return render_template("users.html", users=list(db.users.find()), error="User not found")
+        deleted = user_repository.delete(user_id)
+        if deleted:
+            stats.user_removed(db, deleted.get('role'))
+            return render_template("users.html", **user_list_context(), message="User deleted successfully!")
+        return render_template("users.html", **user_list_context(), error="User not found")
     except Exception as e:
         print(f"Error in delete_user: {str(e)}")
-        return render_template("users.html", users=list(db.users.find()), error=str(e))
+        return render_template("users.html", **user_list_context(), error=str(e))
 
 @app.route('/api/users/<user_id>/delete', methods=['DELETE'])
 def api_delete_user(user_id):
     try:
-        result = db.users.delete_one({'_id': ObjectId(user_id)})
-        if result.deleted_count:
-            return jsonify({"message": "User deleted successfully"})
-        return jsonify({"error": "User not found"}), 404
+        deleted = user_repository.delete(user_id)
+        if deleted:
+            stats.user_removed(db, deleted.get('role'))
+            return json_response({"message": "User deleted successfully"})
+        return json_response({"error": "User not found"}, 404)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 # Book Management Routes
 @app.route('/books/add', methods=['POST'])
@@ -508,19 +599,15 @@ def create_book():
         cover_image_path = None
         
         if cover_image and allowed_file(cover_image.filename):
-            filename = secure_filename(cover_image.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_filename = f"{timestamp}_{filename}"
-            # Use forward slashes for web paths
-            cover_image_path = os.path.join('uploads', unique_filename).replace('\\', '/')
-            cover_image.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+            # Stored once per unique image; thumbnails are generated in the background
+            cover_image_path = store_upload(cover_image, storage, on_variants=covers_changed)
 
         book_data = {
             'title': request.form.get('title'),
             'author': request.form.get('author'),
             'isbn': request.form.get('isbn'),
             'department': request.form.get('department'),
-            'book_count': int(request.form.get('book_count', 1)),
+            'book_count': request.form.get('book_count', 1),
             'borrowed_count': 0,
             'cover_image': cover_image_path,
             'created_at': datetime.now()
@@ -531,24 +618,24 @@ def create_book():
         for field in required_fields:
             if not book_data[field]:
                 return render_template("add_book.html", error=f"Missing required field: {field}")
+        try:
+            book_data['book_count'] = parse_book_count(book_data['book_count'])
+        except ValueError as e:
+            return render_template("add_book.html", error=str(e))
+        book_data['available_copies'] = book_data['book_count']
         
-        # Insert the book
-        db.books.insert_one(book_data)
+        # Insert the book along with its search fields
+        book_data.update(search_fields(book_data))
+        try:
+            book_repository.create(book_data)
+        except DuplicateKeyError:
+            return render_template("add_book.html", error=DUPLICATE_ISBN_ERROR)
+        stats.book_added(db)
+        departments.book_added(db, book_data)
+        http_cache.bump(db, 'books')
         
         # Send email notification
-        email_subject = "New Book Added to Library"
-        email_body = f"""
-        <h2>New Book Added</h2>
-        <p>A new book has been added to the library:</p>
-        <ul>
-            <li><strong>Title:</strong> {book_data['title']}</li>
-            <li><strong>Author:</strong> {book_data['author']}</li>
-            <li><strong>ISBN:</strong> {book_data['isbn']}</li>
-            <li><strong>Department:</strong> {book_data['department']}</li>
-            <li><strong>Copies:</strong> {book_data['book_count']}</li>
-        </ul>
-        """
-        send_email(email_subject, email_body, ADMIN_EMAIL)
+        send_email(*new_book_email(book_data), ADMIN_EMAIL)
         
         return redirect(url_for('books', message="Book added successfully!"))
     except Exception as e:
@@ -564,33 +651,67 @@ def api_create_book():
         # Validate required fields
         for field in required_fields:
             if not book_data.get(field):
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+                return json_response({"error": f"Missing required field: {field}"}, 400)
+        
+        # Copies must be a number before anything is written; a string would never match the availability query
+        try:
+            book_data['book_count'] = parse_book_count(book_data['book_count'])
+        except ValueError as e:
+            return json_response({"error": str(e)}, 400)
         
         # Add additional fields
         book_data['borrowed_count'] = 0
+        book_data['available_copies'] = book_data['book_count']
         book_data['created_at'] = datetime.now()
+        book_data.update(search_fields(book_data))
         
         # Insert the book
-        result = db.books.insert_one(book_data)
-        book_data['_id'] = serialize_id(result.inserted_id)
+        try:
+            inserted_id = book_repository.create(book_data)
+        except DuplicateKeyError:
+            return json_response({"error": DUPLICATE_ISBN_ERROR}, 400)
+        stats.book_added(db)
+        departments.book_added(db, book_data)
+        http_cache.bump(db, 'books')
+        book_data['_id'] = serialize_id(inserted_id)
         
         # Send email notification
-        email_subject = "New Book Added to Library"
-        email_body = f"""
-        <h2>New Book Added</h2>
-        <p>A new book has been added to the library:</p>
-        <ul>
-            <li><strong>Title:</strong> {book_data['title']}</li>
-            <li><strong>Author:</strong> {book_data['author']}</li>
-            <li><strong>ISBN:</strong> {book_data['isbn']}</li>
-            <li><strong>Copies:</strong> {book_data['book_count']}</li>
-        </ul>
-        """
-        send_email(email_subject, email_body, ADMIN_EMAIL)
-        
-        return jsonify({"message": "Book added successfully", "book": book_data}), 201
+        send_email(*new_book_email(book_data), ADMIN_EMAIL)
+        
+        return json_response({"message": "Book added successfully", "book": api_document(book_data, BOOK_FIELDS)}, 201)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+def run_catalog_import():
+    """Import the uploaded catalog file and email one summary; returns the summary"""
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        raise ValueError("No file uploaded")
+    fmt = request.args.get('format') or detect_format(upload.filename)
+    summary = import_catalog(db, upload.stream, fmt)
+    send_email(*summary_email(summary, secure_filename(upload.filename)), ADMIN_EMAIL)
+    return summary
+
+@app.route('/books/import', methods=['POST'])
+@login_required
+def import_books():
+    try:
+        summary = run_catalog_import()
+        message = (f"Imported {summary['imported_rows']} of {summary['rows']} rows: {summary['new_books']} new titles, "
+                   f"{summary['updated_books']} updated, {summary['failed_rows']} failed")
+        return redirect(url_for('books', message=message))
+    except Exception as e:
+        print(f"Error in import_books: {str(e)}")
+        return render_template("add_book.html", error=str(e))
+
+@app.route('/api/books/import', methods=['POST'])
+def api_import_books():
+    try:
+        return json_response(run_catalog_import())
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/books/<book_id>/edit', methods=['POST'])
 def update_book(book_id):
@@ -600,19 +721,15 @@ def update_book(book_id):
         cover_image_path = None
         
         if cover_image and allowed_file(cover_image.filename):
-            filename = secure_filename(cover_image.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            unique_filename = f"{timestamp}_{filename}"
-            # Use forward slashes for web paths
-            cover_image_path = os.path.join('uploads', unique_filename).replace('\\', '/')
-            cover_image.save(os.path.join(app.config['UPLOAD_FOLDER'], unique_filename))
+            # Stored once per unique image; thumbnails are generated in the background
+            cover_image_path = store_upload(cover_image, storage, on_variants=covers_changed)
 
         book_data = {
             'title': request.form.get('title'),
             'author': request.form.get('author'),
             'isbn': request.form.get('isbn'),
             'department': request.form.get('department'),
-            'book_count': int(request.form.get('book_count', 1))
+            'book_count': request.form.get('book_count', 1)
         }
         
         # Add cover image path if new image was uploaded
@@ -624,18 +741,28 @@ def update_book(book_id):
         for field in required_fields:
             if not book_data[field]:
                 return render_template("edit_book.html", book=book_data, error=f"Missing required field: {field}")
+        try:
+            book_data['book_count'] = parse_book_count(book_data['book_count'])
+        except ValueError as e:
+            return render_template("edit_book.html", book=book_data, error=str(e))
         
-        # Update the book
-        result = db.books.update_one(
-            {'_id': ObjectId(book_id)},
-            {'$set': book_data}
-        )
+        # Keep search fields in step with title, author and ISBN
+        book_data.update(search_fields(book_data))
         
-        if result.modified_count:
-            return render_template("books.html", books=list(db.books.find()), error="Book details updated successfully!")
+        # Update the book
+        try:
+            previous = book_repository.update(book_id, availability_update(book_data))
+        except DuplicateKeyError:
+            return render_template("edit_book.html", book=book_data, error=DUPLICATE_ISBN_ERROR)
+        
+        if previous:
+            departments.book_updated(db, previous, book_data)
+            http_cache.bump(db, 'books')
+            return render_template("books.html", **book_list_context(), error="Book details updated successfully!")
+        return render_template("books.html", **book_list_context(), error="Book not found")
     except Exception as e:
         print(f"Error in update_book: {str(e)}")
-        return render_template("books.html", books=list(db.books.find()), error=str(e))
+        return render_template("books.html", **book_list_context(), error=str(e))
 
 @app.route('/api/books/<book_id>/edit', methods=['PUT'])
 def api_update_book(book_id):
@@ -646,67 +773,83 @@ def api_update_book(book_id):
         # Validate required fields
         for field in required_fields:
             if not book_data.get(field):
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+                return json_response({"error": f"Missing required field: {field}"}, 400)
+        
+        if 'book_count' in book_data:
+            try:
+                book_data['book_count'] = parse_book_count(book_data['book_count'])
+            except ValueError as e:
+                return json_response({"error": str(e)}, 400)
+        
+        # Keep search fields in step with title, author and ISBN
+        book_data.update(search_fields(book_data))
         
         # Update the book
-        result = db.books.update_one(
-            {'_id': ObjectId(book_id)},
-            {'$set': book_data}
-        )
+        try:
+            previous = book_repository.update(book_id, availability_update(book_data))
+        except DuplicateKeyError:
+            return json_response({"error": DUPLICATE_ISBN_ERROR}, 400)
         
-        if result.modified_count:
+        if previous:
+            departments.book_updated(db, previous, book_data)
+            http_cache.bump(db, 'books')
             book_data['_id'] = book_id
-            return jsonify({"message": "Book updated successfully", "book": book_data})
-        return jsonify({"error": "Book not found"}), 404
+            return json_response({"message": "Book updated successfully", "book": api_document(book_data, BOOK_FIELDS)})
+        return json_response({"error": "Book not found"}, 404)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/books/<book_id>/delete', methods=['POST'])
 def delete_book(book_id):
     try:
-        result = db.books.delete_one({'_id': ObjectId(book_id)})
-        if result.deleted_count:
-            return render_template("books.html", books=list(db.books.find()), message="Book deleted successfully!")
-        return render_template("books.html", books=list(db.books.find()), error="Book not found")
+        deleted = book_repository.delete(book_id)
+        if deleted:
+            stats.book_removed(db)
+            departments.book_removed(db, deleted)
+            http_cache.bump(db, 'books')
+            return render_template("books.html", **book_list_context(), message="Book deleted successfully!")
+        return render_template("books.html", **book_list_context(), error="Book not found")
     except Exception as e:
         print(f"Error in delete_book: {str(e)}")
-        return render_template("books.html", books=list(db.books.find()), error=str(e))
+        return render_template("books.html", **book_list_context(), error=str(e))
 
 @app.route('/api/books/<book_id>/delete', methods=['DELETE'])
 def api_delete_book(book_id):
     try:
-        result = db.books.delete_one({'_id': ObjectId(book_id)})
-        if result.deleted_count:
-            return jsonify({"message": "Book deleted successfully"})
-        return jsonify({"error": "Book not found"}), 404
+        deleted = book_repository.delete(book_id)
+        if deleted:
+            stats.book_removed(db)
+            departments.book_removed(db, deleted)
+            http_cache.bump(db, 'books')
+            return json_response({"message": "Book deleted successfully"})
+        return json_response({"error": "Book not found"}, 404)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route('/books/<book_id>', methods=['GET'])
 def get_book(book_id):
     try:
-        book = db.books.find_one({'_id': ObjectId(book_id)})
+        book = book_repository.get(book_id)
         if book:
             book['_id'] = serialize_id(book['_id'])
             # Convert backslashes to forward slashes in cover_image path
             if book.get('cover_image'):
                 book['cover_image'] = book['cover_image'].replace('\\', '/')
             return render_template("edit_book.html", book=book)
-        return render_template("books.html", books=list(db.books.find()), error="Book not found")
+        return render_template("books.html", **book_list_context(), error="Book not found")
     except Exception as e:
         print(f"Error in get_book: {str(e)}")
-        return render_template("books.html", books=list(db.books.find()), error=str(e))
+        return render_template("books.html", **book_list_context(), error=str(e))
 
 @app.route('/api/books/<book_id>', methods=['GET'])
 def api_get_book(book_id):
     try:
-        book = db.books.find_one({'_id': ObjectId(book_id)})
+        book = book_repository.get(book_id, api_projection(BOOK_FIELDS))
         if book:
-            book['_id'] = serialize_id(book['_id'])
-            return jsonify(book)
-        return jsonify({"error": "Book not found"}), 404
+            return json_response(book)
+        return json_response({"error": "Book not found"}, 404)
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 @app.route("/adminDashboard.html")
 @login_required
@@ -720,17 +863,16 @@ def user_dashboard():
         return redirect(url_for('login'))
     try:
         # Get user's information
-        user = db.users.find_one({'userId': session.get('user_id')})
+        user = user_repository.find_by_user_id(session.get('user_id'))
         if not user:
             return redirect(url_for('login'))
         
-        # Get user's borrowed books (both current and returned)
-        borrowed_books = list(db.borrowed_books.find({
-            'user_id': session.get('user_id')
-        }).sort('borrowed_date', -1))  # Sort by most recent first
+        # Get user's current loans, and one page of returned loans; older pages load on demand
+        current_loans = loan_repository.active_for_user(session.get('user_id'))
+        borrowed_books, next_cursor = loan_repository.history(session.get('user_id'), request.args.get('after'))
         
         # Convert ObjectId to string for borrowed books
-        for book in borrowed_books:
+        for book in current_loans + borrowed_books:
             book['_id'] = str(book['_id'])
             book['book_id'] = str(book['book_id'])
             # Format dates for display
@@ -740,22 +882,20 @@ def user_dashboard():
                 book['returned_date'] = book['returned_date'].strftime('%Y-%m-%d')
         
         # Get total available books count
-        available_books_count = db.books.count_documents({
-            'book_count': {'$gt': {'$ifNull': ['$borrowed_count', 0]}}
-        })
+        available_books_count = book_repository.count(AVAILABLE_BOOKS_QUERY)
         
         # Get total borrowed books count (currently borrowed)
-        current_borrowed_count = db.borrowed_books.count_documents({
-            'user_id': session.get('user_id'),
-            'status': 'borrowed'
-        })
+        current_borrowed_count = user.get('active_loans', 0)
         
         # Get total books count
-        total_books = db.books.count_documents({})
+        total_books = stats.get_stats(db).get('books_total', 0)
         
         return render_template("userDashboard.html",
                              user=user,
+                             current_loans=current_loans,
                              borrowed_books=borrowed_books,
+                             next_cursor=next_cursor,
+                             list_endpoint='user_dashboard',
                              available_books_count=available_books_count,
                              current_borrowed_count=current_borrowed_count,
                              total_books=total_books)
@@ -763,6 +903,7 @@ def user_dashboard():
         print(f"Error in user dashboard: {str(e)}")
         return render_template("userDashboard.html",
                              user={'total_penalty': 0},
+                             current_loans=[],
                              borrowed_books=[],
                              available_books_count=0,
                              current_borrowed_count=0,
@@ -776,11 +917,12 @@ def staff_dashboard():
         return redirect(url_for('login'))
     try:
         # Get counts for dashboard
-        users_count = db.users.count_documents({'role': 'user'})
-        books_count = db.books.count_documents({})
+        library_stats = stats.get_stats(db)
+        users_count = library_stats.get('users_by_role', {}).get('user', 0)
+        books_count = library_stats.get('books_total', 0)
         
         # Get recently added books (last 5)
-        recent_books = list(db.books.find().sort('created_at', -1).limit(5))
+        recent_books = book_repository.recent(5)
         for book in recent_books:
             book['_id'] = str(book['_id'])
             if book.get('cover_image'):
@@ -800,17 +942,12 @@ def staff_dashboard():
 
 @app.route("/lend-book", methods=['GET', 'POST'])
 @login_required
+@http_cache.cached(db, 'books', window=storage.url_window)
 def lend_book():
     if request.method == 'GET':
         try:
-            # Get all books that have available copies
-            books = list(db.books.find())
-            books = [{**book, '_id': serialize_id(book['_id'])} for book in books]
-            # Convert backslashes to forward slashes in cover_image paths
-            for book in books:
-                if book.get('cover_image'):
-                    book['cover_image'] = book['cover_image'].replace('\\', '/')
-            return render_template("lend_books.html", books=books)
+            # Get one page of books
+            return render_template("lend_books.html", **lend_books_context(request.args.get('after')))
         except Exception as e:
             print(f"Error in lend_book: {str(e)}")
             return render_template("lend_books.html", books=[], error=str(e))
@@ -821,41 +958,11 @@ def lend_book():
             user_id = request.form.get('user_id')
             return_date = datetime.strptime(request.form.get('return_date'), '%Y-%m-%d')
             
-            # Get the book details
-            book = db.books.find_one({'_id': ObjectId(book_id)})
-            if not book:
-                return render_template("lend_books.html", books=list(db.books.find()), error="Book not found")
-            
-            # Check if user exists
-            user = db.users.find_one({'userId': user_id})
-            if not user:
-                return render_template("lend_books.html", books=list(db.books.find()), error="User not found")
-            
-            # Check if book has available copies
-            if book['book_count'] <= book.get('borrowed_count', 0):
-                return render_template("lend_books.html", books=list(db.books.find()), error="No copies available")
-            
-            # Create borrowed book record
-            borrowed_book = {
-                'book_id': book_id,
-                'user_id': user_id,
-                'book_title': book['title'],
-                'author': book['author'],
-                'isbn': book['isbn'],
-                'department': book['department'],
-                'borrowed_date': datetime.now(),
-                'return_date': return_date,
-                'status': 'borrowed'
-            }
-            
-            # Insert into borrowed_books collection
-            db.borrowed_books.insert_one(borrowed_book)
-            
-            # Update book's borrowed count
-            db.books.update_one(
-                {'_id': ObjectId(book_id)},
-                {'$inc': {'borrowed_count': 1}}
-            )
+            # Reserve a copy, count the loan against the user and record it
+            try:
+                book, user, borrowed_book = circulation.lend_book(db, book_id, user_id, return_date)
+            except CirculationError as e:
+                return render_template("lend_books.html", **lend_books_context(), error=str(e))
             
             # Send email notification
             email_subject = "Book Borrowed Successfully"
@@ -875,17 +982,11 @@ def lend_book():
             send_email(email_subject, email_body, user['email'])
             
             # Get updated list of books
-            books = list(db.books.find())
-            books = [{**book, '_id': serialize_id(book['_id'])} for book in books]
-            for book in books:
-                if book.get('cover_image'):
-                    book['cover_image'] = book['cover_image'].replace('\\', '/')
-            
-            return render_template("lend_books.html", books=books, message="Book lent successfully!")
+            return render_template("lend_books.html", **lend_books_context(), message="Book lent successfully!")
             
         except Exception as e:
             print(f"Error in lend_book POST: {str(e)}")
-            return render_template("lend_books.html", books=list(db.books.find()), error=str(e))
+            return render_template("lend_books.html", **lend_books_context(), error=str(e))
 
 @app.route("/borrowed-books")
 @login_required
@@ -895,6 +996,25 @@ def borrowed_books():
         status = request.args.get('status')
         user_id = request.args.get('user_id')
         
+        # Get sort parameters; pages follow the `after` cursor
+        sort = request.args.get('sort', 'borrowed_date')
+        if sort not in BORROWED_BOOKS_SORT_FIELDS:
+            sort = 'borrowed_date'
+        order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+        direction = 1 if order == 'asc' else -1
+        
+        # Archived loans are read from loan_history alone, newest first, a keyset page at a time
+        if status == 'archived':
+            borrowed_books, next_cursor = loan_repository.archived(user_id, request.args.get('after'))
+            for book in borrowed_books:
+                book['_id'] = serialize_id(book['_id'])
+            return render_template("borrowed_books.html",
+                                 borrowed_books=borrowed_books,
+                                 next_cursor=next_cursor,
+                                 list_endpoint='borrowed_books',
+                                 sort='borrowed_date',
+                                 order='desc')
+        
         # Build query
         query = {}
         if status:
@@ -902,69 +1022,41 @@ def borrowed_books():
         if user_id:
             query['user_id'] = user_id
         
-        # Get filtered borrowed books
-        borrowed_books = list(db.borrowed_books.find(query))
-        borrowed_books = [{**book, '_id': serialize_id(book['_id'])} for book in borrowed_books]
-        
-        # Get user names for each borrowed book
+        # Fetch one keyset page of loans along an indexed (sort, _id) order, with user names
+        borrowed_books, next_cursor = loan_repository.listing(query, sort, direction, request.args.get('after'),
+                                                              BORROWED_BOOKS_PER_PAGE)
         for book in borrowed_books:
-            user = db.users.find_one({'userId': book['user_id']})
-            if user:
-                book['user_name'] = user.get('name', 'Unknown User')
-            else:
-                book['user_name'] = 'Unknown User'
+            book['_id'] = serialize_id(book['_id'])
         
-        return render_template("borrowed_books.html", borrowed_books=borrowed_books)
+        return render_template("borrowed_books.html",
+                             borrowed_books=borrowed_books,
+                             next_cursor=next_cursor,
+                             list_endpoint='borrowed_books',
+                             sort=sort,
+                             order=order)
     except Exception as e:
         print(f"Error in borrowed_books: {str(e)}")
-        return render_template("borrowed_books.html", borrowed_books=[], error=str(e))
+        return render_template("borrowed_books.html",
+                             borrowed_books=[],
+                             next_cursor=None,
+                             list_endpoint='borrowed_books',
+                             sort='borrowed_date',
+                             order='desc',
+                             error=str(e))
 
 @app.route("/return-book/<book_id>", methods=['POST'])
 @login_required
 def return_book(book_id):
     try:
-        # Get the borrowed book record
-        borrowed_book = db.borrowed_books.find_one({'_id': ObjectId(book_id)})
-        if not borrowed_book:
-            return redirect(url_for('borrowed_books', error="Borrowed book record not found"))
-        
-        # Calculate days difference and penalty
-        current_date = datetime.now()
+        # Mark the loan returned, put the copy back and charge any penalty
+        try:
+            borrowed_book, user, days_difference, penalty = circulation.return_book(db, book_id)
+        except CirculationError as e:
+            return redirect(url_for('borrowed_books', error=str(e)))
         return_date = borrowed_book['return_date']
-        days_difference = (current_date - return_date).days
-        penalty = 0
-        
-        if days_difference > 0:
-            penalty = days_difference * 5  # Rs. 5 per day penalty
-        
-        # Update the borrowed book status and add penalty information
-        update_data = {
-            'status': 'returned',
-            'returned_date': current_date,
-            'days_late': days_difference if days_difference > 0 else 0,
-            'penalty_amount': penalty
-        }
-        
-        db.borrowed_books.update_one(
-            {'_id': ObjectId(book_id)},
-            {'$set': update_data}
-        )
+        current_date = borrowed_book['returned_date']
         
-        # Decrease the borrowed count in the books collection
-        db.books.update_one(
-            {'_id': ObjectId(borrowed_book['book_id'])},
-            {'$inc': {'borrowed_count': -1}}
-        )
-        
-        # Get user details and update penalty in user record
-        user = db.users.find_one({'userId': borrowed_book['user_id']})
         if user:
-            # Update user's total penalty
-            db.users.update_one(
-                {'userId': borrowed_book['user_id']},
-                {'$inc': {'total_penalty': penalty}}
-            )
-            
             # Send email notification with penalty information
             email_subject = "Book Returned Successfully"
             email_body = f"""
@@ -1002,45 +1094,136 @@ def return_book(book_id):
         print(f"Error in return_book: {str(e)}")
         return redirect(url_for('borrowed_books', error=str(e)))
 
+def parse_batch(key):
+    """Read a list of batch items from the JSON body; returns (items, error)"""
+    items = (request.get_json(silent=True) or {}).get(key)
+    if not isinstance(items, list) or not items:
+        return None, f"Expected a non-empty list in '{key}'"
+    if len(items) > circulation.MAX_BATCH_SIZE:
+        return None, f"At most {circulation.MAX_BATCH_SIZE} items per batch"
+    return items, None
+
+def batch_response(results):
+    succeeded = sum(1 for result in results if result['status'] == 'ok')
+    return json_response({
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    })
+
+@app.route('/api/circulation/checkout', methods=['POST'])
+@login_required
+def api_batch_checkout():
+    try:
+        items, error = parse_batch('checkouts')
+        if error:
+            return json_response({"error": error}, 400)
+        
+        checkouts = []
+        for item in items:
+            # Anything but an object is passed through and reported as a per-item error
+            if isinstance(item, dict):
+                item = dict(item)
+                try:
+                    item['return_date'] = datetime.strptime(item.get('return_date') or '', '%Y-%m-%d')
+                except (TypeError, ValueError):
+                    item['return_date'] = None
+            checkouts.append(item)
+        
+        results, loans_by_user = circulation.lend_books(db, checkouts)
+        
+        # One email per borrower listing every book lent in this batch
+        for user, loans in loans_by_user.values():
+            rows = ''.join(f"""
+                <li><strong>{loan['book_title']}</strong> by {loan['author']} (ISBN: {loan['isbn']}), return by {loan['return_date'].strftime('%Y-%m-%d')}</li>""" for loan in loans)
+            email_body = f"""
+            <h2>Books Borrowed</h2>
+            <p>Dear {user['name']},</p>
+            <p>You have successfully borrowed the following books:</p>
+            <ul>{rows}
+            </ul>
+            <p>Please return the books by the specified return dates.</p>
+            <p>Best regards,<br>Library Management System Team</p>
+            """
+            send_email("Books Borrowed Successfully", email_body, user.get('email'))
+        
+        return batch_response(results)
+    except Exception as e:
+        print(f"Error in api_batch_checkout: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
+@app.route('/api/circulation/return', methods=['POST'])
+@login_required
+def api_batch_return():
+    try:
+        loan_ids, error = parse_batch('loan_ids')
+        if error:
+            return json_response({"error": error}, 400)
+        
+        results, returns_by_user = circulation.return_books(db, loan_ids)
+        
+        # One email per borrower listing every book returned in this batch
+        for user, returns in returns_by_user.values():
+            if not user:
+                continue
+            rows = ''.join(f"""
+                <li><strong>{loan['book_title']}</strong> by {loan['author']} (ISBN: {loan['isbn']}), due {loan['return_date'].strftime('%Y-%m-%d')}{f", {days_late} days late, penalty Rs. {penalty}" if penalty else ""}</li>""" for loan, days_late, penalty in returns)
+            email_body = f"""
+            <h2>Books Returned</h2>
+            <p>Dear {user.get('name', 'User')},</p>
+            <p>The following books have been marked as returned on {datetime.now().strftime('%Y-%m-%d')}:</p>
+            <ul>{rows}
+            </ul>
+            """
+            total_penalty = sum(penalty for _, _, penalty in returns)
+            if total_penalty > 0:
+                email_body += f"""
+                <p><strong>Late Return Penalty:</strong> Rs. {total_penalty}</p>
+                <p>Please pay the penalty amount at the library counter.</p>
+                """
+            email_body += """
+            <p>Thank you for returning the books!</p>
+            <p>Best regards,<br>Library Management System Team</p>
+            """
+            send_email("Books Returned Successfully", email_body, user.get('email'))
+        
+        return batch_response(results)
+    except Exception as e:
+        print(f"Error in api_batch_return: {str(e)}")
+        return json_response({"error": str(e)}, 500)
+
 @app.route("/available-books", methods=['GET'])
 @login_required
+@http_cache.cached(db, 'books', window=storage.url_window)
 def available_books():
     try:
         # Get filter parameters
         department = request.args.get('department')
         search = request.args.get('search')
+        page = max(request.args.get('page', 1, type=int), 1)
         
-        # Build query
-        query = {}
+        # Build query; only books with a copy on the shelf are listed
+        query = dict(AVAILABLE_BOOKS_QUERY)
         if department:
             query['department'] = department
-            
-        if search:
-            query['$or'] = [
-                {'title': {'$regex': search, '$options': 'i'}},
-                {'author': {'$regex': search, '$options': 'i'}},
-                {'isbn': {'$regex': search, '$options': 'i'}}
-            ]
         
-        # Get books from database
-        books = list(db.books.find(query))
-        
-        # Convert ObjectId to string and process cover images
-        for book in books:
-            book['_id'] = str(book['_id'])
-            if book.get('cover_image'):
-                book['cover_image'] = book['cover_image'].replace('\\', '/')
+        # Get books from database; searches are ranked and paged by number,
+        # plain listings are paged by _id
+        if search:
+            context = book_search_context(query, search, page)
+        else:
+            context = book_list_context(query, request.args.get('after'), 'available_books')
         
-        # Get unique departments for filter dropdown
-        departments = sorted(db.books.distinct('department'))
+        # Departments with their title counts for the filter dropdown, kept in memory
+        department_list = departments.get_departments(db)
         
         # Get total books count
-        total_books = db.books.count_documents({})
+        total_books = stats.get_stats(db).get('books_total', 0)
         
         return render_template("available_books.html",
-                             books=books,
-                             departments=departments,
-                             total_books=total_books)
+                             departments=department_list,
+                             total_books=total_books,
+                             **context)
     except Exception as e:
         print(f"Error in available_books: {str(e)}")
         return render_template("available_books.html",
@@ -1049,5 +1232,41 @@ def available_books():
                              total_books=0,
                              error=str(e))
 
+def preload_templates():
+    """Compile every template up front so the first requests in each worker do not pay for it"""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def start_background_workers():
+    """Start the threads that must run in every serving process; call after fork"""
+    metrics.start_writer()
+    if MAIL_WORKER_ENABLED:
+        mail_queue.start_worker()
+
+def create_app(start_workers=True):
+    """Prepare the application for serving and return it
+
+    Pre-forking servers (see wsgi.py and gunicorn.conf.py) call this with
+    start_workers=False in the master and start_background_workers() in each
+    worker after fork, because threads and MongoClients do not survive fork.
+    """
+    # Create indexes and apply pending data migrations
+    if AUTO_MIGRATE:
+        try:
+            migrate(db)
+        except UniqueIndexError:
+            # Duplicate users would no longer be rejected; refuse to start
+            raise
+        except Exception as e:
+            print(f"Error applying migrations: {str(e)}")
+    preload_templates()
+    if start_workers:
+        start_background_workers()
+    else:
+        # Workers open their own connections after fork
+        close_client()
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5432,host='0.0.0.0') 
\ No newline at end of file
+    # Development server; use gunicorn -c gunicorn.conf.py wsgi:app in production
+    create_app().run(debug=True, port=5432,host='0.0.0.0') 
\ No newline at end of file
@@ -0,0 +1,386 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from contextlib import asynccontextmanager
+from datetime import datetime
+import hashlib
+import os
+from dotenv import load_dotenv
+
+# Load .env before the modules below read their settings from the environment
+load_dotenv()
+
+from api_serialization import api_projection, api_document, dumps, RAW_BSON, USER_FIELDS, BOOK_FIELDS
+from catalog_import import new_book_email
+from catalog_search import search_fields, build_search_query, SUGGEST_LIMIT, SUGGEST_PROJECTION
+from database import DATABASE_NAME, client_options, close_client, get_db
+from mail_queue import OUTBOX_COLLECTION, outbox_message
+from pagination import parse_limit, keyset_query, page_result, DEFAULT_LIMIT
+from repositories import UserRepository, BookRepository, COUNTED_FIELDS, availability_update, duplicate_user_error, \
+    parse_book_count, DUPLICATE_ISBN_ERROR
+from user_import import generate_password, credentials_email
+import departments
+import http_cache
+import metrics
+import stats
+
+# Where `python asgi_api.py` listens; each worker process runs one event loop
+HOST = os.getenv('ASYNC_API_HOST', '0.0.0.0')
+PORT = int(os.getenv('ASYNC_API_PORT', '8001'))
+WORKERS = int(os.getenv('ASYNC_API_WORKERS', os.cpu_count() or 1))
+
+# New books are announced to this address, as in the Flask app
+ADMIN_EMAIL = os.getenv('ADMIN_EMAIL')
+
+# The Motor client of this worker, created inside its event loop at startup
+state = {'client': None, 'db': None}
+
+
+class AsyncRepository:
+    """Motor counterpart of repositories.Repository for the API's queries"""
+
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+
+    @property
+    def collection(self):
+        return state['db'][self.collection_name]
+
+    async def page(self, query=None, after=None, limit=DEFAULT_LIMIT, projection=None):
+        """One keyset page in _id order; returns (documents, next_cursor)"""
+        cursor = self.collection.find(keyset_query(query or {}, after), projection).sort('_id', 1).limit(limit + 1)
+        return page_result(await cursor.to_list(limit + 1), limit)
+
+    def export(self, query=None, projection=None, raw=False):
+        collection = self.collection.with_options(codec_options=RAW_BSON) if raw else self.collection
+        return collection.find(query or {}, projection).sort('_id', 1)
+
+    async def get(self, document_id, projection):
+        return await self.collection.find_one({'_id': ObjectId(document_id)}, projection)
+
+    async def create(self, document):
+        return (await self.collection.insert_one(document)).inserted_id
+
+    async def update(self, document_id, update, projection):
+        """Apply an update; returns the projected document as it was before, or None"""
+        return await self.collection.find_one_and_update(
+            {'_id': ObjectId(document_id)}, update, projection=projection, return_document=ReturnDocument.BEFORE
+        )
+
+    async def delete(self, document_id, projection):
+        return await self.collection.find_one_and_delete({'_id': ObjectId(document_id)}, projection=projection)
+
+
+users = AsyncRepository(UserRepository.collection_name)
+books = AsyncRepository(BookRepository.collection_name)
+
+
+async def record(func, *args):
+    """Run one of the Flask app's bookkeeping functions, e.g. stats.book_added(db)
+
+    The library counters, the department registry and the cache change
+    counters are maintained by stats, departments and http_cache alone. They
+    use pymongo, so they run on this process's pymongo client in a worker
+    thread and the event loop is never blocked.
+    """
+    return await run_in_threadpool(func, get_db(), *args)
+
+
+async def send_email(subject, body, to_email):
+    """Queue an email in the outbox shared with the Flask app's mail worker"""
+    if not to_email:
+        return False
+    try:
+        with metrics.track('email_enqueue'):
+            await state['db'][OUTBOX_COLLECTION].insert_one(outbox_message(subject, body, to_email))
+        return True
+    except Exception as e:
+        print(f"Error queueing email: {str(e)}")
+        return False
+
+
+def json_response(value, status=200, headers=None):
+    return Response(dumps(value), status_code=status, headers=headers, media_type='application/json')
+
+
+def missing_field(data, required_fields):
+    for field in required_fields:
+        if not data.get(field):
+            return json_response({"error": f"Missing required field: {field}"}, 400)
+    return None
+
+
+async def ndjson_stream(cursor):
+    async for document in cursor:
+        yield dumps(document) + b'\n'
+
+
+async def bson_stream(cursor):
+    async for document in cursor:
+        yield document.raw
+
+
+async def paginated_api_response(request, repository, fields):
+    """Same contract as app.paginated_api_response: keyset pages, `fields`, and NDJSON or BSON exports"""
+    projection = api_projection(fields, request.query_params.get('fields'))
+
+    export_format = request.query_params.get('format')
+    if export_format == 'ndjson':
+        return StreamingResponse(ndjson_stream(repository.export(None, projection)), media_type='application/x-ndjson')
+    if export_format == 'bson':
+        return StreamingResponse(bson_stream(repository.export(None, projection, raw=True)), media_type='application/bson')
+
+    limit = parse_limit(request.query_params.get('limit'), DEFAULT_LIMIT)
+    documents, next_cursor = await repository.page(None, request.query_params.get('after'), limit, projection)
+    response = json_response(documents)
+    if next_cursor:
+        params = dict(request.query_params, after=next_cursor)
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{request.url.include_query_params(**params)}>; rel="next"'
+    return response
+
+
+async def get_users(request):
+    try:
+        return await paginated_api_response(request, users, USER_FIELDS)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_books(request):
+    """Book pages carry an ETag from the shared books change counter, as http_cache.cached does in Flask"""
+    try:
+        if not http_cache.CACHE_ENABLED:
+            return await paginated_api_response(request, books, BOOK_FIELDS)
+        counter = await state['db'][http_cache.VERSIONS_COLLECTION].find_one({'_id': 'books'})
+        version = (counter or {}).get('version', 0)
+        etag = hashlib.sha1(f"{request.url.path}?{request.url.query}|{version}".encode()).hexdigest()
+        headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'private, no-cache'}
+        if f'"{etag}"' in request.headers.get('if-none-match', ''):
+            return Response(status_code=304, headers=headers)
+        response = await paginated_api_response(request, books, BOOK_FIELDS)
+        if response.status_code == 200 and not isinstance(response, StreamingResponse):
+            response.headers.update(headers)
+        return response
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def suggest_books(request):
+    try:
+        query = build_search_query(request.query_params.get('q', ''))
+        if not query:
+            return json_response([])
+        cursor = books.collection.find(query, SUGGEST_PROJECTION).sort('title', 1).limit(SUGGEST_LIMIT)
+        return json_response(await cursor.to_list(SUGGEST_LIMIT))
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_user(request):
+    try:
+        user = await users.get(request.path_params['user_id'], api_projection(USER_FIELDS))
+        if user:
+            return json_response(user)
+        return json_response({"error": "User not found"}, 404)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def get_book(request):
+    try:
+        book = await books.get(request.path_params['book_id'], api_projection(BOOK_FIELDS))
+        if book:
+            return json_response(book)
+        return json_response({"error": "Book not found"}, 404)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def create_user(request):
+    try:
+        password = generate_password()
+        user_data = await request.json()
+        error = missing_field(user_data, ['userId', 'name', 'email', 'role'])
+        if error:
+            return error
+        if user_data['role'] not in stats.ROLES:
+            return json_response({"error": f"Unknown role: {user_data['role']}"}, 400)
+
+        user_data['password'] = password
+        try:
+            inserted_id = await users.create(user_data)
+        except DuplicateKeyError as e:
+            return json_response({"error": duplicate_user_error(e)}, 400)
+        await record(stats.user_added, user_data['role'])
+        user_data['_id'] = inserted_id
+
+        subject, body = credentials_email(user_data, password)
+        email_sent = await send_email(subject, body, user_data['email'])
+        return json_response({"message": "User added successfully", "user": user_data, "email_sent": email_sent}, 201)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def update_user(request):
+    try:
+        user_id = request.path_params['user_id']
+        user_data = await request.json()
+        error = missing_field(user_data, ['userId', 'name', 'email', 'role'])
+        if error:
+            return error
+        if user_data['role'] not in stats.ROLES:
+            return json_response({"error": f"Unknown role: {user_data['role']}"}, 400)
+
+        previous = await users.update(user_id, {'$set': user_data}, {'role': 1})
+        if previous:
+            await record(stats.user_role_changed, previous.get('role'), user_data['role'])
+            user_data['_id'] = user_id
+            return json_response({"message": "User updated successfully", "user": user_data})
+        return json_response({"error": "User not found"}, 404)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def delete_user(request):
+    try:
+        deleted = await users.delete(request.path_params['user_id'], {'role': 1})
+        if deleted:
+            await record(stats.user_removed, deleted.get('role'))
+            return json_response({"message": "User deleted successfully"})
+        return json_response({"error": "User not found"}, 404)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def create_book(request):
+    try:
+        book_data = await request.json()
+        error = missing_field(book_data, ['title', 'author', 'isbn', 'book_count'])
+        if error:
+            return error
+        try:
+            book_data['book_count'] = parse_book_count(book_data['book_count'])
+        except ValueError as e:
+            return json_response({"error": str(e)}, 400)
+
+        book_data['borrowed_count'] = 0
+        book_data['available_copies'] = book_data['book_count']
+        book_data['created_at'] = datetime.now()
+        book_data.update(search_fields(book_data))
+
+        try:
+            inserted_id = await books.create(book_data)
+        except DuplicateKeyError:
+            return json_response({"error": DUPLICATE_ISBN_ERROR}, 400)
+        await record(stats.book_added)
+        await record(departments.book_added, book_data)
+        await record(http_cache.bump, 'books')
+        book_data['_id'] = inserted_id
+
+        await send_email(*new_book_email(book_data), ADMIN_EMAIL)
+        return json_response({"message": "Book added successfully", "book": api_document(book_data, BOOK_FIELDS)}, 201)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def update_book(request):
+    try:
+        book_id = request.path_params['book_id']
+        book_data = await request.json()
+        error = missing_field(book_data, ['title', 'author', 'isbn', 'status'])
+        if error:
+            return error
+        if 'book_count' in book_data:
+            try:
+                book_data['book_count'] = parse_book_count(book_data['book_count'])
+            except ValueError as e:
+                return json_response({"error": str(e)}, 400)
+
+        book_data.update(search_fields(book_data))
+        try:
+            previous = await books.update(book_id, availability_update(book_data), COUNTED_FIELDS)
+        except DuplicateKeyError:
+            return json_response({"error": DUPLICATE_ISBN_ERROR}, 400)
+        if previous:
+            await record(departments.book_updated, previous, book_data)
+            await record(http_cache.bump, 'books')
+            book_data['_id'] = book_id
+            return json_response({"message": "Book updated successfully", "book": api_document(book_data, BOOK_FIELDS)})
+        return json_response({"error": "Book not found"}, 404)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def delete_book(request):
+    try:
+        deleted = await books.delete(request.path_params['book_id'], COUNTED_FIELDS)
+        if deleted:
+            await record(stats.book_removed)
+            await record(departments.book_removed, deleted)
+            await record(http_cache.bump, 'books')
+            return json_response({"message": "Book deleted successfully"})
+        return json_response({"error": "Book not found"}, 404)
+    except Exception as e:
+        return json_response({"error": str(e)}, 500)
+
+
+async def metrics_view(request):
+    if metrics.METRICS_TOKEN and request.headers.get('authorization') != f"Bearer {metrics.METRICS_TOKEN}":
+        return Response(status_code=401)
+    return Response(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
+@asynccontextmanager
+async def lifespan(app):
+    state['client'] = AsyncIOMotorClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'), **client_options())
+    state['db'] = state['client'][DATABASE_NAME]
+    metrics.start_writer()
+    yield
+    metrics.retire()
+    state['client'].close()
+    close_client()
+
+
+routes = [
+    Route('/api/users', get_users),
+    Route('/api/users/add', create_user, methods=['POST']),
+    Route('/api/users/{user_id}', get_user),
+    Route('/api/users/{user_id}/edit', update_user, methods=['PUT']),
+    Route('/api/users/{user_id}/delete', delete_user, methods=['DELETE']),
+    Route('/api/books', get_books),
+    Route('/api/books/suggest', suggest_books),
+    Route('/api/books/add', create_book, methods=['POST']),
+    Route('/api/books/{book_id}', get_book),
+    Route('/api/books/{book_id}/edit', update_book, methods=['PUT']),
+    Route('/api/books/{book_id}/delete', delete_book, methods=['DELETE']),
+    Route('/metrics', metrics_view)
+]
+
+app = Starlette(
+    routes=routes,
+    lifespan=lifespan,
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*']),
+        Middleware(GZipMiddleware, minimum_size=http_cache.COMPRESS_MIN_SIZE)
+    ]
+)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import uvicorn
+
+    if WORKERS > 1:
+        # The worker processes add up their metrics through a shared directory (see metrics.py)
+        os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"library_async_metrics_{os.getpid()}"))
+        metrics.clear_directory(os.environ['METRICS_DIR'])
+    uvicorn.run('asgi_api:app', host=HOST, port=PORT, workers=WORKERS, access_log=False)
@@ -0,0 +1,298 @@
+from datetime import datetime
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from dotenv import load_dotenv
+
+from loadtest import percentile, print_report
+
+# Routes exercised through the Flask test client, as (name, role, path)
+SCENARIOS = [
+    ('admin_dashboard', 'admin', '/admin'),
+    ('books', 'admin', '/books'),
+    ('books_department', 'admin', '/books?department=CSE'),
+    ('books_search', 'admin', '/books?search=data+systems'),
+    ('available_books', 'staff', '/available-books'),
+    ('lend_book', 'staff', '/lend-book'),
+    ('borrowed_books', 'admin', '/borrowed-books'),
+    ('borrowed_books_overdue_first', 'admin', '/borrowed-books?status=borrowed&sort=return_date&order=asc'),
+    ('borrowed_books_by_user', 'admin', '/borrowed-books?user_id=U000001&sort=return_date'),
+    ('borrowed_books_archived', 'admin', '/borrowed-books?status=archived'),
+    ('user_dashboard', 'user', '/user-dashboard'),
+    ('api_books', 'admin', '/api/books?limit=100'),
+    ('api_users', 'admin', '/api/users?limit=100'),
+    ('api_suggest', 'admin', '/api/books/suggest?q=comp')
+]
+
+
+def summarize(latencies, duration, commands):
+    """p50/p95/p99 and mean latency in ms, throughput and MongoDB commands per request"""
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'requests_per_second': round(len(latencies) / duration, 1) if duration else None,
+        'mongodb_commands_per_request': round(sum(commands) / len(commands), 1)
+    }
+
+
+def busiest_user(db):
+    """The borrower with the most loans, for the user dashboard scenario"""
+    rows = list(db.borrowed_books.aggregate([
+        {'$group': {'_id': '$user_id', 'loans': {'$sum': 1}}},
+        {'$sort': {'loans': -1}},
+        {'$limit': 1}
+    ]))
+    return rows[0]['_id'] if rows else None
+
+
+def session_for(role, user_id):
+    return {'user_id': 'admin' if role == 'admin' else user_id, 'role': role}
+
+
+def run_scenarios(app, db, requests=200, warmup=10, only=None):
+    """Time each scenario through the test client; returns {name: summary}"""
+    import metrics
+
+    users = {'user': busiest_user(db)}
+    staff = db.users.find_one({'role': 'staff'}, {'userId': 1})
+    users['staff'] = staff['userId'] if staff else None
+
+    results = {}
+    client = app.test_client()
+    for name, role, path in SCENARIOS:
+        if only and name not in only:
+            continue
+        with client.session_transaction() as session:
+            session.clear()
+            session.update(session_for(role, users.get(role)))
+        for _ in range(warmup):
+            client.get(path)
+        latencies = []
+        commands = []
+        statuses = set()
+        start = time.perf_counter()
+        for _ in range(requests):
+            request_start = time.perf_counter()
+            response = client.get(path)
+            latencies.append(time.perf_counter() - request_start)
+            # The request ran on this thread, so its command count is still in request_state
+            commands.append(metrics.request_state.commands)
+            statuses.add(response.status_code)
+        results[name] = summarize(latencies, time.perf_counter() - start, commands)
+        results[name]['path'] = path
+        results[name]['statuses'] = sorted(statuses)
+        print(f"{name}: p50 {results[name]['p50_ms']} ms, p95 {results[name]['p95_ms']} ms, "
+              f"p99 {results[name]['p99_ms']} ms, {results[name]['mongodb_commands_per_request']} commands/request")
+    return results
+
+
+def run_http_load(app, path, worker_counts, duration, concurrency, threads=1):
+    """Drive gunicorn with loadtest.py, signed in as the admin"""
+    from loadtest import scaling_test
+
+    cookie_value = app.session_interface.get_signing_serializer(app).dumps(session_for('admin', None))
+    cookie = f"{app.config['SESSION_COOKIE_NAME']}={cookie_value}"
+    return scaling_test(path, worker_counts, duration, concurrency, threads=threads, cookie=cookie)
+
+
+def run_alert_cycles(db, cycles=3, smtp_port=2525):
+    """Run the overdue check against a local SMTP sink, re-arming every reminder before each cycle"""
+    import metrics
+    from smtp_sink import SMTPSink
+
+    sink = SMTPSink(port=smtp_port)
+    sink.start()
+    try:
+        import alerts
+
+        results = []
+        for _ in range(cycles):
+            db.borrowed_books.update_many(
+                {'status': 'borrowed', 'return_date': {'$lt': datetime.now()}},
+                [{'$set': {'next_reminder_at': '$return_date'}}]
+            )
+            commands_before = metrics.mongo_command_duration.count()
+            run = alerts.check_overdue_books()
+            run['mongodb_commands'] = metrics.mongo_command_duration.count() - commands_before
+            results.append(run)
+            print(f"overdue check: {run['emails_sent']} emails to {run['users']} users in "
+                  f"{run['duration_seconds']}s, {run['emails_per_second']} emails/sec")
+        return results
+    finally:
+        sink.shutdown()
+        sink.server_close()
+
+
+def serialization_paths():
+    """Ways of turning a page of BSON documents into a response body, as {name: encode(payloads)}"""
+    import bson
+    from flask import Flask
+    from bson.raw_bson import RawBSONDocument
+    import api_serialization
+
+    flask_json = Flask(__name__).json
+
+    def jsonify_copy(payloads):
+        # The original path: decode, copy each document to stringify _id, then jsonify
+        documents = [bson.decode(payload) for payload in payloads]
+        return flask_json.dumps([{**document, '_id': str(document['_id'])} for document in documents]).encode()
+
+    def stdlib_encoder(payloads):
+        return api_serialization.encoder.encode([bson.decode(payload) for payload in payloads]).encode()
+
+    def raw_bson(payloads):
+        return b''.join(api_serialization.bson_stream(RawBSONDocument(payload) for payload in payloads))
+
+    paths = {'jsonify_copy': jsonify_copy, 'stdlib_encoder': stdlib_encoder}
+    if api_serialization.orjson is not None:
+        paths['orjson'] = lambda payloads: api_serialization.orjson.dumps(
+            [bson.decode(payload) for payload in payloads], default=api_serialization.json_default)
+    paths['raw_bson'] = raw_bson
+    return paths
+
+
+def run_serialization(count=100000, seed=42):
+    """Encode count synthetic books along each serialization path; bytes/sec and peak memory per path
+
+    The books start out as BSON bytes, the way a cursor receives them, so each
+    path pays for its own decoding. Peak memory is measured in a second run
+    under tracemalloc, which would otherwise slow down the timing.
+    """
+    import random
+    import bson
+    from bson import ObjectId
+    from api_serialization import BOOK_FIELDS
+    from datagen import generate_books
+
+    rng = random.Random(seed)
+    payloads = [
+        bson.encode({'_id': ObjectId(), **{field: book.get(field) for field in BOOK_FIELDS}})
+        for book in generate_books(rng, count, datetime.now().replace(microsecond=0))
+    ]
+    results = {}
+    for name, encode in serialization_paths().items():
+        start = time.perf_counter()
+        size = len(encode(payloads))
+        duration = time.perf_counter() - start
+        tracemalloc.start()
+        encode(payloads)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[name] = {
+            'documents': count,
+            'bytes': size,
+            'seconds': round(duration, 3),
+            'mb_per_second': round(size / duration / 1e6, 1),
+            'documents_per_second': round(count / duration),
+            'peak_memory_mb': round(peak / 1e6, 1)
+        }
+        print(f"{name}: {results[name]['mb_per_second']} MB/s, {results[name]['documents_per_second']} documents/s, "
+              f"peak {results[name]['peak_memory_mb']} MB for {size} bytes")
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(previous, current):
+    """Print the change in latency and MongoDB commands per scenario between two reports"""
+    for name, result in current.get('scenarios', {}).items():
+        before = previous.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'mongodb_commands_per_request'):
+            if before.get(key):
+                changes.append(f"{key} {before[key]} -> {result[key]} ({(result[key] - before[key]) / before[key]:+.0%})")
+        print(f"{name}: {', '.join(changes)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the library app against a synthetic dataset')
+    parser.add_argument('--db', default='library_bench', help='benchmark database (see datagen.py)')
+    parser.add_argument('--generate', action='store_true', help='regenerate the dataset first')
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--loans', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--requests', type=int, default=200, help='requests per test client scenario')
+    parser.add_argument('--scenarios', help='comma separated scenario names (default: all)')
+    parser.add_argument('--http', action='store_true', help='also load gunicorn over HTTP')
+    parser.add_argument('--http-path', default='/books')
+    parser.add_argument('--workers', default='1,2', help='gunicorn worker counts for --http')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per --http run')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--alerts', type=int, default=1, metavar='CYCLES', help='overdue check cycles (0 to skip)')
+    parser.add_argument('--smtp-port', type=int, default=2525)
+    parser.add_argument('--cache', action='store_true', help='leave the HTTP response cache on')
+    parser.add_argument('--serialization', type=int, default=0, metavar='DOCUMENTS',
+                        help='also compare API serialization paths on this many books (0 to skip)')
+    parser.add_argument('--output', default='benchmark-report.json')
+    parser.add_argument('--compare', metavar='REPORT', help='print the change against an earlier report')
+    args = parser.parse_args()
+
+    # Point every module, and the gunicorn workers started for --http, at the benchmark database
+    load_dotenv()
+    os.environ.update(
+        MONGODB_DATABASE=args.db,
+        AUTO_MIGRATE='false',
+        MAIL_WORKER_ENABLED='false',
+        HTTP_CACHE_ENABLED='true' if args.cache else 'false',
+        # Keep the slow request and query logs out of the timings
+        SLOW_REQUEST_MS=os.getenv('SLOW_REQUEST_MS', '100000'),
+        SLOW_QUERY_MS=os.getenv('SLOW_QUERY_MS', '100000'),
+        SMTP_SERVER='127.0.0.1',
+        SMTP_PORT=str(args.smtp_port),
+        SMTP_USE_TLS='false',
+        SMTP_USERNAME='',
+        ALERT_WORKERS=os.getenv('ALERT_WORKERS', '8')
+    )
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    from database import db
+    from datagen import generate
+
+    report = {'created_at': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+              'database': args.db, 'cache': args.cache}
+    if args.generate:
+        report['dataset'] = generate(db, args.books, args.users, args.loans, seed=args.seed)
+        print(f"Generated {report['dataset']['books']} books, {report['dataset']['users']} users, "
+              f"{report['dataset']['loans']} loans in {report['dataset']['duration_seconds']}s")
+    report['collections'] = {name: db[name].estimated_document_count() for name in ('books', 'users', 'borrowed_books')}
+
+    from app import create_app
+    app = create_app(start_workers=False)
+    only = set(args.scenarios.split(',')) if args.scenarios else None
+    report['scenarios'] = run_scenarios(app, db, args.requests, only=only)
+
+    if args.serialization:
+        report['serialization'] = run_serialization(args.serialization, args.seed)
+    if args.http:
+        report['http'] = run_http_load(app, args.http_path, [int(count) for count in args.workers.split(',')],
+                                       args.duration, args.concurrency)
+        for result in report['http']:
+            print_report(result)
+    if args.alerts:
+        report['alerts'] = run_alert_cycles(db, args.alerts, args.smtp_port)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
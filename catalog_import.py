@@ -0,0 +1,258 @@
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime
+import csv
+import io
+import json
+import os
+import time
+
+from catalog_search import search_fields, normalize_isbn
+from repositories import BookRepository
+import http_cache
+import departments
+import stats
+
+# Rows sent to the database per bulk_write
+CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '1000'))
+# Per-row errors kept in the summary; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+REQUIRED_FIELDS = ['title', 'author', 'isbn', 'department', 'book_count']
+
+
+def detect_format(filename, default='csv'):
+    """Pick csv or ndjson from a file name"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension in ('.ndjson', '.jsonl', '.json'):
+        return 'ndjson'
+    if extension == '.csv':
+        return 'csv'
+    return default
+
+
+def read_rows(stream, fmt='csv'):
+    """Yield (line number, row dict) from a binary CSV or NDJSON stream without loading it all"""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'ndjson':
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, ValueError(f"Invalid JSON: {str(e)}")
+                continue
+            yield line_number, row if isinstance(row, dict) else ValueError("Expected a JSON object")
+    else:
+        reader = csv.DictReader(text)
+        for row in reader:
+            # Line 1 is the header
+            yield reader.line_num, {(key or '').strip().lower(): value for key, value in row.items()}
+
+
+def validate_row(row):
+    """Clean one imported row; returns (book, error message)"""
+    if isinstance(row, Exception):
+        return None, str(row)
+    book = {field: str(row.get(field) or '').strip() for field in REQUIRED_FIELDS}
+    for field in REQUIRED_FIELDS:
+        if not book[field]:
+            return None, f"Missing required field: {field}"
+    try:
+        book['book_count'] = int(book['book_count'])
+    except ValueError:
+        return None, "book_count must be a whole number"
+    if book['book_count'] < 1:
+        return None, "book_count must be at least 1"
+    if not normalize_isbn(book['isbn']):
+        return None, "Invalid ISBN"
+    return book, None
+
+
+def upsert_operations(books):
+    """One upsert per distinct ISBN in the chunk; copies of repeated ISBNs are added together"""
+    merged = {}
+    for book in books:
+        key = normalize_isbn(book['isbn'])
+        if key in merged:
+            merged[key]['book_count'] += book['book_count']
+        else:
+            merged[key] = dict(book)
+
+    operations = []
+    for key, book in merged.items():
+        new_book = {
+            'title': book['title'],
+            'author': book['author'],
+            'isbn': book['isbn'],
+            'department': book['department'],
+            'borrowed_count': 0,
+            'cover_image': None,
+            'created_at': datetime.now()
+        }
+        fields = search_fields(book)
+        # isbn_normalized comes from the filter on insert
+        del fields['isbn_normalized']
+        new_book.update(fields)
+        operations.append(UpdateOne(
+            {'isbn_normalized': key},
+            {
+                # Existing titles gain copies instead of being duplicated
+                '$inc': {'book_count': book['book_count'], 'available_copies': book['book_count']},
+                '$setOnInsert': new_book
+            },
+            upsert=True
+        ))
+    return operations, list(merged)
+
+
+def import_catalog(db, stream, fmt='csv', chunk_size=CHUNK_SIZE):
+    """Stream books from a CSV or NDJSON file into the catalog
+
+    Rows are upserted by normalized ISBN in unordered bulk writes of
+    chunk_size. Returns a summary with counts, throughput and per-row errors.
+    """
+    start = time.perf_counter()
+    books = BookRepository(db)
+    summary = {
+        'rows': 0,
+        'imported_rows': 0,
+        'new_books': 0,
+        'updated_books': 0,
+        'copies_added': 0,
+        'failed_rows': 0,
+        'errors': []
+    }
+
+    def record_error(line_number, message):
+        summary['failed_rows'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line_number, 'error': message})
+
+    def write(operations):
+        """Run an unordered bulk write, count its inserts and updates; returns its errors by operation index"""
+        try:
+            details = books.bulk_write(operations).bulk_api_result
+        except BulkWriteError as e:
+            # Unordered writes carry on past a failure; the rest of the chunk is applied
+            details = e.details
+        summary['new_books'] += details.get('nUpserted', 0)
+        summary['updated_books'] += details.get('nMatched', 0)
+        return {error['index']: error for error in details.get('writeErrors', [])}
+
+    def flush(chunk):
+        operations, keys = upsert_operations([book for _, book in chunk])
+        lines = {}
+        copies = {}
+        for line_number, book in chunk:
+            key = normalize_isbn(book['isbn'])
+            lines.setdefault(key, []).append(line_number)
+            copies[key] = copies.get(key, 0) + book['book_count']
+        errors = write(operations)
+        # Two imports upserting the same new ISBN at once: the unique index rejects the
+        # second insert, and retried it finds the first one's book and adds its copies
+        retry = [index for index, error in errors.items() if error.get('code') == 11000]
+        if retry:
+            retried_errors = write([operations[index] for index in retry])
+            for index in retry:
+                del errors[index]
+            errors.update({retry[index]: error for index, error in retried_errors.items()})
+        failed = {keys[index]: error.get('errmsg', 'Write failed') for index, error in errors.items()}
+        for key in keys:
+            if key in failed:
+                for line_number in lines[key]:
+                    record_error(line_number, failed[key])
+            else:
+                summary['imported_rows'] += len(lines[key])
+                summary['copies_added'] += copies[key]
+
+    chunk = []
+    for line_number, row in read_rows(stream, fmt):
+        summary['rows'] += 1
+        book, error = validate_row(row)
+        if error:
+            record_error(line_number, error)
+            continue
+        chunk.append((line_number, book))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    if summary['new_books']:
+        stats.book_added(db, summary['new_books'])
+    if summary['imported_rows']:
+        # Rows may add titles or change copies in any department, so recount them all at once
+        departments.rebuild_departments(db)
+        http_cache.bump(db, 'books')
+
+    summary['duration_seconds'] = round(time.perf_counter() - start, 3)
+    summary['rows_per_second'] = round(summary['rows'] / summary['duration_seconds'], 1) if summary['duration_seconds'] else None
+    return summary
+
+
+def new_book_email(book):
+    """Subject and body of the notification sent to the admin when a book is added"""
+    department = f"<li><strong>Department:</strong> {book['department']}</li>" if book.get('department') else ''
+    body = f"""
+    <h2>New Book Added</h2>
+    <p>A new book has been added to the library:</p>
+    <ul>
+        <li><strong>Title:</strong> {book['title']}</li>
+        <li><strong>Author:</strong> {book['author']}</li>
+        <li><strong>ISBN:</strong> {book['isbn']}</li>
+        {department}
+        <li><strong>Copies:</strong> {book['book_count']}</li>
+    </ul>
+    """
+    return "New Book Added to Library", body
+
+
+def summary_email(summary, source):
+    """Subject and body of the single notification sent after an import"""
+    body = f"""
+    <h2>Catalog Import Finished</h2>
+    <p>The import of <strong>{source}</strong> has finished:</p>
+    <ul>
+        <li><strong>Rows read:</strong> {summary['rows']}</li>
+        <li><strong>New titles:</strong> {summary['new_books']}</li>
+        <li><strong>Existing titles updated:</strong> {summary['updated_books']}</li>
+        <li><strong>Copies added:</strong> {summary['copies_added']}</li>
+        <li><strong>Failed rows:</strong> {summary['failed_rows']}</li>
+        <li><strong>Throughput:</strong> {summary['rows_per_second']} rows/second</li>
+    </ul>
+    """
+    if summary['errors']:
+        rows = ''.join(f"<li>Line {error['line']}: {error['error']}</li>" for error in summary['errors'][:20])
+        body += f"<p>First errors:</p><ul>{rows}</ul>"
+    return "Catalog Import Finished", body
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from mail_queue import MailQueue, OUTBOX_COLLECTION
+
+    parser = argparse.ArgumentParser(description='Bulk import books from a CSV or NDJSON file')
+    parser.add_argument('file', help='CSV with title,author,isbn,department,book_count columns, or NDJSON')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='defaults to the file extension')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--no-email', action='store_true', help='skip the summary email to ADMIN_EMAIL')
+    args = parser.parse_args()
+
+    load_dotenv()
+    from database import get_db
+    db = get_db()
+
+    with open(args.file, 'rb') as stream:
+        summary = import_catalog(db, stream, args.format or detect_format(args.file), args.chunk_size)
+
+    print(f"Imported {summary['imported_rows']} of {summary['rows']} rows in {summary['duration_seconds']}s "
+          f"({summary['rows_per_second']} rows/s): {summary['new_books']} new titles, "
+          f"{summary['updated_books']} updated, {summary['copies_added']} copies added")
+    for error in summary['errors']:
+        print(f"Line {error['line']}: {error['error']}")
+    if not args.no_email:
+        MailQueue(db[OUTBOX_COLLECTION]).enqueue(*summary_email(summary, os.path.basename(args.file)), os.getenv('ADMIN_EMAIL'))
@@ -0,0 +1,184 @@
+import re
+import time
+
+# Search results per page on /books and /available-books
+SEARCH_PER_PAGE = 50
+# Suggestions returned by the autocomplete endpoint
+SUGGEST_LIMIT = 10
+# Fields returned with each suggestion
+SUGGEST_PROJECTION = {'title': 1, 'author': 1, 'isbn': 1}
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+ISBN_QUERY_RE = re.compile(r'^[0-9][0-9\- ]*[0-9Xx]?$')
+
+
+def tokenize(text):
+    """Split text into lowercase alphanumeric tokens"""
+    return TOKEN_RE.findall(str(text or '').lower())
+
+
+def normalize_isbn(isbn):
+    """Strip hyphens and spaces so ISBNs can be prefix-matched"""
+    return re.sub(r'[^0-9X]', '', str(isbn or '').upper())
+
+
+def search_fields(book):
+    """Derived fields that keep a book searchable; store them alongside title/author/isbn"""
+    title_tokens = sorted(set(tokenize(book.get('title'))))
+    return {
+        'title_tokens': title_tokens,
+        'search_tokens': sorted(set(title_tokens + tokenize(book.get('author')))),
+        'isbn_normalized': normalize_isbn(book.get('isbn'))
+    }
+
+
+def build_search_query(search):
+    """Build an index-friendly filter for a search box query
+
+    Every word must match a title/author token exactly, except the last one which
+    is matched as a prefix so partially typed words still find results. Queries
+    that look like an ISBN are also prefix-matched against the normalized ISBN.
+    """
+    terms = tokenize(search)
+    if not terms:
+        return {}
+
+    conditions = [{'search_tokens': term} for term in terms[:-1]]
+    conditions.append({'search_tokens': {'$regex': '^' + re.escape(terms[-1])}})
+    query = conditions[0] if len(conditions) == 1 else {'$and': conditions}
+
+    if ISBN_QUERY_RE.match(search.strip()):
+        # $gt '' matches the partial filter of the ISBN index, so the planner can use it
+        isbn_query = {'isbn_normalized': {'$regex': '^' + re.escape(normalize_isbn(search)), '$gt': ''}}
+        query = {'$or': [isbn_query, query]}
+    return query
+
+
+def search_books(collection, search, base_query=None, page=1, per_page=SEARCH_PER_PAGE):
+    """Run a ranked, paginated catalog search; returns (books, total)
+
+    Books rank higher for each query word found in the title, then in the author.
+    """
+    terms = tokenize(search)
+    query = dict(base_query or {})
+    query.update(build_search_query(search))
+    score = {'$add': [
+        {'$multiply': [2, {'$size': {'$setIntersection': [{'$ifNull': ['$title_tokens', []]}, terms]}}]},
+        {'$size': {'$setIntersection': [{'$ifNull': ['$search_tokens', []]}, terms]}}
+    ]}
+    pipeline = [
+        {'$match': query},
+        {'$addFields': {'search_score': score}},
+        {'$sort': {'search_score': -1, 'title': 1, '_id': 1}},
+        {'$facet': {
+            'total': [{'$count': 'count'}],
+            'books': [
+                {'$skip': (page - 1) * per_page},
+                {'$limit': per_page},
+                {'$project': {'title_tokens': 0, 'search_tokens': 0, 'search_score': 0}}
+            ]
+        }}
+    ]
+    result = next(collection.aggregate(pipeline), {'total': [], 'books': []})
+    total = result['total'][0]['count'] if result['total'] else 0
+    return result['books'], total
+
+
+def suggest_books(collection, prefix, limit=SUGGEST_LIMIT):
+    """Autocomplete suggestions for a partially typed query"""
+    query = build_search_query(prefix)
+    if not query:
+        return []
+    return list(collection.find(query, SUGGEST_PROJECTION).sort('title', 1).limit(limit))
+
+
+def backfill_search_fields(db, batch_size=1000):
+    """Populate search fields on books created before catalog search existed"""
+    from pymongo import UpdateOne
+
+    operations = []
+    for book in db.books.find({}, {'title': 1, 'author': 1, 'isbn': 1}):
+        operations.append(UpdateOne({'_id': book['_id']}, {'$set': search_fields(book)}))
+        if len(operations) >= batch_size:
+            db.books.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        db.books.bulk_write(operations, ordered=False)
+
+
+def benchmark(db, count=100000, queries=('data', 'intro', 'computer net', '978-1')):
+    """Compare the old unanchored $regex search with the token index at scale
+
+    Loads `count` synthetic books into the given (scratch) database first.
+    """
+    import random
+    from migrations import ensure_indexes
+
+    words = ['data', 'systems', 'introduction', 'computer', 'networks', 'theory', 'applied', 'modern',
+             'engineering', 'analysis', 'design', 'principles', 'digital', 'signals', 'machine', 'learning']
+    authors = ['Smith', 'Kumar', 'Rao', 'Chen', 'Garcia', 'Reddy', 'Nair', 'Brown', 'Iyer', 'Khan']
+    db.books.drop()
+    ensure_indexes(db)
+    batch = []
+    for i in range(count):
+        book = {
+            'title': ' '.join(random.sample(words, 3)).title(),
+            'author': f"{random.choice(authors)} {random.choice(authors)}",
+            'isbn': f"978-{random.randint(0, 9)}-{i:07d}",
+            'department': random.choice(['CSE', 'ECE', 'EEE', 'MECH', 'CIVIL'])
+        }
+        book.update(search_fields(book))
+        batch.append(book)
+        if len(batch) == 5000:
+            db.books.insert_many(batch)
+            batch = []
+    if batch:
+        db.books.insert_many(batch)
+
+    results = {}
+    for search in queries:
+        regex_query = {'$or': [
+            {'title': {'$regex': search, '$options': 'i'}},
+            {'author': {'$regex': search, '$options': 'i'}},
+            {'isbn': {'$regex': search, '$options': 'i'}}
+        ]}
+        start = time.perf_counter()
+        regex_count = len(list(db.books.find(regex_query).limit(SEARCH_PER_PAGE)))
+        regex_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        books, total = search_books(db.books, search)
+        index_ms = (time.perf_counter() - start) * 1000
+
+        results[search] = {
+            'regex_ms': round(regex_ms, 2),
+            'regex_results': regex_count,
+            'index_ms': round(index_ms, 2),
+            'index_results': len(books),
+            'index_total': total
+        }
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description='Catalog search maintenance and benchmarks')
+    parser.add_argument('--backfill', action='store_true', help='recompute search fields for every book')
+    parser.add_argument('--bench', type=int, metavar='COUNT', help='benchmark search against COUNT synthetic books')
+    parser.add_argument('--bench-db', default='library_bench', help='scratch database used by --bench')
+    args = parser.parse_args()
+
+    load_dotenv()
+    from database import get_client, get_db
+
+    if args.bench:
+        for search, result in benchmark(get_client()[args.bench_db], args.bench).items():
+            print(f"{search!r}: regex {result['regex_ms']} ms, index {result['index_ms']} ms "
+                  f"({result['index_total']} matches)")
+    elif args.backfill:
+        backfill_search_fields(get_db())
+        print("Search fields updated")
+    else:
+        parser.print_help()
@@ -0,0 +1,419 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
+import os
+
+from repositories import BookRepository, UserRepository, LoanRepository, STATS_COLLECTION
+import http_cache
+import stats
+
+# Rs. per day charged for late returns
+PENALTY_PER_DAY = 5
+
+# Largest number of items accepted in one batch checkout or return
+MAX_BATCH_SIZE = int(os.getenv('CIRCULATION_MAX_BATCH', '200'))
+
+# Wrap each lend/return in a multi-document transaction (requires a replica set)
+USE_TRANSACTIONS = os.getenv('CIRCULATION_TRANSACTIONS', 'false').lower() == 'true'
+
+BOOK_FIELDS = {'title': 1, 'author': 1, 'isbn': 1, 'department': 1}
+USER_FIELDS = {'userId': 1, 'name': 1, 'email': 1}
+
+
+class CirculationError(Exception):
+    """A lend or return that cannot be carried out, with a message fit for the user"""
+
+
+def run_in_transaction(db, operation):
+    """Call operation(session) inside a transaction when enabled, otherwise with no session"""
+    if not USE_TRANSACTIONS:
+        return operation(None)
+    with db.client.start_session() as session:
+        return session.with_transaction(operation)
+
+
+def reserve_copy(db, book_id, session=None):
+    """Atomically take one copy off the shelf; the filter guarantees it never goes below zero"""
+    books = BookRepository(db)
+    book, _ = books.reserve_copies(book_id, 1, BOOK_FIELDS, session)
+    if book:
+        return book
+    if books.exists({'_id': ObjectId(book_id)}, session=session):
+        raise CirculationError("No copies available")
+    raise CirculationError("Book not found")
+
+
+def release_copy(db, book_id, session=None):
+    BookRepository(db).release_copies({book_id: 1}, session)
+
+
+def count_loans(db, delta, session=None):
+    """Adjust the copies_on_loan counter by delta
+
+    Inside a transaction a failure rolls the whole lend or return back. Without
+    one the loan is already written, so a failed counter update is only logged
+    and the stats_repair job's rebuild_stats corrects the counter.
+    """
+    if session is not None:
+        stats.increment(db, {'copies_on_loan': delta}, session=session)
+        return
+    try:
+        stats.increment(db, {'copies_on_loan': delta})
+    except Exception as e:
+        print(f"Error updating copies_on_loan: {str(e)}")
+
+
+def lend_book(db, book_id, user_id, return_date):
+    """Lend one copy of a book; returns (book, user, loan)
+
+    The user is checked before a copy is touched, so a lend for an unknown user
+    never holds a copy another desk could have lent. The copy is reserved with
+    a conditional update, so concurrent checkouts of the last copy cannot both
+    succeed. Without transactions, a failure puts the copy and the user's loan
+    count back.
+    """
+    def operation(session):
+        users = UserRepository(db)
+        # Finding the user and counting the new loan against them is one round trip
+        user = users.increment(user_id, {'active_loans': 1}, USER_FIELDS, session)
+        if not user:
+            raise CirculationError("User not found")
+        try:
+            book = reserve_copy(db, book_id, session)
+            loan = {
+                'book_id': book_id,
+                'user_id': user_id,
+                'book_title': book['title'],
+                'author': book['author'],
+                'isbn': book['isbn'],
+                'department': book['department'],
+                'borrowed_date': datetime.now(),
+                'return_date': return_date,
+                'status': 'borrowed',
+                # First overdue reminder goes out once the return date has passed
+                'next_reminder_at': return_date
+            }
+            try:
+                LoanRepository(db).create(loan, session)
+            except Exception:
+                if session is None:
+                    release_copy(db, book_id)
+                raise
+        except Exception:
+            if session is None:
+                users.increment(user_id, {'active_loans': -1})
+            raise
+
+        count_loans(db, 1, session)
+        return book, user, loan
+
+    result = run_in_transaction(db, operation)
+    http_cache.bump(db, 'books', 'borrowed_books')
+    return result
+
+
+def calculate_penalty(return_date, returned_date):
+    """Days late and penalty for a loan returned at returned_date"""
+    days_late = max((returned_date - return_date).days, 0)
+    return days_late, days_late * PENALTY_PER_DAY
+
+
+def return_book(db, loan_id):
+    """Mark a loan returned; returns (loan, user, days_late, penalty)
+
+    The status change is guarded on status 'borrowed', so a loan returned twice
+    (e.g. a double-clicked button) only puts the copy back once.
+    """
+    def operation(session):
+        loans = LoanRepository(db)
+        loan = loans.get(loan_id, session)
+        if not loan:
+            raise CirculationError("Borrowed book record not found")
+
+        returned_date = datetime.now()
+        days_late, penalty = calculate_penalty(loan['return_date'], returned_date)
+        returned = loans.mark_returned(loan['_id'], {
+            'returned_date': returned_date,
+            'days_late': days_late,
+            'penalty_amount': penalty
+        }, session)
+        if not returned:
+            raise CirculationError("Book has already been returned")
+        loan['returned_date'] = returned_date
+
+        release_copy(db, loan['book_id'], session)
+        user = UserRepository(db).increment(loan['user_id'], {'total_penalty': penalty, 'active_loans': -1},
+                                            USER_FIELDS, session)
+        count_loans(db, -1, session)
+        return loan, user, days_late, penalty
+
+    result = run_in_transaction(db, operation)
+    http_cache.bump(db, 'books', 'borrowed_books')
+    return result
+
+
+def parse_object_id(value):
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def checkout_error(item):
+    """Why a batch checkout item is malformed, or None if its fields have the right types"""
+    if not isinstance(item, dict):
+        return "Expected an object with book_id, user_id and return_date"
+    if not isinstance(item.get('user_id'), str) or not item['user_id']:
+        return "Invalid user id"
+    if not isinstance(item.get('return_date'), datetime):
+        return "Invalid return date"
+    return None
+
+
+def lend_books(db, checkouts):
+    """Lend a batch of (book_id, user_id, return_date) checkouts
+
+    Books and users are validated with one $in query each, each distinct title
+    is reserved with a single conditional update, and the loans and user counts
+    are written in bulk. Returns (results, loans_by_user): one result per
+    checkout, in order, with status 'ok' or 'error', and the new loans grouped
+    by user for notification. Malformed items, such as a non-object or a
+    user_id that is not a string, fail on their own like unknown books do.
+    """
+    def operation(session):
+        results = []
+        errors = []
+        for index, item in enumerate(checkouts):
+            result = {'index': index}
+            if isinstance(item, dict):
+                result.update(book_id=item.get('book_id'), user_id=item.get('user_id'))
+            results.append(result)
+            errors.append(checkout_error(item))
+        valid = [item for item, error in zip(checkouts, errors) if not error]
+
+        book_ids = set(filter(None, (parse_object_id(item.get('book_id')) for item in valid)))
+        user_ids = set(item['user_id'] for item in valid)
+        books = BookRepository(db).existing_ids(book_ids, session)
+        users = UserRepository(db).by_user_ids(user_ids, USER_FIELDS, session)
+
+        # Validate every item before touching any copies
+        wanted = {}
+        for result, item, error in zip(results, checkouts, errors):
+            if error:
+                result['error'] = error
+                continue
+            book_id = parse_object_id(item.get('book_id'))
+            if book_id not in books:
+                result['error'] = "Book not found"
+            elif item.get('user_id') not in users:
+                result['error'] = "User not found"
+            else:
+                wanted.setdefault(book_id, []).append(result)
+
+        # Reserve copies per title; items beyond the copies on the shelf fail
+        reserved = {}
+        loans = []
+        for book_id, requests in wanted.items():
+            book, taken = BookRepository(db).reserve_copies(book_id, len(requests), BOOK_FIELDS, session)
+            if taken:
+                reserved[book_id] = taken
+            for position, result in enumerate(requests):
+                if position >= taken:
+                    result['error'] = "No copies available"
+                    continue
+                item = checkouts[result['index']]
+                loans.append((result, {
+                    'book_id': str(book_id),
+                    'user_id': item['user_id'],
+                    'book_title': book['title'],
+                    'author': book['author'],
+                    'isbn': book['isbn'],
+                    'department': book['department'],
+                    'borrowed_date': datetime.now(),
+                    'return_date': item['return_date'],
+                    'status': 'borrowed',
+                    'next_reminder_at': item['return_date']
+                }))
+
+        loans_by_user = {}
+        if loans:
+            try:
+                LoanRepository(db).create_many([loan for _, loan in loans], session)
+            except Exception:
+                if session is None:
+                    BookRepository(db).release_copies(reserved)
+                raise
+
+            for result, loan in loans:
+                result['loan_id'] = str(loan['_id'])
+                loans_by_user.setdefault(loan['user_id'], []).append(loan)
+            UserRepository(db).increment_many({
+                user_id: {'active_loans': len(user_loans)}
+                for user_id, user_loans in loans_by_user.items()
+            }, session)
+            count_loans(db, len(loans), session)
+
+        for result in results:
+            result['status'] = 'error' if 'error' in result else 'ok'
+        return results, {user_id: (users[user_id], user_loans) for user_id, user_loans in loans_by_user.items()}
+
+    results, loans_by_user = run_in_transaction(db, operation)
+    if loans_by_user:
+        http_cache.bump(db, 'books', 'borrowed_books')
+    return results, loans_by_user
+
+
+def return_books(db, loan_ids):
+    """Return a batch of loans by id
+
+    The status changes go through LoanRepository.mark_returned_many, which
+    reports the loans this call actually returned even when another desk
+    returns some of them at the same time. Returns
+    (results, returns_by_user) where returns_by_user maps a user id to
+    (user, [(loan, days_late, penalty), ...]).
+    """
+    def operation(session):
+        results = [{'index': index, 'loan_id': loan_id} for index, loan_id in enumerate(loan_ids)]
+        oids = set(filter(None, (parse_object_id(loan_id) for loan_id in loan_ids)))
+        loan_repository = LoanRepository(db)
+        loans = loan_repository.by_ids(oids, session)
+
+        returned_date = datetime.now()
+        updates = {}
+        for result, loan_id in zip(results, loan_ids):
+            loan = loans.get(parse_object_id(loan_id))
+            if not loan:
+                result['error'] = "Borrowed book record not found"
+            elif loan['status'] != 'borrowed' or loan['_id'] in updates:
+                result['error'] = "Book has already been returned"
+            else:
+                days_late, penalty = calculate_penalty(loan['return_date'], returned_date)
+                updates[loan['_id']] = {
+                    'returned_date': returned_date,
+                    'days_late': days_late,
+                    'penalty_amount': penalty
+                }
+                result.update(days_late=days_late, penalty=penalty)
+
+        returned = set()
+        if updates:
+            returned = loan_repository.mark_returned_many(updates, session)
+
+        copies = {}
+        penalties = {}
+        returns = {}
+        for result, loan_id in zip(results, loan_ids):
+            loan = loans.get(parse_object_id(loan_id))
+            if 'error' in result:
+                continue
+            if loan['_id'] not in returned:
+                # Returned by someone else between our read and our write
+                result['error'] = "Book has already been returned"
+                del result['days_late'], result['penalty']
+                continue
+            loan['returned_date'] = returned_date
+            copies[loan['book_id']] = copies.get(loan['book_id'], 0) + 1
+            count, penalty = penalties.get(loan['user_id'], (0, 0))
+            penalties[loan['user_id']] = (count + 1, penalty + result['penalty'])
+            returns.setdefault(loan['user_id'], []).append((loan, result['days_late'], result['penalty']))
+
+        returns_by_user = {}
+        if returned:
+            user_repository = UserRepository(db)
+            BookRepository(db).release_copies(copies, session)
+            user_repository.increment_many({
+                user_id: {'total_penalty': penalty, 'active_loans': -count}
+                for user_id, (count, penalty) in penalties.items()
+            }, session)
+            count_loans(db, -len(returned), session)
+            users = user_repository.by_user_ids(returns, USER_FIELDS, session)
+            returns_by_user = {user_id: (users.get(user_id), user_returns) for user_id, user_returns in returns.items()}
+
+        for result in results:
+            result['status'] = 'error' if 'error' in result else 'ok'
+        return results, returns_by_user
+
+    results, returns_by_user = run_in_transaction(db, operation)
+    if returns_by_user:
+        http_cache.bump(db, 'books', 'borrowed_books')
+    return results, returns_by_user
+
+
+def legacy_lend_book(db, book_id, user_id, return_date):
+    """The original check-then-write lend sequence, kept only for the stress comparison"""
+    book = db.books.find_one({'_id': ObjectId(book_id)})
+    user = db.users.find_one({'userId': user_id})
+    if not book or not user or book['book_count'] <= book.get('borrowed_count', 0):
+        return False
+    db.borrowed_books.insert_one({'book_id': book_id, 'user_id': user_id, 'return_date': return_date, 'status': 'borrowed'})
+    db.books.update_one({'_id': ObjectId(book_id)}, {'$inc': {'borrowed_count': 1, 'available_copies': -1}})
+    return True
+
+
+def stress_test(db, attempts=500, copies=5, workers=50):
+    """Fire parallel lends at one title; reports over-lending and latency for both implementations
+
+    Uses the given (scratch) database, which is wiped first.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+
+    results = {}
+    for name in ('legacy', 'atomic'):
+        for collection in ('books', 'users', 'borrowed_books', STATS_COLLECTION):
+            db[collection].drop()
+        book_id = str(db.books.insert_one({
+            'title': 'Stress Test', 'author': 'Load', 'isbn': '000', 'department': 'CSE',
+            'book_count': copies, 'borrowed_count': 0, 'available_copies': copies
+        }).inserted_id)
+        db.users.insert_many([{'userId': f'u{i}', 'name': f'User {i}', 'email': f'u{i}@example.com'}
+                              for i in range(attempts)])
+
+        def attempt(i):
+            start = time.perf_counter()
+            if name == 'legacy':
+                succeeded = legacy_lend_book(db, book_id, f'u{i}', datetime.now())
+            else:
+                try:
+                    lend_book(db, book_id, f'u{i}', datetime.now())
+                    succeeded = True
+                except CirculationError:
+                    succeeded = False
+            return succeeded, time.perf_counter() - start
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = list(executor.map(attempt, range(attempts)))
+
+        latencies = sorted(latency for _, latency in outcomes)
+        loans = db.borrowed_books.count_documents({'book_id': book_id})
+        results[name] = {
+            'copies': copies,
+            'successful_lends': sum(1 for succeeded, _ in outcomes if succeeded),
+            'loans_recorded': loans,
+            'over_lent': max(loans - copies, 0),
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 2),
+            'p95_ms': round(latencies[int(len(latencies) * 0.95)] * 1000, 2)
+        }
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description='Concurrency stress test for lending')
+    parser.add_argument('--attempts', type=int, default=500)
+    parser.add_argument('--copies', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=50)
+    parser.add_argument('--db', default='library_stress', help='scratch database (dropped collections!)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    from database import get_client
+    failed = False
+    for name, result in stress_test(get_client()[args.db], args.attempts, args.copies, args.workers).items():
+        print(f"{name}: {result['loans_recorded']} loans for {result['copies']} copies "
+              f"(over-lent {result['over_lent']}), p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms")
+        failed = failed or (name == 'atomic' and result['over_lent'] > 0)
+    if failed:
+        raise SystemExit("Atomic lending over-lent a title")
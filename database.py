@@ -0,0 +1,89 @@
+from pymongo import MongoClient
+from werkzeug.local import LocalProxy
+import metrics
+import os
+import threading
+
+DATABASE_NAME = os.getenv('MONGODB_DATABASE', 'library_db')
+
+# Connection pool and timeouts, per worker process
+MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '50'))
+MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+
+# Durability and routing; "majority" writes survive a failover, and reads may be
+# sent to secondaries (e.g. secondaryPreferred) when slightly stale data is fine
+WRITE_CONCERN = os.getenv('MONGO_WRITE_CONCERN', 'majority')
+WRITE_CONCERN_TIMEOUT_MS = int(os.getenv('MONGO_WRITE_CONCERN_TIMEOUT_MS', '10000'))
+READ_PREFERENCE = os.getenv('MONGO_READ_PREFERENCE', 'primary')
+RETRY_WRITES = os.getenv('MONGO_RETRY_WRITES', 'true').lower() == 'true'
+RETRY_READS = os.getenv('MONGO_RETRY_READS', 'true').lower() == 'true'
+
+state = {'client': None, 'pid': None}
+lock = threading.Lock()
+
+
+def write_concern_option(value):
+    """Parse MONGO_WRITE_CONCERN: a node count such as 1, or a tag such as majority"""
+    return int(value) if value.isdigit() else value
+
+
+def client_options():
+    """Pool, timeout and durability settings shared by MongoClient and the async API's Motor client"""
+    return {
+        'maxPoolSize': MAX_POOL_SIZE,
+        'minPoolSize': MIN_POOL_SIZE,
+        'connectTimeoutMS': CONNECT_TIMEOUT_MS,
+        'serverSelectionTimeoutMS': SERVER_SELECTION_TIMEOUT_MS,
+        'socketTimeoutMS': SOCKET_TIMEOUT_MS,
+        'waitQueueTimeoutMS': WAIT_QUEUE_TIMEOUT_MS,
+        'w': write_concern_option(WRITE_CONCERN),
+        'wTimeoutMS': WRITE_CONCERN_TIMEOUT_MS,
+        'readPreference': READ_PREFERENCE,
+        'retryWrites': RETRY_WRITES,
+        'retryReads': RETRY_READS,
+        'event_listeners': [metrics.command_listener]
+    }
+
+
+def create_client():
+    return MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'), **client_options())
+
+
+def get_client():
+    """The MongoClient of the current process
+
+    MongoClient is not fork-safe, so a forked worker never reuses its parent's
+    client; it creates its own the first time it touches the database.
+    """
+    pid = os.getpid()
+    if state['pid'] != pid:
+        with lock:
+            if state['pid'] != pid:
+                state['client'] = create_client()
+                state['pid'] = pid
+    return state['client']
+
+
+def get_db():
+    return get_client()[DATABASE_NAME]
+
+
+def close_client():
+    """Close this process's client, e.g. in a pre-fork master before workers are started"""
+    with lock:
+        if state['client'] is not None and state['pid'] == os.getpid():
+            state['client'].close()
+        state['client'] = None
+        state['pid'] = None
+
+
+# Module-level handles that resolve to the current process's database on every use
+db = LocalProxy(get_db)
+
+
+def collection_proxy(name):
+    return LocalProxy(lambda: get_db()[name])
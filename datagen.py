@@ -0,0 +1,217 @@
+from datetime import datetime, timedelta
+import argparse
+import random
+import time
+
+from dotenv import load_dotenv
+
+from catalog_search import search_fields
+from circulation import PENALTY_PER_DAY
+from repositories import LOAN_HISTORY_COLLECTION
+
+DEPARTMENTS = ['CSE', 'ECE', 'EEE', 'MECH', 'CIVIL', 'IT', 'MBA', 'MCA']
+TITLE_WORDS = ['data', 'systems', 'introduction', 'computer', 'networks', 'theory', 'applied', 'modern',
+               'engineering', 'analysis', 'design', 'principles', 'digital', 'signals', 'machine', 'learning',
+               'structures', 'algorithms', 'operating', 'database', 'control', 'power', 'thermodynamics',
+               'mechanics', 'circuits', 'management', 'finance', 'marketing', 'statistics', 'calculus']
+FIRST_NAMES = ['Arjun', 'Priya', 'Rahul', 'Sneha', 'Vikram', 'Ananya', 'Kiran', 'Divya', 'Suresh', 'Lakshmi',
+               'Ravi', 'Meera', 'Aditya', 'Pooja', 'Naveen', 'Swathi']
+LAST_NAMES = ['Reddy', 'Kumar', 'Rao', 'Sharma', 'Nair', 'Iyer', 'Khan', 'Naidu', 'Varma', 'Gupta', 'Das', 'Pillai']
+
+# Loan period used by the lend form
+LOAN_DAYS = 14
+# How far back returned loans go
+HISTORY_DAYS = 3 * 365
+
+BATCH_SIZE = 5000
+
+# Collections emptied before generating
+GENERATED_COLLECTIONS = ('books', 'users', 'borrowed_books', LOAN_HISTORY_COLLECTION, 'email_outbox',
+                         'library_stats', 'cache_versions', 'departments')
+
+
+def insert_batches(collection, documents, batch_size=BATCH_SIZE):
+    """insert_many in batches from a generator; returns the number inserted"""
+    inserted = 0
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            collection.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+
+def generate_users(rng, count, now):
+    for i in range(count):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        yield {
+            'userId': f"U{i:06d}",
+            'name': f"{first} {last}",
+            'email': f"{first.lower()}.{last.lower()}.{i}@example.com",
+            # About one account in fifty belongs to staff
+            'role': 'staff' if rng.random() < 0.02 else 'user',
+            'password': 'password',
+            'department': rng.choice(DEPARTMENTS),
+            'active_loans': 0,
+            'total_penalty': 0,
+            'created_at': now - timedelta(days=rng.randint(0, HISTORY_DAYS))
+        }
+
+
+def generate_books(rng, count, now):
+    for i in range(count):
+        book_count = rng.randint(1, 10)
+        book = {
+            'title': ' '.join(rng.sample(TITLE_WORDS, rng.randint(2, 4))).title(),
+            'author': f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            'isbn': f"978-{i % 10}-{i:07d}",
+            'department': rng.choice(DEPARTMENTS),
+            'book_count': book_count,
+            'borrowed_count': 0,
+            'available_copies': book_count,
+            'cover_image': None,
+            'created_at': now - timedelta(days=rng.randint(0, HISTORY_DAYS))
+        }
+        book.update(search_fields(book))
+        yield book
+
+
+def generate_loans(rng, count, books, users, now, active_fraction, overdue_fraction, on_loan, penalties):
+    """Loan documents shaped like the ones circulation.lend_book writes
+
+    books is a list of (book_id, title, author, isbn, department, copies) and
+    users a list of userIds. Active loans never exceed a book's copies;
+    on_loan and penalties collect the per-book and per-user totals.
+    """
+    for _ in range(count):
+        book_id, title, author, isbn, department, copies = rng.choice(books)
+        user_id = rng.choice(users)
+        loan = {
+            'book_id': book_id,
+            'user_id': user_id,
+            'book_title': title,
+            'author': author,
+            'isbn': isbn,
+            'department': department
+        }
+        active = rng.random() < active_fraction and on_loan.get(book_id, 0) < copies
+        if active:
+            overdue = rng.random() < overdue_fraction
+            # Overdue loans were taken out more than a loan period ago
+            days_ago = rng.randint(LOAN_DAYS + 1, LOAN_DAYS + 60) if overdue else rng.randint(0, LOAN_DAYS - 1)
+            borrowed_date = now - timedelta(days=days_ago, minutes=rng.randint(0, 600))
+            return_date = borrowed_date + timedelta(days=LOAN_DAYS)
+            loan.update({
+                'borrowed_date': borrowed_date,
+                'return_date': return_date,
+                'status': 'borrowed',
+                'next_reminder_at': return_date
+            })
+            on_loan[book_id] = on_loan.get(book_id, 0) + 1
+        else:
+            borrowed_date = now - timedelta(days=rng.randint(LOAN_DAYS + 30, HISTORY_DAYS), minutes=rng.randint(0, 600))
+            return_date = borrowed_date + timedelta(days=LOAN_DAYS)
+            # Most books come back on time; the rest up to three weeks late
+            returned_date = return_date - timedelta(days=rng.randint(0, 10)) if rng.random() < 0.8 \
+                else return_date + timedelta(days=rng.randint(1, 21))
+            days_late = max((returned_date - return_date).days, 0)
+            loan.update({
+                'borrowed_date': borrowed_date,
+                'return_date': return_date,
+                'returned_date': returned_date,
+                'status': 'returned',
+                'days_late': days_late,
+                'penalty_amount': days_late * PENALTY_PER_DAY
+            })
+            if days_late:
+                penalties[user_id] = penalties.get(user_id, 0) + days_late * PENALTY_PER_DAY
+        yield loan
+
+
+def generate(db, books=100000, users=50000, loans=2000000, active_fraction=0.05, overdue_fraction=0.3,
+             seed=42, now=None):
+    """Fill db with a synthetic library; the same seed always produces the same data
+
+    Existing books, users, loans and derived collections in db are dropped.
+    Returns the counts generated and the time taken.
+    """
+    from pymongo import UpdateOne
+    from migrations import migrate
+    from stats import rebuild_stats
+    from departments import rebuild_departments
+
+    rng = random.Random(seed)
+    now = now or datetime.now().replace(microsecond=0)
+    start = time.perf_counter()
+    for name in GENERATED_COLLECTIONS:
+        db[name].drop()
+
+    summary = {'seed': seed}
+    summary['users'] = insert_batches(db.users, generate_users(rng, users, now))
+    summary['books'] = insert_batches(db.books, generate_books(rng, books, now))
+
+    book_rows = [(book['_id'], book['title'], book['author'], book['isbn'], book['department'], book['book_count'])
+                 for book in db.books.find({}, {'title': 1, 'author': 1, 'isbn': 1, 'department': 1, 'book_count': 1})
+                 .sort('_id', 1)]
+    user_ids = [f"U{i:06d}" for i in range(users)]
+    on_loan = {}
+    penalties = {}
+    summary['loans'] = insert_batches(db.borrowed_books, generate_loans(
+        rng, loans, book_rows, user_ids, now, active_fraction, overdue_fraction, on_loan, penalties
+    ))
+
+    # Keep the denormalized counts in step with the loans
+    book_operations = [
+        UpdateOne({'_id': book_id}, [{'$set': {
+            'borrowed_count': count,
+            'available_copies': {'$subtract': ['$book_count', count]}
+        }}])
+        for book_id, count in on_loan.items()
+    ]
+    user_operations = [
+        UpdateOne({'userId': user_id}, {'$set': {'total_penalty': penalty}})
+        for user_id, penalty in penalties.items()
+    ]
+    for i in range(0, len(book_operations), BATCH_SIZE):
+        db.books.bulk_write(book_operations[i:i + BATCH_SIZE], ordered=False)
+    for i in range(0, len(user_operations), BATCH_SIZE):
+        db.users.bulk_write(user_operations[i:i + BATCH_SIZE], ordered=False)
+
+    # Indexes are built once the data is in, which is much faster than maintaining them during the load
+    migrate(db)
+    rebuild_stats(db)
+    rebuild_departments(db)
+
+    summary['active_loans'] = sum(on_loan.values())
+    summary['overdue_loans'] = db.borrowed_books.count_documents({'status': 'borrowed', 'return_date': {'$lt': now}})
+    summary['duration_seconds'] = round(time.perf_counter() - start, 1)
+    return summary
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    from database import DATABASE_NAME, get_client
+
+    parser = argparse.ArgumentParser(description='Generate a synthetic library dataset for benchmarks')
+    parser.add_argument('--db', default='library_bench', help='database to fill (its contents are replaced)')
+    parser.add_argument('--books', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--loans', type=int, default=2000000, help='loans in total, current and returned')
+    parser.add_argument('--active-fraction', type=float, default=0.05, help='share of loans still borrowed')
+    parser.add_argument('--overdue-fraction', type=float, default=0.3, help='share of borrowed loans that are overdue')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help='allow replacing the application database')
+    args = parser.parse_args()
+
+    if args.db == DATABASE_NAME and not args.force:
+        parser.error(f"{args.db} is the application database; pass --force to replace its contents")
+    summary = generate(get_client()[args.db], args.books, args.users, args.loans,
+                       args.active_fraction, args.overdue_fraction, args.seed)
+    print(f"Generated {summary['books']} books, {summary['users']} users and {summary['loans']} loans "
+          f"({summary['active_loans']} borrowed, {summary['overdue_loans']} overdue) "
+          f"in {summary['duration_seconds']}s")
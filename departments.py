@@ -0,0 +1,132 @@
+from pymongo import UpdateOne
+from datetime import datetime
+import os
+import threading
+import time
+
+from repositories import BookRepository, DepartmentRepository
+import http_cache
+
+# Seconds a worker serves the list from memory before checking whether another worker changed it
+CHECK_INTERVAL = float(os.getenv('DEPARTMENTS_CHECK_INTERVAL', '5'))
+
+cache = {'departments': None, 'version': None, 'checked_at': 0.0}
+cache_lock = threading.Lock()
+
+
+def invalidate_cache():
+    with cache_lock:
+        cache['departments'] = None
+
+
+def apply_changes(db, changes):
+    """Apply {department: (titles delta, copies delta)} to the registry
+
+    Departments left without titles are removed. Other workers notice the
+    change through the shared 'departments' change counter.
+    """
+    now = datetime.now()
+    operations = [
+        UpdateOne({'_id': name}, {'$inc': {'titles': titles, 'copies': copies}, '$set': {'updated_at': now}}, upsert=True)
+        for name, (titles, copies) in changes.items()
+        if name and (titles or copies)
+    ]
+    if not operations:
+        return
+    DepartmentRepository(db).apply(operations)
+    http_cache.bump(db, 'departments')
+    invalidate_cache()
+
+
+def copy_count(book, default=0):
+    """A book's copies as an int
+
+    Values that are not whole numbers count as 0, the same way
+    rebuild_departments' $sum skips them.
+    """
+    value = book.get('book_count', default)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    return 0
+
+
+def book_added(db, book):
+    apply_changes(db, {book.get('department'): (1, copy_count(book))})
+
+
+def book_removed(db, book):
+    apply_changes(db, {book.get('department'): (-1, -copy_count(book))})
+
+
+def book_updated(db, previous, changes):
+    """Move a book's counts when its department or copies change; previous holds the old values"""
+    old_department, old_copies = previous.get('department'), copy_count(previous)
+    new_department = changes.get('department', old_department)
+    new_copies = copy_count(changes, old_copies)
+    if new_department == old_department:
+        apply_changes(db, {new_department: (0, new_copies - old_copies)})
+    else:
+        apply_changes(db, {old_department: (-1, -old_copies), new_department: (1, new_copies)})
+
+
+def rebuild_departments(db):
+    """Recount every department from the books; repairs drift and covers bulk imports"""
+    counts = BookRepository(db).department_totals()
+    now = datetime.now()
+    operations = [
+        UpdateOne({'_id': name}, {'$set': {'titles': row['titles'], 'copies': row['copies'], 'updated_at': now}}, upsert=True)
+        for name, row in counts.items()
+    ]
+    DepartmentRepository(db).replace(operations, counts)
+    http_cache.bump(db, 'departments')
+    invalidate_cache()
+
+
+def load_departments(db):
+    return [
+        {'name': doc['_id'], 'titles': doc.get('titles', 0), 'copies': doc.get('copies', 0)}
+        for doc in DepartmentRepository(db).all()
+    ]
+
+
+def get_departments(db):
+    """Departments sorted by name, each with its title and copy counts
+
+    Served from memory; the shared change counter is read at most every
+    CHECK_INTERVAL seconds and the registry only when it has changed.
+    """
+    now = time.monotonic()
+    with cache_lock:
+        if cache['departments'] is not None and now - cache['checked_at'] < CHECK_INTERVAL:
+            return cache['departments']
+
+    version = http_cache.versions(db, ('departments',))[0]
+    with cache_lock:
+        if cache['departments'] is not None and cache['version'] == version:
+            cache['checked_at'] = now
+            return cache['departments']
+
+    departments = load_departments(db)
+    if not departments and BookRepository(db).exists():
+        # First use on this database: build the registry from the books
+        rebuild_departments(db)
+        version = http_cache.versions(db, ('departments',))[0]
+        departments = load_departments(db)
+
+    with cache_lock:
+        cache['departments'] = departments
+        cache['version'] = version
+        cache['checked_at'] = now
+    return departments
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from database import get_db
+    db = get_db()
+    rebuild_departments(db)
+    print(f"Rebuilt the department registry: {len(load_departments(db))} departments")
@@ -0,0 +1,43 @@
+import multiprocessing
+import os
+import tempfile
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5432')
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Threads per worker; requests mostly wait on MongoDB, so a few threads per process help
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+worker_class = 'gthread' if threads > 1 else 'sync'
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '30'))
+keepalive = 5
+
+# Import the app (and compile its templates) once in the master; workers share it copy-on-write
+preload_app = True
+
+# Restart workers now and then to bound memory growth
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', '1000'))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# Workers share their metrics through this directory, so a scrape of /metrics on
+# any worker reports the whole server (see metrics.py); one directory per server
+os.environ.setdefault('METRICS_DIR', os.path.join(tempfile.gettempdir(), f"library_metrics_{os.getpid()}"))
+
+
+def on_starting(server):
+    from metrics import clear_directory
+    clear_directory()
+
+
+def post_fork(server, worker):
+    # Threads do not survive fork, so each worker starts its own mail worker;
+    # its MongoClient is created on first use (database.get_client)
+    from app import start_background_workers
+    start_background_workers()
+
+
+def worker_exit(server, worker):
+    # Keep the exiting worker's counts, e.g. when max_requests recycles it
+    from metrics import retire
+    retire()
@@ -0,0 +1,181 @@
+from flask import request, session, make_response, g
+from collections import OrderedDict
+from functools import wraps
+import gzip
+import hashlib
+import os
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Collection holding one change counter per tracked collection
+VERSIONS_COLLECTION = 'cache_versions'
+
+# Rendered bodies kept in memory per worker
+CACHE_SIZE = int(os.getenv('HTTP_CACHE_SIZE', '256'))
+CACHE_ENABLED = os.getenv('HTTP_CACHE_ENABLED', 'true').lower() == 'true'
+
+# Responses smaller than this are not worth compressing
+COMPRESS_MIN_SIZE = int(os.getenv('HTTP_COMPRESS_MIN_SIZE', '1024'))
+COMPRESSIBLE_TYPES = ('application/json', 'text/html')
+
+
+class LRUCache:
+    """A bounded, thread-safe mapping that evicts the least recently used entry"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+
+body_cache = LRUCache(CACHE_SIZE)
+
+
+def bump(db, *collections):
+    """Record that collections changed; every ETag derived from them changes too"""
+    for name in collections:
+        db[VERSIONS_COLLECTION].update_one({'_id': name}, {'$inc': {'version': 1}}, upsert=True)
+
+
+def versions(db, collections):
+    """Current change counter of each collection, in the given order"""
+    found = {doc['_id']: doc['version'] for doc in db[VERSIONS_COLLECTION].find({'_id': {'$in': list(collections)}})}
+    return [found.get(name, 0) for name in collections]
+
+
+def request_key():
+    """Route, query string and viewer; pages show the signed-in user's name, so the user is part of it"""
+    query = '&'.join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+    return f"{request.endpoint}?{query}|{session.get('role')}|{session.get('user_id')}"
+
+
+def uncacheable():
+    """Mark the response being rendered as not worth caching, e.g. a page showing a placeholder"""
+    g.http_cache_skip = True
+
+
+def cached(db, *collections, window=None):
+    """Serve GET responses with an ETag derived from the collections' change counters
+
+    Requests carrying a matching If-None-Match get a 304. Rendered bodies are
+    kept in an LRU keyed by route, query and viewer, so unchanged pages are
+    not rendered again until one of the collections changes. window, if given,
+    returns a value that is part of the ETag too, e.g. the period in which
+    the page's signed URLs stay valid.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET' or not CACHE_ENABLED:
+                return view(*args, **kwargs)
+
+            key = request_key()
+            version = versions(db, collections)
+            if window is not None:
+                version.append(window())
+            etag = hashlib.sha1(f"{key}|{version}".encode()).hexdigest()
+
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+                response.set_etag(etag, weak=True)
+                return response
+
+            entry = body_cache.get(key)
+            if entry and entry['etag'] == etag:
+                response = make_response(entry['body'], 200)
+                response.mimetype = entry['mimetype']
+                for header, value in entry['headers']:
+                    response.headers[header] = value
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed or g.pop('http_cache_skip', False):
+                    return response
+                body_cache.set(key, {
+                    'etag': etag,
+                    'body': response.get_data(),
+                    'mimetype': response.mimetype,
+                    # e.g. X-Next-Cursor and Link on paginated API responses
+                    'headers': [(header, value) for header, value in response.headers.items()
+                                if header not in ('Content-Type', 'Content-Length')]
+                })
+            response.set_etag(etag, weak=True)
+            # Browsers may keep the page but must revalidate it on every use
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def compressed_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def accepted_encoding():
+    if brotli is not None and 'br' in request.accept_encodings:
+        return 'br'
+    if 'gzip' in request.accept_encodings:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook: gzip (or brotli, when installed) large JSON and HTML bodies"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding()
+    if not encoding:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+
+    # Cached pages come back with the same ETag, so their compressed form is reused
+    etag = response.get_etag()[0]
+    cache_key = f"{encoding}|{etag}" if etag else None
+    body = body_cache.get(cache_key) if cache_key else None
+    if body is None:
+        body = compressed_body(data, encoding)
+        if cache_key:
+            body_cache.set(cache_key, body)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    app.after_request(compress_response)
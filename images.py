@@ -0,0 +1,236 @@
+from PIL import Image, ImageOps
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import time
+
+import http_cache
+
+# Resized copies generated for every cover, as (max width, max height)
+VARIANTS = {
+    'thumb': (200, 300),
+    'medium': (480, 720)
+}
+UPLOAD_PREFIX = 'uploads'
+VARIANT_DIR = 'variants'
+JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '82'))
+
+# Extension and content type stored for each format Pillow detects
+FORMAT_EXTENSIONS = {'JPEG': 'jpeg', 'PNG': 'png', 'GIF': 'gif'}
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}
+
+CHUNK_SIZE = 64 * 1024
+# Uploads larger than this are spooled to a temporary file instead of memory
+SPOOL_SIZE = 1024 * 1024
+
+# Variants are generated in the background, off the request path
+executor = ThreadPoolExecutor(max_workers=int(os.getenv('IMAGE_WORKERS', '2')), thread_name_prefix='images')
+
+# Keys known to exist in storage; objects are content-addressed so they never change
+known_keys = set()
+known_keys_lock = threading.Lock()
+# Keys found missing, with when to look again, so pages listing books whose
+# variants are not generated yet do not send a HEAD request per cover
+missing_keys = {}
+MISSING_KEY_TTL = float(os.getenv('IMAGE_MISSING_KEY_TTL', '30'))
+
+
+def normalize_key(cover_image):
+    """Storage key for a stored cover_image value (older values use backslashes)"""
+    return cover_image.replace('\\', '/')
+
+
+def image_extension(stream):
+    """Extension for the image in stream; raises ValueError if it is not a supported image"""
+    try:
+        with Image.open(stream) as image:
+            image_format = image.format
+            image.verify()
+    except Exception:
+        raise ValueError("Cover image is not a valid image file")
+    if image_format not in FORMAT_EXTENSIONS:
+        raise ValueError(f"Unsupported image format: {image_format}")
+    return FORMAT_EXTENSIONS[image_format]
+
+
+def spool(stream):
+    """Copy a stream into a temporary file while hashing it; returns (file, sha256 hex)"""
+    digest = hashlib.sha256()
+    spooled = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled, digest.hexdigest()
+
+
+def store_image(storage, stream):
+    """Store an image under the hash of its contents; returns its key, e.g. 'uploads/<sha256>.jpeg'
+
+    Identical images are stored once.
+    """
+    spooled, digest = spool(stream)
+    with spooled:
+        extension = image_extension(spooled)
+        key = f"{UPLOAD_PREFIX}/{digest}.{extension}"
+        if not storage.exists(key):
+            spooled.seek(0)
+            storage.save(key, spooled, CONTENT_TYPES[extension])
+    return key
+
+
+def store_upload(upload, storage, on_variants=None):
+    """Store an uploaded cover and generate its variants in the background; returns its key
+
+    on_variants is called once new variants have been stored.
+    """
+    key = store_image(storage, upload.stream)
+    schedule_variants(storage, key, on_variants)
+    return key
+
+
+def variant_key(key, variant):
+    """Key of a variant, e.g. 'uploads/variants/<sha256>_thumb.jpeg' for 'uploads/<sha256>.png'"""
+    directory, filename = os.path.split(key)
+    stem = os.path.splitext(filename)[0]
+    return f"{directory}/{VARIANT_DIR}/{stem}_{variant}.jpeg"
+
+
+def generate_variants(storage, key):
+    """Store every missing resized variant of an image; returns how many were created"""
+    missing = {variant: size for variant, size in VARIANTS.items() if not storage.exists(variant_key(key, variant))}
+    if not missing:
+        return 0
+    with storage.open(key) as original_stream:
+        data = io.BytesIO(original_stream.read())
+    with Image.open(data) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha channel; flatten transparent covers onto white
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+        for variant, size in missing.items():
+            resized = image.copy()
+            resized.thumbnail(size, Image.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+            output.seek(0)
+            storage.save(variant_key(key, variant), output, 'image/jpeg')
+            with known_keys_lock:
+                missing_keys.pop(variant_key(key, variant), None)
+    return len(missing)
+
+
+def schedule_variants(storage, key, on_variants=None):
+    def run():
+        try:
+            if generate_variants(storage, key) and on_variants:
+                on_variants()
+        except Exception as e:
+            print(f"Error generating variants for {key}: {str(e)}")
+    executor.submit(run)
+
+
+def key_exists(storage, key):
+    now = time.time()
+    with known_keys_lock:
+        if key in known_keys:
+            return True
+        if missing_keys.get(key, 0) > now:
+            return False
+    if not storage.exists(key):
+        with known_keys_lock:
+            missing_keys[key] = now + MISSING_KEY_TTL
+        return False
+    with known_keys_lock:
+        known_keys.add(key)
+        missing_keys.pop(key, None)
+    return True
+
+
+def cover_url(storage, cover_image, variant=None):
+    """URL of a cover's variant, falling back to the original until the variant exists"""
+    if not cover_image:
+        return cover_image
+    key = normalize_key(cover_image)
+    if variant:
+        candidate = variant_key(key, variant)
+        if key_exists(storage, candidate):
+            return storage.url(candidate)
+    return storage.url(key)
+
+
+def backfill(db, storage, prune=False):
+    """Move existing covers to content-addressed keys, generate their variants and repoint books
+
+    With prune, originals no book refers to any more are deleted.
+    Returns a summary of the work done.
+    """
+    from pymongo import UpdateOne
+
+    summary = {'books_updated': 0, 'unique_images': 0, 'variants_created': 0, 'files_removed': 0, 'bytes_freed': 0}
+    stored = {}
+    operations = []
+    for book in db.books.find({'cover_image': {'$nin': [None, '']}}, {'cover_image': 1}):
+        key = normalize_key(book['cover_image'])
+        if key not in stored:
+            if not storage.exists(key):
+                print(f"Missing cover for book {book['_id']}: {key}")
+                continue
+            try:
+                with storage.open(key) as stream:
+                    stored[key] = store_image(storage, stream)
+            except ValueError as e:
+                print(f"Skipping {key}: {str(e)}")
+                continue
+        if stored[key] != book['cover_image']:
+            operations.append(UpdateOne({'_id': book['_id']}, {'$set': {'cover_image': stored[key]}}))
+    if operations:
+        db.books.bulk_write(operations, ordered=False)
+    summary['books_updated'] = len(operations)
+
+    content_addressed = set(stored.values())
+    summary['unique_images'] = len(content_addressed)
+    for key in content_addressed:
+        summary['variants_created'] += generate_variants(storage, key)
+    if summary['books_updated'] or summary['variants_created']:
+        # Cached pages still link to the old covers
+        http_cache.bump(db, 'books')
+
+    if prune:
+        referenced = set(normalize_key(key) for key in db.books.distinct('cover_image') if key)
+        for key in storage.list_keys(UPLOAD_PREFIX):
+            if key not in referenced:
+                summary['bytes_freed'] += storage.size(key)
+                storage.delete(key)
+                summary['files_removed'] += 1
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from storage import get_storage
+
+    parser = argparse.ArgumentParser(description='Cover image maintenance')
+    parser.add_argument('--backfill', action='store_true', help='de-duplicate existing covers and generate variants')
+    parser.add_argument('--prune', action='store_true', help='with --backfill, delete covers no book refers to')
+    parser.add_argument('--static-folder', default='static', help='root of the local storage backend')
+    args = parser.parse_args()
+
+    if args.backfill:
+        load_dotenv()
+        from database import get_db
+        summary = backfill(get_db(), get_storage(args.static_folder), args.prune)
+        print(f"Repointed {summary['books_updated']} books to {summary['unique_images']} unique images, "
+              f"created {summary['variants_created']} variants, removed {summary['files_removed']} files "
+              f"({summary['bytes_freed'] // 1024} KB)")
+    else:
+        parser.print_help()
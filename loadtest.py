@@ -0,0 +1,187 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+
+def client_loop(url, duration, cookie=None):
+    """Request url back to back for duration seconds; returns (latencies, errors)"""
+    latencies = []
+    errors = 0
+    headers = {'Cookie': cookie} if cookie else {}
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=30) as response:
+                response.read()
+            latencies.append(time.perf_counter() - start)
+        except (urllib.error.URLError, OSError):
+            errors += 1
+    return latencies, errors
+
+
+def client_process(url, duration, threads, cookie=None):
+    """One load-generating process running `threads` concurrent clients"""
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        results = list(executor.map(lambda _: client_loop(url, duration, cookie), range(threads)))
+    latencies = [latency for result in results for latency in result[0]]
+    return latencies, sum(result[1] for result in results)
+
+
+def percentile(values, fraction):
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else None
+
+
+def run_load(url, duration=10, concurrency=32, processes=None, cookie=None):
+    """Drive url with `concurrency` clients spread over several processes; returns a report"""
+    # Several client processes, so the load generator is not limited by one GIL
+    processes = processes or min(os.cpu_count() or 1, concurrency)
+    per_process = [concurrency // processes + (1 if i < concurrency % processes else 0) for i in range(processes)]
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [executor.submit(client_process, url, duration, threads, cookie) for threads in per_process if threads]
+        results = [future.result() for future in futures]
+
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': sum(result[1] for result in results),
+        'requests_per_second': round(len(latencies) / duration, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None
+    }
+
+
+def wait_until_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=2).read()
+            return True
+        except urllib.error.HTTPError:
+            return True
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.2)
+    return False
+
+
+def start_gunicorn(workers, port, threads):
+    env = dict(os.environ, GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads),
+               GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_ACCESS_LOG='/dev/null')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+
+
+def start_uvicorn(workers, port):
+    """The async API (asgi_api.py) under uvicorn"""
+    return subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'asgi_api:app', '--host', '127.0.0.1', '--port', str(port),
+         '--workers', str(workers), '--no-access-log', '--log-level', 'warning', '--backlog', '4096'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True
+    )
+
+
+def start_server(server, workers, port, threads):
+    if server == 'asgi':
+        return start_uvicorn(workers, port)
+    return start_gunicorn(workers, port, threads)
+
+
+def scaling_test(path, worker_counts, duration, concurrency, port=8765, threads=1, cookie=None, server='flask'):
+    """Start the server with each worker count in turn and load it; shows how throughput scales with cores"""
+    reports = []
+    for workers in worker_counts:
+        process = start_server(server, workers, port, threads)
+        try:
+            url = f"http://127.0.0.1:{port}{path}"
+            if not wait_until_ready(url):
+                raise RuntimeError(f"{server} with {workers} workers did not start")
+            report = run_load(url, duration, concurrency, cookie=cookie)
+            report['workers'] = workers
+            reports.append(report)
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+    return reports
+
+
+def concurrency_test(path, levels, duration, port=8765, threads=4):
+    """Load the Flask API and the async API with one worker each at increasing connection counts
+
+    A single worker uses at most one core, so requests per second at each
+    level is the throughput per core; errors and p99 show where a server
+    stops keeping up with its open connections.
+    """
+    reports = []
+    for server in ('flask', 'asgi'):
+        process = start_server(server, 1, port, threads)
+        try:
+            url = f"http://127.0.0.1:{port}{path}"
+            if not wait_until_ready(url):
+                raise RuntimeError(f"{server} did not start")
+            for concurrency in levels:
+                report = run_load(url, duration, concurrency)
+                report['server'] = server
+                reports.append(report)
+                print_report(report)
+        finally:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait()
+    return reports
+
+
+def print_report(report):
+    if 'server' in report:
+        prefix = f"{report['server']}, {report['concurrency']} connections: "
+    else:
+        prefix = f"{report['workers']} workers: " if 'workers' in report else ''
+    print(f"{prefix}{report['requests_per_second']} req/s over {report['requests']} requests "
+          f"({report['errors']} errors), p50 {report['p50_ms']} ms, p95 {report['p95_ms']} ms, p99 {report['p99_ms']} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='HTTP load test for the library app')
+    parser.add_argument('--url', help='load an already running server at this URL')
+    parser.add_argument('--path', default='/api/books', help='path requested by --workers runs')
+    parser.add_argument('--workers', default='1,2,4', help='comma separated gunicorn worker counts to compare')
+    parser.add_argument('--threads', type=int, help='gunicorn threads per worker (default 1 for --workers, 4 for --levels)')
+    parser.add_argument('--server', choices=('flask', 'asgi'), default='flask',
+                        help='serve --workers runs with gunicorn (flask) or uvicorn (asgi_api.py)')
+    parser.add_argument('--levels', help='comma separated connection counts; compares flask and asgi on one worker each')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--cookie', help='Cookie header, e.g. a logged-in session for HTML pages')
+    args = parser.parse_args()
+
+    if args.url:
+        print_report(run_load(args.url, args.duration, args.concurrency, cookie=args.cookie))
+    elif args.levels:
+        levels = [int(level) for level in args.levels.split(',')]
+        reports = concurrency_test(args.path, levels, args.duration, threads=args.threads or 4)
+        for concurrency in levels:
+            flask, asgi = [report for report in reports if report['concurrency'] == concurrency]
+            if flask['requests_per_second']:
+                print(f"{concurrency} connections: asgi {asgi['requests_per_second'] / flask['requests_per_second']:.2f}x "
+                      f"flask req/s per core, {asgi['errors']} vs {flask['errors']} errors")
+    else:
+        worker_counts = [int(count) for count in args.workers.split(',')]
+        reports = scaling_test(args.path, worker_counts, args.duration, args.concurrency,
+                               threads=args.threads or 1, cookie=args.cookie, server=args.server)
+        for report in reports:
+            print_report(report)
+        baseline = reports[0]['requests_per_second']
+        if baseline:
+            print(', '.join(f"{report['workers']} workers: {report['requests_per_second'] / baseline:.2f}x"
+                            for report in reports))
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+import argparse
+import os
+import time
+
+from repositories import LoanRepository
+from scheduler import check_lease
+
+# Returned loans stay in borrowed_books this long, so recent returns remain on the hot path
+ARCHIVE_AFTER = timedelta(days=float(os.getenv('LOAN_ARCHIVE_AFTER_DAYS', '30')))
+ARCHIVE_BATCH_SIZE = int(os.getenv('LOAN_ARCHIVE_BATCH_SIZE', '1000'))
+
+
+def archive_returned_loans(db, older_than=ARCHIVE_AFTER, batch_size=ARCHIVE_BATCH_SIZE, now=None):
+    """Move loans returned more than older_than ago from borrowed_books to loan_history
+
+    Each batch is copied with idempotent upserts before it is deleted, so an
+    interrupted run loses nothing and the next run finishes the batch.
+    Returns the number of loans archived, batches and duration.
+    """
+    cutoff = (now or datetime.now()) - older_than
+    summary = {'archived': 0, 'batches': 0, 'duration_seconds': 0.0}
+    start = time.perf_counter()
+    loan_repository = LoanRepository(db)
+    while True:
+        # Stop between batches if the scheduler lost this job's lease
+        check_lease()
+        loans = loan_repository.returned_before(cutoff, batch_size)
+        if not loans:
+            break
+        archived_at = datetime.now()
+        for loan in loans:
+            # The batch tag is only needed right after a batch return
+            loan.pop('return_batch', None)
+            loan['archived_at'] = archived_at
+        summary['archived'] += loan_repository.archive(loans)
+        summary['batches'] += 1
+    summary['duration_seconds'] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description='Move old returned loans to the loan history collection')
+    parser.add_argument('--older-than-days', type=float, default=ARCHIVE_AFTER.total_seconds() / 86400)
+    parser.add_argument('--db', help='database to archive in (default: MONGODB_DATABASE)')
+    args = parser.parse_args()
+
+    load_dotenv()
+    from database import get_client, get_db
+    db = get_client()[args.db] if args.db else get_db()
+    summary = archive_returned_loans(db, timedelta(days=args.older_than_days))
+    print(f"Archived {summary['archived']} loans in {summary['batches']} batches ({summary['duration_seconds']}s)")
@@ -0,0 +1,258 @@
+from pymongo import ReturnDocument
+from datetime import datetime, timedelta
+import os
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+
+import metrics
+
+# Outbox collection name
+OUTBOX_COLLECTION = 'email_outbox'
+
+# Worker settings
+BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', '50'))
+POLL_INTERVAL = float(os.getenv('MAIL_POLL_INTERVAL', '1'))
+MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS', '5'))
+RETRY_BASE_SECONDS = int(os.getenv('MAIL_RETRY_BASE_SECONDS', '30'))
+# Messages left in 'sending' longer than this are assumed to belong to a dead worker
+CLAIM_TIMEOUT_SECONDS = int(os.getenv('MAIL_CLAIM_TIMEOUT_SECONDS', '300'))
+# Close the SMTP connection after this many idle seconds
+IDLE_TIMEOUT_SECONDS = int(os.getenv('MAIL_IDLE_TIMEOUT_SECONDS', '60'))
+
+
+def smtp_settings_from_env():
+    """Read SMTP connection settings from the environment"""
+    return {
+        'server': os.getenv('SMTP_SERVER', 'smtp.gmail.com'),
+        'port': int(os.getenv('SMTP_PORT', '587')),
+        'username': os.getenv('SMTP_USERNAME'),
+        'password': os.getenv('SMTP_PASSWORD'),
+        'use_tls': os.getenv('SMTP_USE_TLS', 'true').lower() == 'true',
+        'sender': os.getenv('MAIL_FROM') or os.getenv('SMTP_USERNAME')
+    }
+
+
+def build_message(subject, body, to_email, sender):
+    """Build an HTML email message"""
+    msg = MIMEMultipart()
+    msg['From'] = sender
+    msg['To'] = to_email
+    msg['Subject'] = subject
+
+    msg.attach(MIMEText(body, 'html'))
+    return msg
+
+
+class SMTPSession:
+    """A reusable SMTP connection that reconnects on demand"""
+
+    def __init__(self, server, port, username=None, password=None, use_tls=True, sender=None):
+        self.server = server
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.sender = sender or username or 'library@localhost'
+        self.connection = None
+
+    def connect(self):
+        self.connection = smtplib.SMTP(self.server, self.port)
+        if self.use_tls:
+            self.connection.starttls()
+        if self.username:
+            self.connection.login(self.username, self.password)
+
+    def send(self, subject, body, to_email):
+        """Send a message, opening (or re-opening) the connection if needed"""
+        msg = build_message(subject, body, to_email, self.sender)
+        with metrics.track('smtp_send'):
+            if self.connection is None:
+                self.connect()
+            try:
+                self.connection.send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped an idle connection, retry once on a fresh one
+                self.connect()
+                self.connection.send_message(msg)
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def outbox_message(subject, body, to_email, now=None):
+    """A pending outbox document, ready for the worker to send"""
+    now = now or datetime.now()
+    return {
+        'subject': subject,
+        'body': body,
+        'to_email': to_email,
+        'status': 'pending',
+        'attempts': 0,
+        'next_attempt_at': now,
+        'created_at': now
+    }
+
+
+class MailQueue:
+    """Durable outbound email queue stored in a MongoDB collection"""
+
+    def __init__(self, collection, smtp_settings=None):
+        self.collection = collection
+        self.smtp_settings = smtp_settings or smtp_settings_from_env()
+        self.worker = None
+
+    def enqueue(self, subject, body, to_email):
+        """Store a message in the outbox; returns True once it is queued"""
+        if not to_email:
+            return False
+        self.collection.insert_one(outbox_message(subject, body, to_email))
+        return True
+
+    def enqueue_many(self, messages):
+        """Queue (subject, body, to_email) messages in one insert; returns how many were queued"""
+        now = datetime.now()
+        documents = [outbox_message(subject, body, to_email, now) for subject, body, to_email in messages if to_email]
+        if documents:
+            self.collection.insert_many(documents)
+        return len(documents)
+
+    def claim_next(self):
+        """Atomically claim one due message for sending"""
+        now = datetime.now()
+        return self.collection.find_one_and_update(
+            {
+                '$or': [
+                    {'status': 'pending', 'next_attempt_at': {'$lte': now}},
+                    {'status': 'sending', 'claimed_at': {'$lt': now - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)}}
+                ]
+            },
+            {'$set': {'status': 'sending', 'claimed_at': now}},
+            sort=[('next_attempt_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def mark_sent(self, message):
+        self.collection.update_one(
+            {'_id': message['_id']},
+            {'$set': {'status': 'sent', 'sent_at': datetime.now()}, '$unset': {'claimed_at': ''}}
+        )
+
+    def mark_failed(self, message, error):
+        attempts = message.get('attempts', 0) + 1
+        update = {
+            'attempts': attempts,
+            'last_error': error
+        }
+        if attempts >= MAX_ATTEMPTS:
+            update['status'] = 'failed'
+        else:
+            # Exponential backoff: 30s, 60s, 120s, ...
+            delay = RETRY_BASE_SECONDS * (2 ** (attempts - 1))
+            update['status'] = 'pending'
+            update['next_attempt_at'] = datetime.now() + timedelta(seconds=delay)
+        self.collection.update_one(
+            {'_id': message['_id']},
+            {'$set': update, '$unset': {'claimed_at': ''}}
+        )
+
+    def drain(self, session, batch_size=BATCH_SIZE):
+        """Send up to batch_size due messages over one SMTP session; returns the number sent"""
+        sent = 0
+        for _ in range(batch_size):
+            message = self.claim_next()
+            if not message:
+                break
+            try:
+                session.send(message['subject'], message['body'], message['to_email'])
+                self.mark_sent(message)
+                sent += 1
+            except Exception as e:
+                print(f"Error sending email to {message['to_email']}: {str(e)}")
+                self.mark_failed(message, str(e))
+                # Drop the connection so the next message starts from a clean session
+                session.close()
+        return sent
+
+    def start_worker(self):
+        """Start the background worker thread if it is not already running"""
+        if self.worker is None or not self.worker.is_alive():
+            self.worker = MailWorker(self)
+            self.worker.start()
+        return self.worker
+
+    def stop_worker(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker.join()
+            self.worker = None
+
+
+class MailWorker(threading.Thread):
+    """Background thread that drains the outbox over a persistent SMTP session"""
+
+    def __init__(self, queue, poll_interval=POLL_INTERVAL):
+        super().__init__(name='mail-worker', daemon=True)
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        session = SMTPSession(**self.queue.smtp_settings)
+        last_sent = time.monotonic()
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    sent = self.queue.drain(session)
+                except Exception as e:
+                    print(f"Error draining email outbox: {str(e)}")
+                    sent = 0
+                if sent:
+                    last_sent = time.monotonic()
+                    continue
+                # Outbox is empty; release the SMTP connection once it has been idle a while
+                if time.monotonic() - last_sent > IDLE_TIMEOUT_SECONDS:
+                    session.close()
+                self.stop_event.wait(self.poll_interval)
+        finally:
+            session.close()
+
+
+def run_worker():
+    """Run the outbox worker in the foreground"""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    # Imported after load_dotenv so MONGODB_DATABASE from .env applies, as in the app
+    from database import get_db
+    queue = MailQueue(get_db()[OUTBOX_COLLECTION])
+
+    print("Starting email outbox worker...")
+    print("Press Ctrl+C to stop the worker")
+    worker = queue.start_worker()
+    try:
+        while worker.is_alive():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("\nStopping the email outbox worker...")
+        queue.stop_worker()
+
+
+if __name__ == '__main__':
+    run_worker()
@@ -0,0 +1,455 @@
+from flask import request, Response, abort
+from pymongo import monitoring
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import glob
+import json
+import os
+import threading
+import time
+
+# Requests slower than this are written to the slow-request log
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '500'))
+# Requests issuing more MongoDB commands than this are logged too; usually an N+1 query
+REQUEST_COMMANDS_WARN = int(os.getenv('REQUEST_COMMANDS_WARN', '25'))
+# When set, /metrics requires "Authorization: Bearer <token>"
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Directory shared by the worker processes of one server; when set, each worker writes its
+# metrics there and /metrics on any worker reports the sum over all of them
+METRICS_DIR = os.getenv('METRICS_DIR')
+# Seconds between the snapshots a worker writes to METRICS_DIR
+METRICS_WRITE_INTERVAL = float(os.getenv('METRICS_WRITE_INTERVAL', '5'))
+# Snapshot in METRICS_DIR holding the final counts of workers that have exited
+EXITED_SNAPSHOT = 'exited.json'
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250)
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+# Every metric created in this process, in the order it is rendered
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in labels) + '}'
+
+
+class Counter:
+    """A monotonically increasing value per label set"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def export(self):
+        with self.lock:
+            return dict(self.values)
+
+    @staticmethod
+    def combine(value, other):
+        """The value of one label set across two processes"""
+        return value + other
+
+    def samples(self, values=None):
+        if values is None:
+            values = self.export()
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(zip(self.labelnames, key))} {value}"
+
+
+class Gauge(Counter):
+    """A value per label set that is set rather than added to, such as a timestamp"""
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            self.values[key] = value
+
+    @staticmethod
+    def combine(value, other):
+        # Gauges here are timestamps, so the latest one wins
+        return max(value, other)
+
+
+class Histogram:
+    """Observations counted into cumulative buckets per label set, as Prometheus expects"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry['buckets'][i] += 1
+                    break
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def count(self):
+        """Observations across every label set"""
+        with self.lock:
+            return sum(entry['count'] for entry in self.values.values())
+
+    def export(self):
+        with self.lock:
+            return {key: dict(entry, buckets=list(entry['buckets'])) for key, entry in self.values.items()}
+
+    @staticmethod
+    def combine(entry, other):
+        return {
+            'buckets': [count + more for count, more in zip(entry['buckets'], other['buckets'])],
+            'sum': entry['sum'] + other['sum'],
+            'count': entry['count'] + other['count']
+        }
+
+    def samples(self, values=None):
+        if values is None:
+            values = self.export()
+        for key, entry in sorted(values.items()):
+            labels = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry['buckets']):
+                cumulative += count
+                yield f"{self.name}_bucket{format_labels(labels + [('le', bound)])} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(labels + [('le', '+Inf')])} {entry['count']}"
+            yield f"{self.name}_sum{format_labels(labels)} {entry['sum']:.6f}"
+            yield f"{self.name}_count{format_labels(labels)} {entry['count']}"
+
+
+def render():
+    """Every metric in the Prometheus text exposition format
+
+    In a worker writing to METRICS_DIR these are the totals over every worker
+    of the server, including the ones that have exited.
+    """
+    combined = collect() if writer['pid'] == os.getpid() else None
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples(combined.get(metric.name, {}) if combined is not None else None))
+    return '\n'.join(lines) + '\n'
+
+
+# Shared metrics: each worker of a pre-forking server (gunicorn, uvicorn --workers)
+# keeps its own registry, so a scrape would only see whichever worker answered.
+# Workers instead write snapshots to METRICS_DIR and /metrics adds them up.
+
+writer = {'pid': None}
+
+
+def snapshot():
+    """This process's values as {metric name: [[label values, value], ...]}, for JSON"""
+    return {metric.name: [[list(key), value] for key, value in metric.export().items()] for metric in registry}
+
+
+def combine_snapshots(snapshots):
+    """Add snapshots up per label set; returns {metric name: {label values: value}}"""
+    by_name = {metric.name: metric for metric in registry}
+    combined = {name: {} for name in by_name}
+    for data in snapshots:
+        for name, rows in data.items():
+            if name not in by_name:
+                continue
+            values = combined[name]
+            for key, value in rows:
+                key = tuple(key)
+                values[key] = by_name[name].combine(values[key], value) if key in values else value
+    return combined
+
+
+def snapshot_path(name):
+    return os.path.join(METRICS_DIR, name)
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_snapshot(path, data):
+    # Written under a temporary name and renamed, so readers never see half a file
+    temporary = f"{path}.{os.getpid()}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump(data, f)
+    os.replace(temporary, path)
+
+
+@contextmanager
+def directory_lock():
+    """Serialize folding an exited worker's snapshot with readers of METRICS_DIR"""
+    import fcntl
+
+    with open(snapshot_path('.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def worker_snapshot_path(pid=None):
+    return snapshot_path(f"worker_{pid or os.getpid()}.json")
+
+
+def fold_into_exited(path, data):
+    """Add a worker's final snapshot to the exited snapshot and remove its own file; call under the lock"""
+    exited = combine_snapshots([read_snapshot(snapshot_path(EXITED_SNAPSHOT)), data])
+    write_snapshot(snapshot_path(EXITED_SNAPSHOT),
+                   {name: [[list(key), value] for key, value in values.items()] for name, values in exited.items()})
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def collect():
+    """Totals over every snapshot in METRICS_DIR, with this process's current values"""
+    with directory_lock():
+        write_snapshot(worker_snapshot_path(), snapshot())
+        return combine_snapshots(read_snapshot(path) for path in glob.glob(snapshot_path('*.json')))
+
+
+def write_periodically(pid):
+    """Refresh this worker's snapshot until retire() has folded it into the exited one"""
+    while True:
+        time.sleep(METRICS_WRITE_INTERVAL)
+        try:
+            with directory_lock():
+                if writer['pid'] != pid:
+                    return
+                write_snapshot(worker_snapshot_path(), snapshot())
+        except Exception as e:
+            print(f"Error writing metrics snapshot: {str(e)}")
+
+
+def start_writer():
+    """Share this worker's metrics through METRICS_DIR; call in each worker after fork
+
+    Values inherited from the parent process are dropped so they are not
+    counted once per worker. Does nothing when METRICS_DIR is not set.
+    """
+    if not METRICS_DIR or writer['pid'] == os.getpid():
+        return
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for metric in registry:
+        with metric.lock:
+            metric.values.clear()
+    path = worker_snapshot_path()
+    with directory_lock():
+        if os.path.exists(path):
+            # Left by an earlier process with this pid that did not exit cleanly
+            fold_into_exited(path, read_snapshot(path))
+    writer['pid'] = os.getpid()
+    threading.Thread(target=write_periodically, args=(os.getpid(),), name='metrics-writer', daemon=True).start()
+
+
+def retire():
+    """Keep an exiting worker's counts in METRICS_DIR, so totals do not drop when it is replaced"""
+    if writer['pid'] != os.getpid():
+        return
+    with directory_lock():
+        writer['pid'] = None
+        fold_into_exited(worker_snapshot_path(), snapshot())
+
+
+def clear_directory(directory=None):
+    """Remove the snapshots of a previous run; call in the server's master before workers start"""
+    directory = directory or METRICS_DIR
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+request_duration = Histogram('http_request_duration_seconds', 'Time spent handling HTTP requests',
+                             ('method', 'endpoint', 'status'))
+request_mongo_commands = Histogram('http_request_mongodb_commands', 'MongoDB commands issued per HTTP request',
+                                   ('endpoint',), COUNT_BUCKETS)
+mongo_command_duration = Histogram('mongodb_command_duration_seconds', 'MongoDB command round trip time',
+                                   ('command',))
+mongo_command_failures = Counter('mongodb_command_failures_total', 'MongoDB commands that failed', ('command',))
+repository_duration = Histogram('repository_query_duration_seconds', 'Time spent in repository methods',
+                                ('method',))
+operation_duration = Histogram('operation_duration_seconds',
+                               'Time spent in instrumented operations such as SMTP sends and the overdue check',
+                               ('operation',))
+operation_failures = Counter('operation_failures_total', 'Instrumented operations that raised', ('operation',))
+job_duration = Histogram('scheduler_job_duration_seconds', 'Time spent in scheduled job runs, by outcome',
+                         ('job', 'status'), JOB_BUCKETS)
+job_last_success = Gauge('scheduler_job_last_success_timestamp_seconds',
+                         'Unix time at which each scheduled job last finished successfully', ('job',))
+
+
+def log_event(event, **fields):
+    """Print one structured log line as JSON"""
+    print(json.dumps({'event': event, 'time': datetime.now().isoformat(timespec='milliseconds'), **fields},
+                     default=str))
+
+
+@contextmanager
+def track(operation):
+    """Time a block as `operation`, counting it as failed if it raises"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        operation_failures.inc(operation=operation)
+        raise
+    finally:
+        operation_duration.observe(time.perf_counter() - start, operation=operation)
+
+
+def timed(operation):
+    """Decorator form of track()"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with track(operation):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# MongoDB commands issued by the request running on the current thread
+request_state = threading.local()
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command and counts the commands of the current request
+
+    pymongo calls listeners on the thread that ran the command.
+    """
+
+    def record(self, event):
+        seconds = event.duration_micros / 1e6
+        mongo_command_duration.observe(seconds, command=event.command_name)
+        if getattr(request_state, 'active', False):
+            request_state.commands += 1
+            request_state.mongo_seconds += seconds
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self.record(event)
+
+    def failed(self, event):
+        mongo_command_failures.inc(command=event.command_name)
+        self.record(event)
+
+
+# Passed to every MongoClient (see database.py)
+command_listener = CommandMetrics()
+
+
+def start_request():
+    request_state.active = True
+    request_state.start = time.perf_counter()
+    request_state.commands = 0
+    request_state.mongo_seconds = 0.0
+
+
+def finish_request(status):
+    if not getattr(request_state, 'active', False):
+        return
+    request_state.active = False
+    duration = time.perf_counter() - request_state.start
+    endpoint = request.endpoint or 'unmatched'
+    request_duration.observe(duration, method=request.method, endpoint=endpoint, status=status)
+    request_mongo_commands.observe(request_state.commands, endpoint=endpoint)
+
+    slow = duration * 1000 >= SLOW_REQUEST_MS
+    chatty = request_state.commands > REQUEST_COMMANDS_WARN
+    if slow or chatty:
+        log_event('slow_request',
+                  reason='duration' if slow else 'mongodb_commands',
+                  method=request.method,
+                  path=request.path,
+                  endpoint=endpoint,
+                  status=status,
+                  duration_ms=round(duration * 1000, 1),
+                  mongodb_commands=request_state.commands,
+                  mongodb_ms=round(request_state.mongo_seconds * 1000, 1))
+
+
+def metrics_view():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+        abort(401)
+    return Response(render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Record per-route timings and MongoDB command counts, and serve them at /metrics"""
+    app.before_request(start_request)
+
+    @app.after_request
+    def record_response(response):
+        finish_request(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_error(error):
+        # after_request does not run for unhandled exceptions
+        if error is not None:
+            finish_request(500)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if METRICS_TOKEN and self.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            self.send_error(401)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='0.0.0.0'):
+    """Serve /metrics from a background thread, for processes without a web app such as alerts.py"""
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    return server
@@ -0,0 +1,300 @@
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from bson import ObjectId
+from datetime import datetime
+import argparse
+import sys
+
+from catalog_search import backfill_search_fields
+from stats import rebuild_stats
+from departments import rebuild_departments
+from catalog_search import build_search_query
+from pagination import keyset_query
+from repositories import (AVAILABLE_BOOKS_QUERY, LISTING_SORTS, listing_find, active_loans_find, history_query,
+                          archived_query, date_keyset_query, LOAN_HISTORY_COLLECTION)
+
+# Indexes required by the queries in app.py, alerts.py, mail_queue.py and loan_archive.py.
+# Each entry is (keys, options); the name is always set so reports stay stable.
+INDEXES = {
+    'users': [
+        ([('userId', ASCENDING)], {'name': 'userId_unique', 'unique': True}),
+        ([('email', ASCENDING)], {'name': 'email_unique', 'unique': True}),
+        ([('role', ASCENDING)], {'name': 'role'})
+    ],
+    'books': [
+        ([('department', ASCENDING), ('_id', ASCENDING)], {'name': 'department_id'}),
+        ([('created_at', DESCENDING)], {'name': 'created_at_desc'}),
+        ([('available_copies', ASCENDING)], {'name': 'available_copies'}),
+        ([('search_tokens', ASCENDING)], {'name': 'search_tokens'}),
+        # Catalog imports upsert by ISBN; books without a usable ISBN ('') may repeat
+        ([('isbn_normalized', ASCENDING)],
+         {'name': 'isbn_normalized_unique', 'unique': True, 'partialFilterExpression': {'isbn_normalized': {'$gt': ''}}})
+    ],
+    'borrowed_books': [
+        ([('user_id', ASCENDING), ('status', ASCENDING), ('return_date', ASCENDING)], {'name': 'user_id_status_return_date'}),
+        # One (sort, _id) index per loan listing sort, unfiltered and per user (repositories.LISTING_SORTS)
+        ([('borrowed_date', DESCENDING), ('_id', DESCENDING)], {'name': 'borrowed_date_id'}),
+        ([('return_date', ASCENDING), ('_id', ASCENDING)], {'name': 'return_date_id'}),
+        ([('user_id', ASCENDING), ('borrowed_date', DESCENDING), ('_id', DESCENDING)], {'name': 'user_id_borrowed_date_id'}),
+        ([('user_id', ASCENDING), ('return_date', ASCENDING), ('_id', ASCENDING)], {'name': 'user_id_return_date_id'}),
+        ([('status', ASCENDING), ('next_reminder_at', ASCENDING)], {'name': 'status_next_reminder_at'}),
+        ([('return_batch', ASCENDING)], {'name': 'return_batch', 'sparse': True}),
+        ([('user_id', ASCENDING), ('status', ASCENDING), ('borrowed_date', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'user_id_status_borrowed_date'}),
+        ([('status', ASCENDING), ('returned_date', ASCENDING)], {'name': 'status_returned_date'})
+    ],
+    LOAN_HISTORY_COLLECTION: [
+        ([('user_id', ASCENDING), ('status', ASCENDING), ('borrowed_date', DESCENDING), ('_id', DESCENDING)],
+         {'name': 'user_id_status_borrowed_date'}),
+        ([('borrowed_date', DESCENDING), ('_id', DESCENDING)], {'name': 'borrowed_date_id_desc'})
+    ],
+    'email_outbox': [
+        ([('status', ASCENDING), ('next_attempt_at', ASCENDING)], {'name': 'status_next_attempt_at'})
+    ]
+}
+
+# A loan cursor as the listing pages emit it, so keyset filters are checked too
+SAMPLE_LOAN_CURSOR = f"{datetime(2000, 1, 1).isoformat()}_{ObjectId()}"
+NEWEST_FIRST = [('borrowed_date', DESCENDING), ('_id', DESCENDING)]
+
+
+def hot_queries():
+    """Representative hot queries, used to verify that every one of them is served by an index
+
+    Each entry is (description, collection, filter, sort, hint), built with the
+    same helpers the repositories use. Ranked searches and suggestions sort
+    their matches in memory by design, so only their filter is checked.
+    """
+    queries = [
+        ('login / user lookup', 'users', {'userId': 'sample'}, None, None),
+        ('user email lookup', 'users', {'email': 'sample@example.com'}, None, None),
+        ('staff dashboard user count', 'users', {'role': 'user'}, None, None),
+        ('books page', 'books', keyset_query({}, str(ObjectId())), [('_id', ASCENDING)], None),
+        ('books by department', 'books', keyset_query({'department': 'sample'}, str(ObjectId())), [('_id', ASCENDING)], None),
+        ('available books', 'books', keyset_query(AVAILABLE_BOOKS_QUERY), [('_id', ASCENDING)], None),
+        ('available books by department', 'books', keyset_query(dict(AVAILABLE_BOOKS_QUERY, department='sample')),
+         [('_id', ASCENDING)], None),
+        ('available books count', 'books', AVAILABLE_BOOKS_QUERY, None, None),
+        ('catalog search', 'books', build_search_query('data sys'), None, None),
+        ('catalog search by department', 'books', dict(build_search_query('data sys'), department='sample'), None, None),
+        ('catalog ISBN search', 'books', build_search_query('978-1'), None, None),
+        ('recently added books', 'books', {}, [('created_at', DESCENDING)], None),
+        ('user current loans', 'borrowed_books', *active_loans_find('sample'), None),
+        ('user recent returns', 'borrowed_books', date_keyset_query(history_query('sample'), 'borrowed_date', -1, SAMPLE_LOAN_CURSOR),
+         NEWEST_FIRST, None),
+        ('user archived loans', LOAN_HISTORY_COLLECTION, date_keyset_query(history_query('sample'), 'borrowed_date', -1, SAMPLE_LOAN_CURSOR),
+         NEWEST_FIRST, None),
+        ('archived loans listing', LOAN_HISTORY_COLLECTION, date_keyset_query(archived_query(), 'borrowed_date', -1, SAMPLE_LOAN_CURSOR),
+         NEWEST_FIRST, None),
+        ('returned loans to archive', 'borrowed_books', {'status': 'returned', 'returned_date': {'$lt': datetime(2000, 1, 1)}}, None, None),
+        ('loans due for a reminder', 'borrowed_books', {'status': 'borrowed', 'next_reminder_at': {'$lte': datetime(2000, 1, 1)}}, None, None),
+        ('batch return read-back', 'borrowed_books', {'return_batch': ObjectId()}, None, None),
+        ('email outbox claim', 'email_outbox', {'status': 'pending', 'next_attempt_at': {'$lte': datetime(2000, 1, 1)}},
+         [('next_attempt_at', ASCENDING)], None)
+    ]
+    # Every sort, direction and filter the borrowed books listing accepts, first page and later ones
+    for sort in LISTING_SORTS:
+        for direction in (-1, 1):
+            for filters in ({}, {'status': 'borrowed'}, {'user_id': 'sample'}, {'user_id': 'sample', 'status': 'returned'}):
+                for after in (None, SAMPLE_LOAN_CURSOR):
+                    description = f"borrowed books listing by {sort} {'desc' if direction < 0 else 'asc'}" \
+                                  f"{''.join(f', {field}' for field in filters)}{', later page' if after else ''}"
+                    queries.append((description, 'borrowed_books', *listing_find(filters, sort, direction, after)))
+    return queries
+
+
+def backfill_next_reminder_at(db):
+    """Schedule the first overdue reminder of existing loans at their return date"""
+    db.borrowed_books.update_many(
+        {'status': 'borrowed', 'next_reminder_at': {'$exists': False}},
+        [{'$set': {'next_reminder_at': '$return_date'}}]
+    )
+
+
+def backfill_available_copies(db):
+    """Derive available_copies for books created before the field was maintained"""
+    db.books.update_many(
+        {},
+        [{'$set': {'available_copies': {'$subtract': ['$book_count', {'$ifNull': ['$borrowed_count', 0]}]}}}]
+    )
+
+
+def drop_isbn_normalized_index(db):
+    """Drop the plain ISBN index, replaced by isbn_normalized_unique"""
+    if 'isbn_normalized' in db.books.index_information():
+        db.books.drop_index('isbn_normalized')
+
+
+def drop_unkeyed_loan_indexes(db):
+    """Drop the listing indexes without _id, replaced by borrowed_date_id and user_id_borrowed_date_id"""
+    existing = db.borrowed_books.index_information()
+    for name in ('borrowed_date_desc', 'user_id_borrowed_date'):
+        if name in existing:
+            db.borrowed_books.drop_index(name)
+
+
+def drop_user_id_status_index(db):
+    """Drop the current loans index, replaced by user_id_status_return_date which also serves their sort"""
+    if 'user_id_status' in db.borrowed_books.index_information():
+        db.borrowed_books.drop_index('user_id_status')
+
+
+# Data migrations, applied once each in order and recorded in the schema_migrations collection.
+# Each entry is (name, function taking db).
+MIGRATIONS = [
+    ('0001_book_search_fields', backfill_search_fields),
+    ('0002_loan_next_reminder_at', backfill_next_reminder_at),
+    ('0003_library_stats', rebuild_stats),
+    ('0004_book_available_copies', backfill_available_copies),
+    ('0005_department_registry', rebuild_departments),
+    ('0006_drop_isbn_normalized_index', drop_isbn_normalized_index),
+    ('0007_drop_unkeyed_loan_indexes', drop_unkeyed_loan_indexes),
+    ('0008_drop_user_id_status_index', drop_user_id_status_index)
+]
+
+
+# Unique indexes the app cannot run without: user creation relies on them to reject duplicates.
+# Other failed indexes, such as isbn_normalized_unique on a catalog that already holds
+# duplicate ISBNs, are reported and the app starts anyway.
+REQUIRED_UNIQUE_INDEXES = {'users.userId_unique', 'users.email_unique'}
+
+
+class UniqueIndexError(Exception):
+    """A unique index could not be built, so the duplicates it guards against are not rejected"""
+
+
+def ensure_indexes(db):
+    """Create every declared index; returns the names of indexes that failed to build
+
+    Raises UniqueIndexError if one of REQUIRED_UNIQUE_INDEXES fails: the
+    user write paths rely on them instead of checking for duplicates first.
+    """
+    failed = []
+    failed_unique = []
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except OperationFailure as e:
+                # Typically duplicate data blocking a unique index
+                print(f"Error creating index {collection_name}.{options['name']}: {str(e)}")
+                failed.append(f"{collection_name}.{options['name']}")
+                if f"{collection_name}.{options['name']}" in REQUIRED_UNIQUE_INDEXES:
+                    failed_unique.append(f"{collection_name}.{options['name']}")
+    if failed_unique:
+        raise UniqueIndexError(f"Unique indexes failed to build: {', '.join(failed_unique)}; "
+                               f"remove the duplicate documents and run python migrations.py")
+    return failed
+
+
+def apply_migrations(db):
+    """Run pending data migrations; returns the names of the ones applied"""
+    applied = set(doc['_id'] for doc in db.schema_migrations.find({}, {'_id': 1}))
+    newly_applied = []
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        print(f"Applying migration {name}...")
+        migration(db)
+        db.schema_migrations.insert_one({'_id': name, 'applied_at': datetime.now()})
+        newly_applied.append(name)
+    return newly_applied
+
+
+def migrate(db):
+    """Bring indexes and data up to date; safe to run on every startup"""
+    failed = ensure_indexes(db)
+    applied = apply_migrations(db)
+    return {'failed_indexes': failed, 'applied_migrations': applied}
+
+
+def missing_indexes(db):
+    """List declared indexes that do not exist in the database"""
+    missing = []
+    for collection_name, indexes in INDEXES.items():
+        existing = set(db[collection_name].index_information())
+        for _, options in indexes:
+            if options['name'] not in existing:
+                missing.append(f"{collection_name}.{options['name']}")
+    return missing
+
+
+def unused_indexes(db):
+    """List indexes with no recorded accesses since the server last started"""
+    unused = []
+    for collection_name in INDEXES:
+        for stats in db[collection_name].aggregate([{'$indexStats': {}}]):
+            if stats['name'] != '_id_' and stats['accesses']['ops'] == 0:
+                unused.append(f"{collection_name}.{stats['name']}")
+    return unused
+
+
+def plan_stages(plan):
+    """Flatten the stage names of an explain plan tree"""
+    stages = [plan.get('stage')]
+    if 'inputStage' in plan:
+        stages.extend(plan_stages(plan['inputStage']))
+    for child in plan.get('inputStages', []):
+        stages.extend(plan_stages(child))
+    return stages
+
+
+def explain_query(db, collection_name, query, sort=None, hint=None):
+    """Return the stages of the winning plan for a find"""
+    command = {'find': collection_name, 'filter': query}
+    if sort:
+        command['sort'] = dict(sort)
+    if hint:
+        command['hint'] = hint
+    explain = db.command('explain', command, verbosity='queryPlanner')
+    planner = explain['queryPlanner']
+    return plan_stages(planner['winningPlan'].get('queryPlan', planner['winningPlan']))
+
+
+def check_query_plans(db):
+    """Explain every hot query; returns a list of (description, stages, uses_index)
+
+    uses_index means the plan scans an index, never the collection, and
+    returns a sorted query in index order instead of sorting in memory.
+    """
+    results = []
+    for description, collection_name, query, sort, hint in hot_queries():
+        stages = explain_query(db, collection_name, query, sort, hint)
+        uses_index = 'IXSCAN' in stages and 'COLLSCAN' not in stages and not (sort and 'SORT' in stages)
+        results.append((description, stages, uses_index))
+    return results
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description='Apply and inspect the database indexes and migrations')
+    parser.add_argument('--report', action='store_true', help='report missing and unused indexes')
+    parser.add_argument('--explain', action='store_true', help='verify that hot queries use an index')
+    args = parser.parse_args()
+
+    load_dotenv()
+    from database import get_db
+    db = get_db()
+
+    if args.report or args.explain:
+        if args.report:
+            print(f"Missing indexes: {', '.join(missing_indexes(db)) or 'none'}")
+            print(f"Unused indexes: {', '.join(unused_indexes(db)) or 'none'}")
+        if args.explain:
+            all_indexed = True
+            for description, stages, uses_index in check_query_plans(db):
+                print(f"[{'OK' if uses_index else 'SLOW'}] {description}: {' <- '.join(stages)}")
+                all_indexed = all_indexed and uses_index
+            if not all_indexed:
+                sys.exit(1)
+    else:
+        try:
+            result = migrate(db)
+        except UniqueIndexError as e:
+            print(str(e))
+            sys.exit(1)
+        print(f"Applied migrations: {', '.join(result['applied_migrations']) or 'none'}")
+        if result['failed_indexes']:
+            print(f"Failed indexes: {', '.join(result['failed_indexes'])}")
+            sys.exit(1)
@@ -0,0 +1,55 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+
+# Page size used when the client does not ask for one
+DEFAULT_LIMIT = 50
+# Largest page a client may request
+MAX_LIMIT = 500
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    """Clamp a requested page size to 1..MAX_LIMIT"""
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return min(max(limit, 1), MAX_LIMIT)
+
+
+def parse_cursor(value):
+    """Turn an `after` parameter into an ObjectId, ignoring malformed values"""
+    if not value:
+        return None
+    try:
+        return ObjectId(value)
+    except (InvalidId, TypeError):
+        return None
+
+
+def keyset_page(collection, query, after=None, limit=DEFAULT_LIMIT, projection=None):
+    """Fetch the page of documents following `after` in _id order
+
+    Returns (documents, next_cursor); next_cursor is None on the last page.
+    """
+    # Fetch one extra document to find out whether another page exists
+    documents = list(collection.find(keyset_query(query, after), projection).sort('_id', 1).limit(limit + 1))
+    return page_result(documents, limit)
+
+
+def keyset_query(query, after=None):
+    """query restricted to documents after the `after` cursor"""
+    query = dict(query)
+    cursor_id = parse_cursor(after)
+    if cursor_id:
+        query['_id'] = {'$gt': cursor_id}
+    return query
+
+
+def page_result(documents, limit):
+    """Trim the extra document fetched past the page; returns (documents, next_cursor)"""
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = str(documents[-1]['_id'])
+    return documents, next_cursor
+
@@ -0,0 +1,664 @@
+from pymongo.errors import AutoReconnect, NetworkTimeout
+from pymongo import ReturnDocument, ReplaceOne, UpdateOne
+from bson import ObjectId
+from bson.errors import InvalidId
+from datetime import datetime
+from functools import wraps
+import os
+import time
+
+from pagination import keyset_page, DEFAULT_LIMIT
+from catalog_search import search_books, suggest_books, SEARCH_PER_PAGE
+from api_serialization import RAW_BSON
+import metrics
+
+# Queries slower than this are logged
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '200'))
+
+# Extra attempts for reads interrupted by a failover; the driver itself retries once
+READ_RETRIES = int(os.getenv('MONGO_READ_RETRIES', '2'))
+READ_RETRY_DELAY = float(os.getenv('MONGO_READ_RETRY_DELAY', '0.5'))
+
+# Returned loans move here from borrowed_books, which then only holds current and recent loans
+LOAN_HISTORY_COLLECTION = 'loan_history'
+
+# Collection and document holding the library-wide counters
+STATS_COLLECTION = 'library_stats'
+STATS_ID = 'counters'
+
+# One document per department: {'_id': name, 'titles': n, 'copies': n}
+DEPARTMENTS_COLLECTION = 'departments'
+
+# Departments matching this are removed after a change
+EMPTY_DEPARTMENTS = {'titles': {'$lte': 0}}
+
+# Book fields the department registry counts
+COUNTED_FIELDS = {'department': 1, 'book_count': 1}
+
+# Returned loans shown per page of a user's history
+HISTORY_PER_PAGE = 20
+
+# Books with at least one copy on the shelf
+AVAILABLE_BOOKS_QUERY = {'available_copies': {'$gt': 0}}
+
+# Sorts the loan listing offers, with the borrowed_books index that serves each
+# one unfiltered and filtered by user; both end in _id, so no page is sorted in memory
+LISTING_SORTS = {
+    'borrowed_date': ('borrowed_date_id', 'user_id_borrowed_date_id'),
+    'return_date': ('return_date_id', 'user_id_return_date_id')
+}
+
+def record_query(name, elapsed):
+    """Publish a repository call's time on /metrics and log it when slow"""
+    metrics.repository_duration.observe(elapsed / 1000, method=name)
+    if elapsed >= SLOW_QUERY_MS:
+        print(f"Slow query {name}: {elapsed:.1f} ms")
+
+
+def instrumented(retry=False):
+    """Time a repository method; with retry, repeat it when the connection drops
+
+    Only reads are retried here. Writes rely on the driver's retryable writes,
+    which know whether the server already applied the write.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            name = f"{type(self).__name__}.{method.__name__}"
+            attempts = 1 + (READ_RETRIES if retry else 0)
+            start = time.perf_counter()
+            try:
+                for attempt in range(attempts):
+                    try:
+                        return method(self, *args, **kwargs)
+                    except (AutoReconnect, NetworkTimeout) as e:
+                        if attempt == attempts - 1:
+                            raise
+                        print(f"Retrying {name} after {str(e)}")
+                        time.sleep(READ_RETRY_DELAY * (attempt + 1))
+            finally:
+                record_query(name, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+
+def parse_history_cursor(value):
+    """Turn a loan `after` parameter ("<date>_<loan id>") into a (datetime, ObjectId) pair"""
+    if not value:
+        return None
+    try:
+        borrowed_date, loan_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(borrowed_date), ObjectId(loan_id)
+    except (ValueError, InvalidId):
+        return None
+
+
+def date_keyset_query(query, sort, direction, after=None):
+    """query restricted to the loans past an `after` cursor in (sort, _id) order"""
+    query = dict(query)
+    position = parse_history_cursor(after)
+    if position:
+        value, loan_id = position
+        past, up_to = ('$lt', '$lte') if direction < 0 else ('$gt', '$gte')
+        # The plain range gives the index scan its bounds; the $or drops the loans already shown at value
+        query[sort] = {up_to: value}
+        query['$or'] = [
+            {sort: {past: value}},
+            {'_id': {past: loan_id}}
+        ]
+    return query
+
+
+def active_loans_find(user_id):
+    """Filter and sort of a user's current loans, soonest due first"""
+    return {'user_id': user_id, 'status': 'borrowed'}, [('return_date', 1)]
+
+
+def history_query(user_id):
+    """Filter of a user's returned loans, in borrowed_books and loan_history alike"""
+    return {'user_id': user_id, 'status': 'returned'}
+
+
+def archived_query(user_id=None):
+    """Filter of the archived loans listing, optionally for one user"""
+    return history_query(user_id) if user_id else {}
+
+
+def date_page_result(loans, sort, limit):
+    """Trim the extra loan fetched past the page; returns (loans, next_cursor)"""
+    next_cursor = None
+    if len(loans) > limit:
+        loans = loans[:limit]
+        next_cursor = f"{loans[-1][sort].isoformat()}_{loans[-1]['_id']}"
+    return loans, next_cursor
+
+
+def listing_find(query, sort, direction, after=None):
+    """Filter, sort and index hint for one page of the loan listing
+
+    The hint pins the (sort, _id) index, so status filters are applied while
+    scanning it instead of picking a status index and sorting in memory.
+    """
+    unfiltered, by_user = LISTING_SORTS[sort]
+    return (date_keyset_query(query, sort, direction, after), [(sort, direction), ('_id', direction)],
+            by_user if 'user_id' in query else unfiltered)
+
+
+def return_update(fields):
+    """Update marking a loan returned with fields such as returned_date and penalty_amount"""
+    return {'$set': dict(fields, status='returned'), '$unset': {'next_reminder_at': ''}}
+
+
+def duplicate_user_error(error):
+    """Describe which unique user field a DuplicateKeyError was raised for"""
+    key_pattern = (error.details or {}).get('keyPattern', {})
+    if 'email' in key_pattern:
+        return "User with this email already exists"
+    return "User with this ID already exists"
+
+
+# Raised through the unique isbn_normalized index when creating or editing a book
+DUPLICATE_ISBN_ERROR = "A book with this ISBN already exists"
+
+
+def parse_book_count(value):
+    """A copy count from a form or JSON body as a non-negative int; raises ValueError otherwise"""
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    raise ValueError("book_count must be a whole number")
+
+
+def availability_update(book_data):
+    """Update pipeline that sets book_data and recomputes available_copies from the stored counts
+
+    Lowering book_count below the copies on loan leaves no copies available
+    rather than a negative count.
+    """
+    return [
+        # $literal keeps user-supplied values such as "$title" from being read as field paths
+        {'$set': {field: {'$literal': value} for field, value in book_data.items()}},
+        {'$set': {'available_copies': {'$max': [
+            {'$subtract': ['$book_count', {'$ifNull': ['$borrowed_count', 0]}]},
+            0
+        ]}}}
+    ]
+
+
+def copies_update(count):
+    """Update putting count copies back on the shelf; a negative count takes them off"""
+    return {'$inc': {'borrowed_count': -count, 'available_copies': count}}
+
+
+class Repository:
+    """Queries against one collection
+
+    The collection is looked up on every use, so a repository created before
+    a pre-forking server forks uses the worker's own client afterwards.
+    """
+    collection_name = None
+    # Projection used for lists and lookups unless the caller asks for specific fields
+    list_projection = None
+
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def collection(self):
+        return self.db[self.collection_name]
+
+    @instrumented(retry=True)
+    def page(self, query=None, after=None, limit=DEFAULT_LIMIT, projection=None):
+        """One keyset page in _id order; returns (documents, next_cursor)"""
+        return keyset_page(self.collection, query or {}, after, limit, projection or self.list_projection)
+
+    @instrumented(retry=True)
+    def count(self, query=None):
+        return self.collection.count_documents(query or {})
+
+    @instrumented(retry=True)
+    def exists(self, query=None, session=None):
+        return bool(self.collection.count_documents(query or {}, limit=1, session=session))
+
+    @instrumented()
+    def bulk_write(self, operations, session=None):
+        """Run unordered bulk operations; raises BulkWriteError after applying the rest"""
+        return self.collection.bulk_write(operations, ordered=False, session=session)
+
+    def export(self, query=None, projection=None, raw=False):
+        """Cursor over every matching document in _id order, for streaming exports
+
+        With raw, documents come back as RawBSONDocuments and are never decoded.
+        """
+        collection = self.collection.with_options(codec_options=RAW_BSON) if raw else self.collection
+        return collection.find(query or {}, projection or self.list_projection).sort('_id', 1)
+
+
+class UserRepository(Repository):
+    collection_name = 'users'
+
+    # Passwords are only loaded to check a login
+    list_projection = {'password': 0}
+
+    @instrumented(retry=True)
+    def find_for_login(self, user_id):
+        return self.collection.find_one({'userId': user_id})
+
+    @instrumented(retry=True)
+    def find_by_user_id(self, user_id):
+        return self.collection.find_one({'userId': user_id}, self.list_projection)
+
+    @instrumented(retry=True)
+    def get(self, user_id, projection=None):
+        return self.collection.find_one({'_id': ObjectId(user_id)}, projection or self.list_projection)
+
+    @instrumented(retry=True)
+    def by_user_ids(self, user_ids, projection=None, session=None):
+        """Users keyed by userId, from one $in query"""
+        return {
+            user['userId']: user
+            for user in self.collection.find({'userId': {'$in': list(user_ids)}}, projection or self.list_projection,
+                                             session=session)
+        }
+
+    @instrumented(retry=True)
+    def taken(self, user_ids, emails):
+        """The given user ids and emails that already belong to a user; returns (ids, emails)"""
+        existing = self.collection.find(
+            {'$or': [{'userId': {'$in': list(user_ids)}}, {'email': {'$in': list(emails)}}]},
+            {'userId': 1, 'email': 1}
+        )
+        taken_ids = set()
+        taken_emails = set()
+        for user in existing:
+            taken_ids.add(user.get('userId'))
+            taken_emails.add(user.get('email'))
+        return taken_ids, taken_emails
+
+    @instrumented(retry=True)
+    def role_counts(self):
+        """Number of users per role"""
+        return {
+            row['_id']: row['count']
+            for row in self.collection.aggregate([{'$group': {'_id': '$role', 'count': {'$sum': 1}}}])
+            if row['_id']
+        }
+
+    @instrumented()
+    def create(self, user_data):
+        """Insert a user; raises DuplicateKeyError for a taken userId or email"""
+        return self.collection.insert_one(user_data).inserted_id
+
+    @instrumented()
+    def create_many(self, documents):
+        """Insert users unordered; raises BulkWriteError listing the ones that failed"""
+        self.collection.insert_many(documents, ordered=False)
+
+    @instrumented()
+    def increment(self, user_id, counters, projection=None, session=None):
+        """Add to a user's counters, e.g. {'active_loans': 1}; returns the user, or None if not found"""
+        return self.collection.find_one_and_update(
+            {'userId': user_id},
+            {'$inc': counters},
+            projection=projection or self.list_projection,
+            session=session
+        )
+
+    @instrumented()
+    def increment_many(self, counters_by_user, session=None):
+        """Add to the counters of several users, {user_id: counters}, in one bulk write"""
+        self.collection.bulk_write([
+            UpdateOne({'userId': user_id}, {'$inc': counters})
+            for user_id, counters in counters_by_user.items()
+        ], ordered=False, session=session)
+
+    @instrumented()
+    def set_active_loans(self, active_loans):
+        """Make every user's active_loans match {user_id: count}, writing only users that differ"""
+        operations = [
+            UpdateOne({'userId': user['userId']}, {'$set': {'active_loans': 0}})
+            for user in self.collection.find({'active_loans': {'$ne': 0}}, {'userId': 1})
+            if user.get('userId') and user['userId'] not in active_loans
+        ]
+        operations.extend(
+            UpdateOne({'userId': user_id, 'active_loans': {'$ne': count}}, {'$set': {'active_loans': count}})
+            for user_id, count in active_loans.items()
+        )
+        for start in range(0, len(operations), 1000):
+            self.collection.bulk_write(operations[start:start + 1000], ordered=False)
+
+    @instrumented()
+    def update(self, user_id, user_data):
+        """Set fields on a user; returns the user's previous role document, or None if not found"""
+        return self.collection.find_one_and_update(
+            {'_id': ObjectId(user_id)},
+            {'$set': user_data},
+            projection={'role': 1}
+        )
+
+    @instrumented()
+    def delete(self, user_id):
+        """Delete a user; returns its role document, or None if not found"""
+        return self.collection.find_one_and_delete({'_id': ObjectId(user_id)}, projection={'role': 1})
+
+
+class BookRepository(Repository):
+    collection_name = 'books'
+
+    # Search fields are internal to the catalog search
+    list_projection = {'title_tokens': 0, 'search_tokens': 0}
+
+    @instrumented(retry=True)
+    def get(self, book_id, projection=None):
+        return self.collection.find_one({'_id': ObjectId(book_id)}, projection or self.list_projection)
+
+    @instrumented(retry=True)
+    def search(self, search, query=None, page=1, per_page=SEARCH_PER_PAGE):
+        """Ranked search results; returns (books, total)"""
+        return search_books(self.collection, search, query, page, per_page)
+
+    @instrumented(retry=True)
+    def suggest(self, prefix):
+        return suggest_books(self.collection, prefix)
+
+    @instrumented(retry=True)
+    def recent(self, limit=5):
+        return list(self.collection.find({}, self.list_projection).sort('created_at', -1).limit(limit))
+
+    @instrumented(retry=True)
+    def existing_ids(self, book_ids, session=None):
+        """The given book ObjectIds that are in the catalog"""
+        return set(book['_id'] for book in self.collection.find({'_id': {'$in': list(book_ids)}}, {'_id': 1}, session=session))
+
+    @instrumented(retry=True)
+    def department_totals(self):
+        """Titles and copies per department, counted from the books"""
+        return {
+            row['_id']: row
+            for row in self.collection.aggregate([
+                {'$group': {'_id': '$department', 'titles': {'$sum': 1}, 'copies': {'$sum': '$book_count'}}}
+            ])
+            if row['_id']
+        }
+
+    @instrumented()
+    def create(self, book_data):
+        """Insert a book; raises DuplicateKeyError for an ISBN already in the catalog"""
+        return self.collection.insert_one(book_data).inserted_id
+
+    @instrumented()
+    def update(self, book_id, update):
+        """Apply an update document or pipeline; returns the book's previous department and copies, or None"""
+        return self.collection.find_one_and_update(
+            {'_id': ObjectId(book_id)},
+            update,
+            projection=COUNTED_FIELDS,
+            return_document=ReturnDocument.BEFORE
+        )
+
+    @instrumented()
+    def delete(self, book_id):
+        """Delete a book; returns its department and copies, or None if not found"""
+        return self.collection.find_one_and_delete({'_id': ObjectId(book_id)}, projection=COUNTED_FIELDS)
+
+    @instrumented()
+    def reserve_copies(self, book_id, wanted=1, projection=None, session=None):
+        """Take up to `wanted` copies off the shelf in one conditional update; returns (book, copies taken)
+
+        The filter and the $max keep available_copies from ever going below zero.
+        The book is returned as it was before the update, or None when the book
+        is missing or has no copies available.
+        """
+        book = self.collection.find_one_and_update(
+            {'_id': ObjectId(book_id), 'available_copies': {'$gt': 0}},
+            [{'$set': {
+                'borrowed_count': {'$add': [{'$ifNull': ['$borrowed_count', 0]}, {'$min': ['$available_copies', wanted]}]},
+                'available_copies': {'$max': [{'$subtract': ['$available_copies', wanted]}, 0]}
+            }}],
+            projection={**projection, 'available_copies': 1} if projection else None,
+            return_document=ReturnDocument.BEFORE,
+            session=session
+        )
+        if not book:
+            return None, 0
+        return book, min(book['available_copies'], wanted)
+
+    @instrumented()
+    def release_copies(self, counts, session=None):
+        """Put copies back on the shelf, {book_id: count}, in one bulk write"""
+        self.collection.bulk_write([
+            UpdateOne({'_id': ObjectId(book_id)}, copies_update(count))
+            for book_id, count in counts.items()
+        ], ordered=False, session=session)
+
+
+class LoanRepository(Repository):
+    collection_name = 'borrowed_books'
+
+    @property
+    def history_collection(self):
+        return self.db[LOAN_HISTORY_COLLECTION]
+
+    @instrumented(retry=True)
+    def get(self, loan_id, session=None):
+        return self.collection.find_one({'_id': ObjectId(loan_id)}, session=session)
+
+    @instrumented(retry=True)
+    def by_ids(self, loan_ids, session=None):
+        """Loans keyed by _id, from one $in query"""
+        return {loan['_id']: loan for loan in self.collection.find({'_id': {'$in': list(loan_ids)}}, session=session)}
+
+    @instrumented()
+    def create(self, loan, session=None):
+        """Insert a loan; its _id is set on the document"""
+        return self.collection.insert_one(loan, session=session).inserted_id
+
+    @instrumented()
+    def create_many(self, loans, session=None):
+        self.collection.insert_many(loans, session=session)
+
+    @instrumented()
+    def mark_returned(self, loan_id, fields, session=None):
+        """Set a loan's return fields; returns False if the loan was no longer borrowed"""
+        result = self.collection.update_one(
+            {'_id': ObjectId(loan_id), 'status': 'borrowed'},
+            return_update(fields),
+            session=session
+        )
+        return bool(result.modified_count)
+
+    @instrumented()
+    def mark_returned_many(self, fields_by_loan, session=None):
+        """Set the return fields of several loans, {loan _id: fields}; returns the ids this call returned
+
+        Every update is guarded on status 'borrowed' and tagged with a batch id,
+        so the loans returned here can be read back even when another desk
+        returns some of them at the same time.
+        """
+        batch_id = ObjectId()
+        self.collection.bulk_write([
+            UpdateOne({'_id': loan_id, 'status': 'borrowed'}, return_update(dict(fields, return_batch=batch_id)))
+            for loan_id, fields in fields_by_loan.items()
+        ], ordered=False, session=session)
+        return set(loan['_id'] for loan in self.collection.find({'return_batch': batch_id}, {'_id': 1}, session=session))
+
+    @instrumented(retry=True)
+    def active_counts_by_user(self):
+        """Number of borrowed loans per user id"""
+        return {
+            row['_id']: row['count']
+            for row in self.collection.aggregate([
+                {'$match': {'status': 'borrowed'}},
+                {'$group': {'_id': '$user_id', 'count': {'$sum': 1}}}
+            ])
+        }
+
+    @instrumented(retry=True)
+    def returned_before(self, cutoff, limit):
+        """Up to limit loans returned before cutoff, still in borrowed_books"""
+        return list(self.collection.find({'status': 'returned', 'returned_date': {'$lt': cutoff}}).limit(limit))
+
+    @instrumented()
+    def archive(self, loans):
+        """Copy returned loans to loan_history with idempotent upserts, then delete them; returns the number deleted"""
+        self.history_collection.bulk_write([ReplaceOne({'_id': loan['_id']}, loan, upsert=True) for loan in loans],
+                                           ordered=False)
+        result = self.collection.delete_many({'_id': {'$in': [loan['_id'] for loan in loans]}, 'status': 'returned'})
+        return result.deleted_count
+
+    @instrumented(retry=True)
+    def active_for_user(self, user_id):
+        """A user's current loans, soonest due first"""
+        query, sort = active_loans_find(user_id)
+        return list(self.collection.find(query).sort(sort))
+
+    @instrumented(retry=True)
+    def history(self, user_id, after=None, limit=HISTORY_PER_PAGE):
+        """One page of a user's returned loans, most recently borrowed first
+
+        Recent returns are still in borrowed_books and older ones in loan_history;
+        both are read with the same keyset filter and merged. Returns
+        (loans, next_cursor); next_cursor is None on the last page.
+        """
+        return self.newest_first((self.collection, self.history_collection), history_query(user_id), after, limit)
+
+    def newest_first(self, collections, query, after=None, limit=HISTORY_PER_PAGE):
+        """Keyset page over (borrowed_date, _id) descending, merged across collections
+
+        Returns (loans, next_cursor); next_cursor is None on the last page.
+        """
+        query = date_keyset_query(query, 'borrowed_date', -1, after)
+        sort = [('borrowed_date', -1), ('_id', -1)]
+        loans = {}
+        for collection in collections:
+            # A loan being archived can briefly be in both collections
+            for loan in collection.find(query).sort(sort).limit(limit + 1):
+                loans[loan['_id']] = loan
+        loans = sorted(loans.values(), key=lambda loan: (loan['borrowed_date'], loan['_id']), reverse=True)
+        return date_page_result(loans, 'borrowed_date', limit)
+
+    def with_user_names(self, loans):
+        """Set each loan's user_name from one users query, 'Unknown User' if the borrower is gone"""
+        names = {
+            user['userId']: user.get('name')
+            for user in self.db.users.find({'userId': {'$in': list({loan['user_id'] for loan in loans})}},
+                                           {'userId': 1, 'name': 1})
+        }
+        for loan in loans:
+            loan['user_name'] = names.get(loan['user_id']) or 'Unknown User'
+        return loans
+
+    @instrumented(retry=True)
+    def archived(self, user_id=None, after=None, limit=HISTORY_PER_PAGE):
+        """One page of archived loans, most recently borrowed first, with borrower names
+
+        Read from loan_history alone with an indexed keyset page, so the archive
+        is never sorted or counted as a whole. Returns (loans, next_cursor).
+        """
+        loans, next_cursor = self.newest_first((self.history_collection,), archived_query(user_id), after, limit)
+        return self.with_user_names(loans), next_cursor
+
+    @instrumented(retry=True)
+    def listing(self, query, sort='borrowed_date', direction=-1, after=None, limit=HISTORY_PER_PAGE):
+        """One keyset page of current and recently returned loans, with borrower names
+
+        sort is one of LISTING_SORTS. Only borrowed_books is read; archived loans
+        are listed by archived(). Nothing is counted, so the cost of a page does
+        not grow with the collection. Returns (loans, next_cursor).
+        """
+        find_query, find_sort, hint = listing_find(query, sort, direction, after)
+        loans = list(self.collection.find(find_query).sort(find_sort).hint(hint).limit(limit + 1))
+        loans, next_cursor = date_page_result(loans, sort, limit)
+        return self.with_user_names(loans), next_cursor
+
+    @instrumented(retry=True)
+    def due_for_reminder(self, current_date):
+        """Loans due for a reminder, grouped by borrower with the borrower's name and email
+
+        Only loans whose next_reminder_at has passed are picked up, so each run only
+        sees loans that became overdue or whose reminder interval elapsed.
+        """
+        return self.collection.aggregate([
+            {'$match': {
+                'status': 'borrowed',
+                'next_reminder_at': {'$lte': current_date}
+            }},
+            {'$sort': {'return_date': 1}},
+            {'$group': {
+                '_id': '$user_id',
+                'books': {'$push': {
+                    'loan_id': '$_id',
+                    'book_title': '$book_title',
+                    'return_date': '$return_date'
+                }}
+            }},
+            {'$lookup': {
+                'from': 'users',
+                'localField': '_id',
+                'foreignField': 'userId',
+                'as': 'user'
+            }},
+            {'$unwind': '$user'},
+            {'$match': {'user.email': {'$nin': [None, '']}}},
+            {'$project': {
+                'books': 1,
+                'name': '$user.name',
+                'email': '$user.email'
+            }}
+        ], allowDiskUse=True)
+
+    @instrumented()
+    def record_reminder(self, loan_ids, current_date, next_reminder_at):
+        """Mark loans as reminded and schedule their next reminder"""
+        self.collection.update_many(
+            {'_id': {'$in': list(loan_ids)}, 'status': 'borrowed'},
+            {
+                '$set': {
+                    'last_notified_at': current_date,
+                    'next_reminder_at': next_reminder_at
+                },
+                '$inc': {'reminders_sent': 1}
+            }
+        )
+
+
+class StatsRepository(Repository):
+    """The single document holding the library-wide counters"""
+    collection_name = STATS_COLLECTION
+
+    @instrumented(retry=True)
+    def load(self):
+        return self.collection.find_one({'_id': STATS_ID})
+
+    @instrumented()
+    def increment(self, update, session=None):
+        """Apply a counter update; a no-op until the counters document exists"""
+        self.collection.update_one({'_id': STATS_ID}, update, session=session)
+
+    @instrumented()
+    def save(self, stats):
+        self.collection.replace_one({'_id': STATS_ID}, stats, upsert=True)
+
+
+class DepartmentRepository(Repository):
+    """The department registry: titles and copies per department"""
+    collection_name = DEPARTMENTS_COLLECTION
+
+    @instrumented(retry=True)
+    def all(self):
+        """Every department, sorted by name"""
+        return list(self.collection.find().sort('_id', 1))
+
+    @instrumented()
+    def apply(self, operations):
+        """Run registry upserts, then remove the departments left without titles"""
+        self.collection.bulk_write(operations, ordered=False)
+        self.collection.delete_many(EMPTY_DEPARTMENTS)
+
+    @instrumented()
+    def replace(self, operations, names):
+        """Run registry upserts and remove every department not in names"""
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        self.collection.delete_many({'_id': {'$nin': list(names)}})
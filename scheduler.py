@@ -0,0 +1,226 @@
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+import os
+import random
+import signal
+import socket
+import threading
+import time
+
+import metrics
+
+# Collection holding one lease document per job
+LEASE_COLLECTION = 'job_leases'
+
+# The job currently running on each job thread, for check_lease
+current = threading.local()
+
+
+class LeaseLost(Exception):
+    """Raised by check_lease once another node may have taken over the running job"""
+
+
+def check_lease():
+    """Stop the running job if its lease was lost
+
+    Long jobs call this between batches. Outside a scheduled job it does nothing.
+    """
+    job = getattr(current, 'job', None)
+    if job is not None and job.lease_lost.is_set():
+        raise LeaseLost(f"Lease for job {job.name} was lost")
+
+
+class Job:
+    """A function run every `interval` seconds, with optional random jitter"""
+
+    def __init__(self, name, func, interval, jitter=0, lease_seconds=None):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        # How long a node may hold the lease while the job is running
+        self.lease_seconds = lease_seconds or max(interval, 300)
+        # Set by the heartbeat when the lease could not be renewed
+        self.lease_lost = threading.Event()
+        self.next_run = time.time() + random.uniform(0, jitter)
+        self.thread = None
+
+        # Outcome of the last run, recorded on the lease document
+        self.last_duration = None
+        self.last_error = None
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def schedule_next(self, started):
+        # Never schedule in the past, so a slow run is not followed by an immediate catch-up
+        self.next_run = max(started + self.interval, time.time()) + random.uniform(0, self.jitter)
+
+
+class Scheduler:
+    """Runs interval jobs, using lease documents so only one node runs each job at a time
+
+    Without a database every job simply runs locally on its interval.
+    """
+
+    def __init__(self, db=None, worker_id=None, tick=1.0):
+        self.leases = db[LEASE_COLLECTION] if db is not None else None
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.tick = tick
+        self.jobs = {}
+        self.stop_event = threading.Event()
+
+    def add_job(self, name, func, interval, jitter=0, lease_seconds=None):
+        job = Job(name, func, interval, jitter, lease_seconds)
+        self.jobs[name] = job
+        return job
+
+    def job(self, name, interval, jitter=0, lease_seconds=None):
+        """Decorator form of add_job"""
+        def decorator(func):
+            self.add_job(name, func, interval, jitter, lease_seconds)
+            return func
+        return decorator
+
+    def acquire_lease(self, job):
+        """Claim the job's lease; returns False if another node holds it"""
+        if self.leases is None:
+            return True
+        now = datetime.now()
+        try:
+            self.leases.find_one_and_update(
+                {'_id': job.name, 'expires_at': {'$lte': now}},
+                {'$set': {
+                    'owner': self.worker_id,
+                    'acquired_at': now,
+                    'expires_at': now + timedelta(seconds=job.lease_seconds)
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The lease document exists and has not expired
+            return False
+        return True
+
+    def renew_lease(self, job):
+        """Push the running job's lease expiry forward; returns False if this node no longer holds it"""
+        if self.leases is None:
+            return True
+        result = self.leases.update_one(
+            {'_id': job.name, 'owner': self.worker_id},
+            {'$set': {'expires_at': datetime.now() + timedelta(seconds=job.lease_seconds)}}
+        )
+        return result.matched_count == 1
+
+    def heartbeat(self, job, done):
+        """Renew the job's lease every third of lease_seconds until done is set
+
+        If the lease was taken over, or could not be renewed before it
+        expired, job.lease_lost is set so the job stops at its next check_lease.
+        """
+        expires = time.time() + job.lease_seconds
+        while not done.wait(job.lease_seconds / 3):
+            try:
+                if not self.renew_lease(job):
+                    print(f"Lease for job {job.name} was taken over, stopping the job")
+                    job.lease_lost.set()
+                    return
+                expires = time.time() + job.lease_seconds
+            except Exception as e:
+                print(f"Error renewing lease for job {job.name}: {str(e)}")
+                if time.time() >= expires:
+                    print(f"Lease for job {job.name} expired, stopping the job")
+                    job.lease_lost.set()
+                    return
+
+    def release_lease(self, job, started_at, status):
+        """Hold the lease until the next run so other nodes do not rerun the job early"""
+        if self.leases is None:
+            return
+        self.leases.update_one(
+            {'_id': job.name, 'owner': self.worker_id},
+            {'$set': {
+                'expires_at': datetime.fromtimestamp(job.next_run),
+                'last_status': status,
+                'last_started_at': started_at,
+                'last_finished_at': datetime.now(),
+                'last_duration_seconds': job.last_duration,
+                'last_error': job.last_error
+            }, '$inc': {'runs': 1}}
+        )
+
+    def run_job(self, job):
+        started = time.time()
+        started_at = datetime.now()
+        status = 'success'
+        job.lease_lost.clear()
+        current.job = job
+        done = threading.Event()
+        heartbeat = None
+        if self.leases is not None:
+            heartbeat = threading.Thread(target=self.heartbeat, args=(job, done),
+                                         name=f"lease-{job.name}", daemon=True)
+            heartbeat.start()
+        try:
+            job.func()
+            job.last_error = None
+        except LeaseLost as e:
+            status = 'lease_lost'
+            job.last_error = str(e)
+            print(f"Job {job.name} stopped: {str(e)}")
+        except Exception as e:
+            status = 'failed'
+            job.last_error = str(e)
+            print(f"Error in job {job.name}: {str(e)}")
+        finally:
+            done.set()
+            if heartbeat is not None:
+                heartbeat.join()
+            current.job = None
+            job.last_duration = round(time.time() - started, 3)
+            metrics.job_duration.observe(job.last_duration, job=job.name, status=status)
+            if status == 'success':
+                metrics.job_last_success.set(time.time(), job=job.name)
+            job.schedule_next(started)
+            try:
+                self.release_lease(job, started_at, status)
+            except Exception as e:
+                print(f"Error releasing lease for job {job.name}: {str(e)}")
+
+    def run_pending(self):
+        """Start every job that is due; a job is never started while its previous run is going"""
+        now = time.time()
+        for job in self.jobs.values():
+            if now < job.next_run or job.is_running():
+                continue
+            try:
+                acquired = self.acquire_lease(job)
+            except Exception as e:
+                print(f"Error acquiring lease for job {job.name}: {str(e)}")
+                acquired = False
+            if not acquired:
+                # Another node is running this job; check again shortly
+                job.next_run = now + min(job.interval, 30)
+                continue
+            # Not due again until this run finishes and reschedules it
+            job.next_run = float('inf')
+            job.thread = threading.Thread(target=self.run_job, args=(job,), name=f"job-{job.name}", daemon=True)
+            job.thread.start()
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+    def run_forever(self):
+        """Run jobs until stopped, then wait for running jobs to finish"""
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGINT, self.stop)
+            signal.signal(signal.SIGTERM, self.stop)
+
+        while not self.stop_event.is_set():
+            self.run_pending()
+            self.stop_event.wait(self.tick)
+
+        for job in self.jobs.values():
+            if job.is_running():
+                print(f"Waiting for job {job.name} to finish...")
+                job.thread.join()
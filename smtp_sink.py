@@ -0,0 +1,131 @@
+import argparse
+import socketserver
+import smtplib
+import threading
+import time
+
+from mail_queue import SMTPSession, build_message
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Speaks just enough SMTP to accept and discard messages"""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply('220 localhost SMTP sink ready')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            command = line.decode(errors='replace').strip().upper()
+
+            if command.startswith('EHLO'):
+                self.wfile.write(b'250-localhost\r\n250 AUTH PLAIN LOGIN\r\n')
+            elif command.startswith('HELO'):
+                self.reply('250 localhost')
+            elif command.startswith('AUTH'):
+                self.reply('235 Authentication successful')
+            elif command.startswith('DATA'):
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b'.\r\n', b'.\n'):
+                        break
+                self.server.record_message()
+                self.reply('250 OK: queued')
+            elif command.startswith('QUIT'):
+                self.reply('221 Bye')
+                break
+            else:
+                # MAIL, RCPT, RSET, NOOP and anything else
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Local stand-in SMTP server that counts the messages it receives"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host='127.0.0.1', port=1025):
+        super().__init__((host, port), SMTPSinkHandler)
+        self.lock = threading.Lock()
+        self.message_count = 0
+        self.connection_count = 0
+
+    def verify_request(self, request, client_address):
+        with self.lock:
+            self.connection_count += 1
+        return True
+
+    def record_message(self):
+        with self.lock:
+            self.message_count += 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='smtp-sink', daemon=True)
+        thread.start()
+        return thread
+
+
+def send_with_new_connection(host, port, count):
+    """The old send_email behaviour: one SMTP connection per message"""
+    for i in range(count):
+        server = smtplib.SMTP(host, port)
+        server.send_message(build_message('Benchmark', '<p>Hello</p>', f'user{i}@example.com', 'library@example.com'))
+        server.quit()
+
+
+def send_with_session(host, port, count):
+    """Send every message over one reusable SMTPSession"""
+    with SMTPSession(host, port, use_tls=False) as session:
+        for i in range(count):
+            session.send('Benchmark', '<p>Hello</p>', f'user{i}@example.com')
+
+
+def benchmark(count=500, host='127.0.0.1', port=1025):
+    """Compare per-message connections against a persistent session"""
+    sink = SMTPSink(host, port)
+    sink.start()
+    results = {}
+    try:
+        for name, sender in (('new_connection', send_with_new_connection), ('session', send_with_session)):
+            start = time.perf_counter()
+            sender(host, port, count)
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                'messages': count,
+                'seconds': round(elapsed, 3),
+                'messages_per_second': round(count / elapsed, 1),
+                'avg_latency_ms': round(elapsed / count * 1000, 3)
+            }
+    finally:
+        sink.shutdown()
+        sink.server_close()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local SMTP sink for development and benchmarks')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1025)
+    parser.add_argument('--bench', type=int, metavar='COUNT', help='run a send benchmark with COUNT messages and exit')
+    args = parser.parse_args()
+
+    if args.bench:
+        for name, result in benchmark(args.bench, args.host, args.port).items():
+            print(f"{name}: {result['messages_per_second']} msg/s, {result['avg_latency_ms']} ms/msg")
+    else:
+        sink = SMTPSink(args.host, args.port)
+        print(f"SMTP sink listening on {args.host}:{args.port}")
+        print("Press Ctrl+C to stop the sink")
+        sink.start()
+        try:
+            while True:
+                time.sleep(10)
+                print(f"Received {sink.message_count} messages over {sink.connection_count} connections")
+        except KeyboardInterrupt:
+            print("\nStopping the SMTP sink...")
+            sink.shutdown()
@@ -0,0 +1,101 @@
+from datetime import datetime
+import os
+import threading
+import time
+
+from repositories import UserRepository, BookRepository, LoanRepository, StatsRepository, STATS_ID
+
+# Roles counted in users_by_role; users with any other role are rejected before they are written
+ROLES = ('user', 'staff', 'admin')
+
+# Seconds a worker may serve counters from memory before re-reading them
+CACHE_TTL = float(os.getenv('STATS_CACHE_TTL', '30'))
+
+cache = {'stats': None, 'loaded_at': 0.0}
+cache_lock = threading.Lock()
+
+
+def invalidate_cache():
+    with cache_lock:
+        cache['stats'] = None
+
+
+def increment(db, counters, session=None):
+    """Apply deltas to the library counters, e.g. {'books_total': 1}
+
+    Nothing is written until the counters exist; get_stats builds them from
+    scratch on first use, which already includes this change.
+    """
+    StatsRepository(db).increment({'$inc': counters, '$set': {'updated_at': datetime.now()}}, session)
+    invalidate_cache()
+
+
+def user_added(db, role, count=1):
+    increment(db, {'users_total': count, f'users_by_role.{role}': count})
+
+
+def user_removed(db, role):
+    increment(db, {'users_total': -1, f'users_by_role.{role}': -1})
+
+
+def user_role_changed(db, old_role, new_role):
+    if old_role != new_role:
+        increment(db, {f'users_by_role.{old_role}': -1, f'users_by_role.{new_role}': 1})
+
+
+def book_added(db, count=1):
+    increment(db, {'books_total': count})
+
+
+def book_removed(db, count=1):
+    increment(db, {'books_total': -count})
+
+
+def get_stats(db):
+    """Library counters, served from memory for up to CACHE_TTL seconds"""
+    with cache_lock:
+        if cache['stats'] is not None and time.monotonic() - cache['loaded_at'] < CACHE_TTL:
+            return cache['stats']
+
+    stats = StatsRepository(db).load()
+    if stats is None:
+        # First use on this database: build the counters from scratch
+        stats = rebuild_stats(db)
+
+    with cache_lock:
+        cache['stats'] = stats
+        cache['loaded_at'] = time.monotonic()
+    return stats
+
+
+def rebuild_stats(db):
+    """Recompute every counter from the collections; repairs any drift in the incremental counts"""
+    users = UserRepository(db)
+    active_loans = LoanRepository(db).active_counts_by_user()
+
+    stats = {
+        '_id': STATS_ID,
+        'users_total': users.count(),
+        'users_by_role': users.role_counts(),
+        'books_total': BookRepository(db).count(),
+        'copies_on_loan': sum(active_loans.values()),
+        'updated_at': datetime.now(),
+        'rebuilt_at': datetime.now()
+    }
+    StatsRepository(db).save(stats)
+
+    # Per-user active loan counts live on the user documents
+    users.set_active_loans(active_loans)
+
+    invalidate_cache()
+    return stats
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    from database import get_db
+    stats = rebuild_stats(get_db())
+    print(f"Rebuilt library counters: {stats['users_total']} users, {stats['books_total']} books, "
+          f"{stats['copies_on_loan']} copies on loan")
@@ -0,0 +1,167 @@
+import os
+import shutil
+import threading
+import time
+
+# Content-addressed objects never change, so browsers and CDNs may cache them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+CHUNK_SIZE = 64 * 1024
+# Part size used for multipart S3 uploads
+MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+class LocalStorage:
+    """Objects stored as files below a directory that is served as /static"""
+
+    def __init__(self, root, url_prefix='/static'):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip('/')
+
+    def path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f"Invalid storage key: {key}")
+        return path
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def save(self, key, stream, content_type=None):
+        """Copy a file object to key in chunks; the file appears atomically once complete"""
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def open(self, key):
+        return open(self.path(key), 'rb')
+
+    def delete(self, key):
+        path = self.path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def list_keys(self, prefix):
+        """Keys of the files directly below the prefix directory"""
+        directory = self.path(prefix)
+        if not os.path.isdir(directory):
+            return []
+        return [f"{prefix.rstrip('/')}/{name}" for name in os.listdir(directory)
+                if os.path.isfile(os.path.join(directory, name)) and not name.endswith('.tmp')]
+
+    def size(self, key):
+        return os.path.getsize(self.path(key))
+
+    def url(self, key):
+        return f"{self.url_prefix}/{key}"
+
+    def url_window(self):
+        """Period a page's cover URLs belong to; local URLs never expire"""
+        return None
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket (AWS S3, MinIO, or moto for local testing)
+
+    Browsers fetch images straight from the bucket, through S3_PUBLIC_URL
+    (a public bucket or CDN) or through pre-signed URLs, so image bytes never
+    pass through the Flask workers.
+    """
+
+    def __init__(self, bucket, endpoint_url=None, region=None, public_url=None, url_expiry=3600):
+        # Imported here so boto3 is only needed when the S3 backend is used
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(multipart_chunksize=MULTIPART_CHUNK_SIZE,
+                                              multipart_threshold=MULTIPART_CHUNK_SIZE)
+        self.public_url = public_url.rstrip('/') if public_url else None
+        self.url_expiry = url_expiry
+        # Pre-signed URLs are reused for half their lifetime so pages stay cacheable
+        self.signed_urls = {}
+        self.signed_urls_lock = threading.Lock()
+
+    def exists(self, key):
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return False
+            raise
+        return True
+
+    def save(self, key, stream, content_type=None):
+        """Stream a file object to the bucket, using a multipart upload for large files"""
+        extra_args = {'CacheControl': IMMUTABLE_CACHE_CONTROL}
+        if content_type:
+            extra_args['ContentType'] = content_type
+        self.client.upload_fileobj(stream, self.bucket, key, ExtraArgs=extra_args, Config=self.transfer_config)
+
+    def open(self, key):
+        return self.client.get_object(Bucket=self.bucket, Key=key)['Body']
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def list_keys(self, prefix):
+        """Keys directly below prefix (not in deeper "directories")"""
+        prefix = prefix.rstrip('/') + '/'
+        keys = []
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter='/'):
+            keys.extend(item['Key'] for item in page.get('Contents', []))
+        return keys
+
+    def size(self, key):
+        return self.client.head_object(Bucket=self.bucket, Key=key)['ContentLength']
+
+    def url_window(self):
+        """Period a page's cover URLs belong to
+
+        A signed URL is reused for half its lifetime, so a page rendered within
+        one half-lifetime window keeps working links until the window ends.
+        """
+        if self.public_url:
+            return None
+        return int(time.time() // (self.url_expiry / 2))
+
+    def url(self, key):
+        if self.public_url:
+            return f"{self.public_url}/{key}"
+        now = time.time()
+        with self.signed_urls_lock:
+            cached = self.signed_urls.get(key)
+            if cached and cached[1] > now:
+                return cached[0]
+        url = self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=self.url_expiry
+        )
+        with self.signed_urls_lock:
+            self.signed_urls[key] = (url, now + self.url_expiry / 2)
+        return url
+
+
+def get_storage(static_folder='static'):
+    """Build the storage backend selected by STORAGE_BACKEND (local or s3)"""
+    backend = os.getenv('STORAGE_BACKEND', 'local').lower()
+    if backend == 's3':
+        return S3Storage(
+            os.getenv('S3_BUCKET'),
+            endpoint_url=os.getenv('S3_ENDPOINT_URL') or None,
+            region=os.getenv('S3_REGION') or None,
+            public_url=os.getenv('S3_PUBLIC_URL') or None,
+            url_expiry=int(os.getenv('S3_URL_EXPIRY', '3600'))
+        )
+    return LocalStorage(static_folder)
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import ServerSelectionTimeoutError
+
+# The modules under test live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def client():
+    """MongoDB at MONGODB_URI; the tests are skipped when it is not reachable"""
+    client = MongoClient(os.getenv('MONGODB_URI', 'mongodb://localhost:27017/'), serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command('ping')
+    except ServerSelectionTimeoutError:
+        pytest.skip('MongoDB is not reachable at MONGODB_URI')
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def db(client):
+    """A scratch database, dropped after the test"""
+    name = f"library_test_{os.getpid()}"
+    client.drop_database(name)
+    yield client[name]
+    client.drop_database(name)
@@ -0,0 +1,63 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import threading
+
+import pytest
+
+from circulation import lend_book, CirculationError
+
+COPIES = 5
+ATTEMPTS = 100
+
+
+@pytest.fixture
+def book_id(db):
+    return str(db.books.insert_one({
+        'title': 'Concurrency', 'author': 'Load', 'isbn': '000', 'department': 'CSE',
+        'book_count': COPIES, 'borrowed_count': 0, 'available_copies': COPIES
+    }).inserted_id)
+
+
+def test_concurrent_lends_never_over_lend(db, book_id):
+    db.users.insert_many([{'userId': f'u{i}', 'name': f'User {i}', 'email': f'u{i}@example.com'}
+                          for i in range(ATTEMPTS)])
+
+    # Sample the shelf count while the lends run
+    lowest = [COPIES]
+    done = threading.Event()
+
+    def watch():
+        while not done.is_set():
+            book = db.books.find_one({}, {'available_copies': 1})
+            lowest[0] = min(lowest[0], book['available_copies'])
+
+    def attempt(i):
+        try:
+            lend_book(db, book_id, f'u{i}', datetime.now() + timedelta(days=14))
+            return True
+        except CirculationError:
+            return False
+
+    watcher = threading.Thread(target=watch)
+    watcher.start()
+    try:
+        with ThreadPoolExecutor(max_workers=25) as executor:
+            outcomes = list(executor.map(attempt, range(ATTEMPTS)))
+    finally:
+        done.set()
+        watcher.join()
+
+    book = db.books.find_one({})
+    assert sum(outcomes) == COPIES
+    assert db.borrowed_books.count_documents({'book_id': book_id}) == COPIES
+    assert book['available_copies'] == 0
+    assert book['borrowed_count'] == COPIES
+    assert lowest[0] >= 0
+
+
+def test_unknown_user_does_not_take_a_copy(db, book_id):
+    with pytest.raises(CirculationError, match="User not found"):
+        lend_book(db, book_id, 'nobody', datetime.now() + timedelta(days=14))
+
+    assert db.books.find_one({})['available_copies'] == COPIES
+    assert db.borrowed_books.count_documents({}) == 0
@@ -0,0 +1,12 @@
+from datagen import generate
+from loan_archive import archive_returned_loans
+from migrations import check_query_plans
+
+
+def test_hot_queries_use_an_index_without_sorting_in_memory(db):
+    # Enough data that the planner's choice between indexes is a real one
+    generate(db, books=2000, users=500, loans=20000)
+    archive_returned_loans(db)
+
+    regressions = [(description, stages) for description, stages, uses_index in check_query_plans(db) if not uses_index]
+    assert regressions == []
@@ -0,0 +1,177 @@
+from pymongo.errors import BulkWriteError
+import csv
+import io
+import os
+import random
+import string
+import time
+
+from repositories import UserRepository
+import stats
+
+# Roster rows inserted per insert_many
+CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '1000'))
+# Per-row problems kept in the summary; the rest are only counted
+MAX_REPORTED_ERRORS = 100
+
+REQUIRED_FIELDS = ['userId', 'name', 'email', 'role']
+
+
+def generate_password(length=8):
+    """Generate a random password with letters, numbers, and special characters"""
+    characters = string.ascii_letters + string.digits + string.punctuation
+    return ''.join(random.choice(characters) for _ in range(length))
+
+
+def credentials_email(user_data, password):
+    """Subject and body of the welcome email carrying a new user's credentials"""
+    subject = "Your Library Management System Account"
+    body = f"""
+    <h2>Welcome to Library Management System</h2>
+    <p>Dear {user_data['name']},</p>
+    <p>Your account has been created successfully. Here are your login credentials:</p>
+    <ul>
+        <li><strong>User ID:</strong> {user_data['userId']}</li>
+        <li><strong>Password:</strong> {password}</li>
+    </ul>
+    <p>Please change your password after your first login for security purposes.</p>
+    <p>Best regards,<br>Library Management System Team</p>
+    """
+    return subject, body
+
+
+def read_roster(stream):
+    """Yield (line number, row) from a binary CSV roster with userId, name, email and role columns"""
+    reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+    columns = {field.lower(): field for field in REQUIRED_FIELDS}
+    for row in reader:
+        # Header names are matched case-insensitively, so "userid" and "UserId" both work
+        yield reader.line_num, {columns.get((key or '').strip().lower(), key): (value or '').strip()
+                                for key, value in row.items()}
+
+
+def validate_row(row):
+    """Clean one roster row; returns (user, error message)"""
+    user = {field: row.get(field, '') for field in REQUIRED_FIELDS}
+    for field in REQUIRED_FIELDS:
+        if not user[field]:
+            return None, f"Missing required field: {field}"
+    user['role'] = user['role'].lower()
+    if '@' not in user['email']:
+        return None, "Invalid email address"
+    if user['role'] not in stats.ROLES:
+        return None, f"Unknown role: {user['role']}"
+    return user, None
+
+
+def import_users(db, stream, mail_queue, chunk_size=CHUNK_SIZE):
+    """Create accounts for every row of a CSV roster
+
+    Each chunk is checked against existing users with one $in query, inserted
+    with insert_many, and its credential emails are queued in one batch for
+    the mail worker. Returns a summary with created/skipped/failed counts and
+    throughput.
+    """
+    start = time.perf_counter()
+    users = UserRepository(db)
+    summary = {
+        'rows': 0,
+        'created': 0,
+        'skipped': 0,
+        'failed': 0,
+        'emails_queued': 0,
+        'errors': []
+    }
+    seen_ids = set()
+    seen_emails = set()
+
+    def record(outcome, line_number, message):
+        summary[outcome] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({'line': line_number, 'outcome': outcome, 'error': message})
+
+    def flush(chunk):
+        taken_ids, taken_emails = users.taken([user['userId'] for _, user in chunk], [user['email'] for _, user in chunk])
+
+        new_users = []
+        for line_number, user in chunk:
+            if user['userId'] in taken_ids:
+                record('skipped', line_number, f"User ID already exists: {user['userId']}")
+            elif user['email'] in taken_emails:
+                record('skipped', line_number, f"Email already exists: {user['email']}")
+            else:
+                new_users.append((line_number, user, generate_password()))
+        if not new_users:
+            return
+
+        documents = [dict(user, password=password) for _, user, password in new_users]
+        failed = {}
+        try:
+            users.create_many(documents)
+        except BulkWriteError as e:
+            # Accounts created by someone else since the $in check hit the unique indexes (code 11000)
+            failed = {error['index']: error for error in e.details['writeErrors']}
+
+        roles = {}
+        messages = []
+        for index, (line_number, user, password) in enumerate(new_users):
+            if index in failed:
+                if failed[index].get('code') == 11000:
+                    record('skipped', line_number, "User ID or email already exists")
+                else:
+                    record('failed', line_number, failed[index].get('errmsg', 'Insert failed'))
+                continue
+            summary['created'] += 1
+            roles[user['role']] = roles.get(user['role'], 0) + 1
+            messages.append((*credentials_email(user, password), user['email']))
+        for role, count in roles.items():
+            stats.user_added(db, role, count)
+        summary['emails_queued'] += mail_queue.enqueue_many(messages)
+
+    chunk = []
+    for line_number, row in read_roster(stream):
+        summary['rows'] += 1
+        user, error = validate_row(row)
+        if error:
+            record('failed', line_number, error)
+            continue
+        # Duplicates within the roster itself
+        if user['userId'] in seen_ids or user['email'] in seen_emails:
+            record('skipped', line_number, "Duplicate row in roster")
+            continue
+        seen_ids.add(user['userId'])
+        seen_emails.add(user['email'])
+        chunk.append((line_number, user))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+
+    summary['duration_seconds'] = round(time.perf_counter() - start, 3)
+    summary['rows_per_second'] = round(summary['rows'] / summary['duration_seconds'], 1) if summary['duration_seconds'] else None
+    return summary
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from mail_queue import MailQueue, OUTBOX_COLLECTION
+
+    parser = argparse.ArgumentParser(description='Create user accounts from a CSV roster')
+    parser.add_argument('file', help='CSV with userId,name,email,role columns')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    from database import get_db
+    db = get_db()
+
+    with open(args.file, 'rb') as stream:
+        summary = import_users(db, stream, MailQueue(db[OUTBOX_COLLECTION]), args.chunk_size)
+
+    print(f"Processed {summary['rows']} rows in {summary['duration_seconds']}s ({summary['rows_per_second']} rows/s): "
+          f"{summary['created']} created, {summary['skipped']} skipped, {summary['failed']} failed, "
+          f"{summary['emails_queued']} credential emails queued")
+    for error in summary['errors']:
+        print(f"Line {error['line']} ({error['outcome']}): {error['error']}")
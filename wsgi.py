@@ -0,0 +1,5 @@
+from app import create_app
+
+# Entry point for WSGI servers: gunicorn -c gunicorn.conf.py wsgi:app
+# Background workers are started per process by gunicorn.conf.py after fork.
+app = create_app(start_workers=False)